@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import concurrent.futures
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson.objectid import ObjectId
+
+from geomatch import geomatch as gm
+from geomatch import haversine as hv
+from geomatch import mongo as m
+from geomatch import parallel as par
+from geomatch import spatial, stream, testing
+
+SIDEREAL_DAY = 86_164  # [s]
+STARTUP_COMMANDS = (("--version",), ("--help",), ("match", "--help"))
+KERNEL_CALL = (
+    "import numpy as np; from geomatch import haversine as hv; "
+    "x = np.zeros(4); t = np.zeros(4, np.int64); "
+    "hv.haversine_batch(x, x, t, x, x, t, 1.0, 1)"
+)
+ENGINE_NAMES = (
+    *par.ENGINES,
+    "thread+grid",
+    "sweep+grid",
+    "stream",
+    "mongo-thread",
+    "mongo-bounded",
+    "mongo-batch",
+)
+
+
+def synthetic_documents(
+    n,
+    start=datetime(2023, 6, 1),
+    span=timedelta(days=1),
+    period_min=101.0,
+    inclination=98.7,
+    swath_km=1_000,
+    seed=0,
+):
+    """Create documents along a polar orbit ground track.
+
+    `n` points are spread over `span` (density), randomly across a swath
+    of `swath_km` around the ground track of an orbit with the given
+    period and inclination, similar to TROPOMI and IASI.
+    """
+    rng = np.random.default_rng(seed)
+    seconds = np.sort(rng.uniform(0, span.total_seconds(), n))
+    u = 2 * np.pi * seconds / (period_min * 60) + rng.uniform(0, 2 * np.pi)
+    i = np.radians(inclination)
+    lats = np.degrees(np.arcsin(np.sin(i) * np.sin(u)))
+    lons = np.degrees(np.arctan2(np.cos(i) * np.sin(u), np.cos(u)))
+    lons += rng.uniform(-180, 180) - 360 * seconds / SIDEREAL_DAY
+
+    # polar orbits scan roughly east-west across the track
+    offset = np.degrees(rng.uniform(-0.5, 0.5, n) * swath_km / hv.R)
+    lons += offset / np.maximum(np.cos(np.radians(lats)), 0.1)
+    lons = (lons + 180) % 360 - 180
+    return [
+        dict(
+            _id=ObjectId(),
+            id=k,
+            time=start + timedelta(seconds=float(s)),
+            loc=dict(type="Point", coordinates=[float(lon), float(lat)]),
+        )
+        for k, (s, lat, lon) in enumerate(zip(seconds, lats, lons))
+    ]
+
+
+def match_sets(result):
+    """Return the matches of a result as {source_id: frozenset(ids)}."""
+    return {k: frozenset(v) for x in result["matches"] for k, v in x.items()}
+
+
+def _stream(client, source, searchspace, distance_km, delta):
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "matches.json")
+        stream.parallel_stream(client, source, searchspace, distance_km, delta, output)
+        with open(output) as f:
+            return json.load(f)
+
+
+def engines(client, source_name="TROPOMI", searchspace="IASI"):
+    """Return all engines (see `ENGINE_NAMES`) as functions of (distance_km, delta)."""
+    source = gm.get_collection(client, source_name, cache=False)
+    candidates = gm.get_collection(client, searchspace, cache=False)
+    # MongoDB measures the radius as angle of distance_km / EARTH_RADIUS_KM
+    mongo_km = m.EARTH_RADIUS_KM / hv.R
+
+    def grid(engine):
+        def run(distance_km, delta):
+            index = spatial.GridIndex.from_frame(candidates)
+            return engine(source, candidates, distance_km, delta, index=index)
+
+        return run
+
+    def frame(engine):
+        return lambda distance_km, delta: engine(source, candidates, distance_km, delta)
+
+    def mongo(engine):
+        return lambda distance_km, delta: engine(
+            client, source, distance_km * mongo_km, delta, searchspace
+        )
+
+    result = {name: frame(engine) for name, engine in par.ENGINES.items()}
+    result["thread+grid"] = grid(par.parallel_thread)
+    result["sweep+grid"] = grid(par.parallel_sweep)
+    result["stream"] = lambda distance_km, delta: _stream(
+        client, source_name, searchspace, distance_km, delta
+    )
+    result["mongo-thread"] = mongo(m.parallel_mongo)
+    result["mongo-bounded"] = mongo(m.bounded_mongo)
+    result["mongo-batch"] = mongo(m.batch_mongo)
+    return result, source.index.size
+
+
+def _max_rss_mb(who=resource.RUSAGE_SELF):
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _run_engine(tropomi, iasi, name, settings, repeat):
+    """Time one engine for all settings, run in a fresh process.
+
+    Returns the match sets and latencies per setting and the peak RSS of
+    the process before (`base`) and after the runs as well as the largest
+    peak RSS of its child processes, e.g. the workers of `par.parallel_shared`.
+    """
+    runs, _ = engines(testing.memory_client(tropomi, iasi))
+    memory = dict(base_rss_mb=_max_rss_mb())
+    results = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for distance_km, delta in settings:
+            latencies = []
+            for _ in range(repeat):
+                tic = time.perf_counter()
+                result = runs[name](distance_km, delta)
+                latencies.append(time.perf_counter() - tic)
+            results.append((match_sets(result), latencies))
+    memory.update(
+        peak_rss_mb=_max_rss_mb(),
+        children_peak_rss_mb=_max_rss_mb(resource.RUSAGE_CHILDREN),
+    )
+    return results, memory
+
+
+def run_benchmark(tropomi, iasi, settings, names=None, repeat=3, reference="batch"):
+    """Run the engines for all (distance_km, delta) settings.
+
+    Every engine runs in its own spawned process, so its peak RSS includes
+    compiled code and worker processes. The match sets of every engine are
+    compared with the ones of the reference engine. Returns a json
+    serialisable report with throughput (centers/s), latency percentiles
+    per run and the peak RSS per engine.
+    """
+    runs, n = engines(testing.memory_client(tropomi, iasi))
+    names = list(ENGINE_NAMES) if not names else list(names)
+    report = dict(
+        sources=n,
+        candidates=len(iasi),
+        repeat=repeat,
+        reference=reference,
+        settings=[],
+        memory={},
+    )
+    for distance_km, delta in settings:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            expected = match_sets(runs[reference](distance_km, delta))
+        report["settings"].append(
+            dict(
+                distance_km=distance_km,
+                delta_min=delta.total_seconds() / 60,
+                pairs=sum(len(x) for x in expected.values()),
+                expected=expected,
+                engines={},
+            )
+        )
+
+    for name in names:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            future = executor.submit(_run_engine, tropomi, iasi, name, settings, repeat)
+            results, report["memory"][name] = future.result()
+        for entry, (found, latencies) in zip(report["settings"], results):
+            entry["engines"][name] = dict(
+                identical=found == entry["expected"],
+                throughput=n / np.median(latencies),
+                latency_s={
+                    f"p{q}": float(np.percentile(latencies, q)) for q in (50, 90, 99)
+                },
+            )
+        print(f"Benchmarked {name}")
+    for entry in report["settings"]:
+        del entry["expected"]
+    return report
+
+
+def _timed_run(args, env=None):
+    tic = time.perf_counter()
+    subprocess.run(args, env=env, check=True, capture_output=True)
+    return time.perf_counter() - tic
+
+
+def startup(repeat=3):
+    """Return the wall time [s] of fresh interpreters running the cli.
+
+    Each command of `STARTUP_COMMANDS` is timed (best of `repeat`) and the
+    first call of a numba kernel with an empty cache (compiling) and again
+    with the cache written by the first run (loading).
+    """
+    cli = "from geomatch.cli import main; main()"
+    report = dict(
+        python=min(_timed_run([sys.executable, "-c", ""]) for _ in range(repeat))
+    )
+    for args in STARTUP_COMMANDS:
+        report[" ".join(args)] = min(
+            _timed_run([sys.executable, "-c", cli, *args]) for _ in range(repeat)
+        )
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, NUMBA_CACHE_DIR=tmp)
+        kernel = [sys.executable, "-c", KERNEL_CALL]
+        report["kernel (cold)"] = _timed_run(kernel, env)
+        report["kernel (cached)"] = min(_timed_run(kernel, env) for _ in range(repeat))
+    return report
+
+
+def main(
+    sources,
+    candidates,
+    span,
+    settings,
+    names=None,
+    repeat=3,
+    output=None,
+    seed=0,
+):
+    """Benchmark all engines on synthetic TROPOMI/IASI like tracks."""
+    print("Generating data")
+    tropomi = synthetic_documents(sources, span=span, period_min=100.9, seed=seed)
+    iasi = synthetic_documents(candidates, span=span, period_min=101.4, seed=seed + 1)
+    report = run_benchmark(tropomi, iasi, settings, names, repeat)
+    if output is not None:
+        gm.to_json(output, report)
+    else:
+        print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    settings = [(20.0, timedelta(minutes=120)), (160.934, timedelta(hours=6))]
+    main(2_000, 8_000, timedelta(days=1), settings)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from bson.objectid import ObjectId
+from pandas import DataFrame, DatetimeIndex
+from pandas.api import extensions
+
+from geomatch import geomatch as gm
+
+COLLECTIONS = ("TROPOMI", "IASI")
+
+
+@extensions.register_extension_dtype
+class ObjectIdDtype(extensions.ExtensionDtype):
+    """Pandas dtype of `ObjectIdArray`."""
+
+    name = "objectid"
+    type = ObjectId
+    na_value = None
+
+    @classmethod
+    def construct_array_type(cls):
+        return ObjectIdArray
+
+
+class ObjectIdArray(extensions.ExtensionArray):
+    """ObjectIds backed by a (n, 12) uint8 array.
+
+    The raw bytes (e.g. a memory mapped cache column) are used as they are,
+    an ObjectId is only created for an element that is accessed.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    @classmethod
+    def _from_sequence(cls, scalars, dtype=None, copy=False):
+        raw = b"".join(ObjectId(x).binary for x in scalars)
+        return cls(np.frombuffer(raw, dtype=np.uint8).reshape(-1, 12))
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls._from_sequence(values)
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        return cls(np.concatenate([x.raw for x in to_concat]))
+
+    @property
+    def dtype(self):
+        return ObjectIdDtype()
+
+    @property
+    def nbytes(self):
+        return self.raw.nbytes
+
+    def __len__(self):
+        return self.raw.shape[0]
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return ObjectId(self.raw[item].tobytes())
+        if isinstance(item, tuple) and len(item) == 1:
+            item = item[0]
+        return type(self)(self.raw[item])
+
+    def __iter__(self):
+        for row in self.raw:
+            yield ObjectId(row.tobytes())
+
+    def __eq__(self, other):
+        return np.asarray(self, dtype=object) == other
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(list(self), dtype=object)
+
+    def isna(self):
+        return np.zeros(len(self), dtype=bool)
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        if allow_fill and np.any(np.asarray(indices) < 0):
+            raise ValueError("ObjectIdArray does not support missing values.")
+        return type(self)(extensions.take(self.raw, indices, axis=0))
+
+    def copy(self):
+        return type(self)(self.raw.copy())
+
+
+def cache_dir():
+    """Return the cache directory (env GEOMATCH_CACHE_DIR)."""
+    default = os.path.join(os.path.expanduser("~"), ".cache", "geomatch")
+    return os.getenv("GEOMATCH_CACHE_DIR", default)
+
+
+def _path(name, *parts):
+    return os.path.join(cache_dir(), name, *parts)
+
+
+def fingerprint(client, name):
+    """Return document count and maximum _id of a collection."""
+    collection = client[name].v0
+    last = collection.find_one(sort=[("_id", -1)], projection={"_id": 1})
+    return dict(
+        count=collection.estimated_document_count(),
+        max_id=None if last is None else str(last["_id"]),
+    )
+
+
+def read_meta(name):
+    """Return the metadata of a cached collection or None if not cached."""
+    try:
+        with open(_path(name, "meta.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def is_valid(client, name):
+    """Check if the cache of a collection matches the collection in MongoDB."""
+    meta = read_meta(name)
+    if meta is None:
+        return False
+    return {k: meta[k] for k in ("count", "max_id")} == fingerprint(client, name)
+
+
+def save(name, frame, meta):
+    """Save a frame (see `gm._query_result_to_gdb`) as columnar .npy files."""
+    tmp = _path(name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    ids = frame["id"].values
+    if ids.dtype == object:
+        ids = ids.astype(str)
+    oids = frame["_id"].values
+    if isinstance(oids, ObjectIdArray):
+        oids = oids.raw
+    else:
+        oids = b"".join(x.binary for x in oids)
+        oids = np.frombuffer(oids, dtype=np.uint8).reshape(-1, 12)
+    columns = dict(
+        time=frame.index.values.astype("datetime64[ns]").view("int64"),
+        lat=frame["lat"].values.astype(np.float64),
+        lon=frame["lon"].values.astype(np.float64),
+        id=ids,
+        oid=oids,
+    )
+    for column, values in columns.items():
+        np.save(os.path.join(tmp, f"{column}.npy"), values)
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(dict(meta, created=time.time()), f)
+    shutil.rmtree(_path(name), ignore_errors=True)
+    os.replace(tmp, _path(name))
+
+
+def load_columns(name):
+    """Memory map the cached columns of a collection."""
+    columns = ("time", "lat", "lon", "id", "oid")
+    return {x: np.load(_path(name, f"{x}.npy"), mmap_mode="r") for x in columns}
+
+
+def load(name):
+    """Load a cached collection as frame (see `gm._query_result_to_gdb`).
+
+    The numeric columns are used directly from the memory mapped files and
+    `_id` is an `ObjectIdArray` over the mapped bytes, nothing is copied.
+    """
+    columns = {k: np.asarray(v) for k, v in load_columns(name).items()}
+    if columns["time"].size == 0:
+        return None
+    index = DatetimeIndex(columns["time"].view("datetime64[ns]"), name="time")
+    df = DataFrame(
+        dict(
+            id=columns["id"],
+            _id=ObjectIdArray(columns["oid"]),
+            lat=columns["lat"],
+            lon=columns["lon"],
+            timestamp=index.values,
+        ),
+        index=index,
+        copy=False,
+    )
+    if df["id"].dtype.kind == "U":
+        df["id"] = df["id"].astype(object)
+    return df
+
+
+def build(client, name):
+    """Snapshot a MongoDB collection into the cache."""
+    meta = fingerprint(client, name)
+    frame = gm.get_collection(client, name, cache=False)
+    if frame is None:
+        frame = DataFrame(
+            dict(id=[], _id=[], lat=[], lon=[], timestamp=[]),
+            index=DatetimeIndex([], name="time"),
+        )
+    save(name, frame, meta)
+    return meta
+
+
+def clear(name):
+    """Remove a collection from the cache."""
+    shutil.rmtree(_path(name), ignore_errors=True)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson.objectid import ObjectId
+
+from geomatch import cache as lc
+from geomatch import geomatch as gm
+from geomatch import metrics
+from geomatch import parallel as par
+
+
+def checkpoint_path(output):
+    """Return the path of the checkpoint stored alongside the output."""
+    return f"{output}.checkpoint.json"
+
+
+def read(output):
+    """Return the checkpoint of an output file or None."""
+    try:
+        with open(checkpoint_path(output)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write(output, state):
+    """Atomically replace the checkpoint of an output file."""
+    tmp = checkpoint_path(output) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, checkpoint_path(output))
+
+
+def restore(output, size):
+    """Restore the output to its checkpointed state of `size` bytes.
+
+    Appending (see `gm.MatchWriter`) first removes the closing `]}`, so an
+    interrupted run leaves the output up to two bytes shorter or with
+    partial matches at its end.
+    """
+    with open(output, "r+b") as f:
+        if f.seek(0, os.SEEK_END) < size - 2:
+            raise ValueError(f"{output} is shorter than its checkpoint")
+        f.truncate(size - 2)
+        f.seek(size - 2)
+        f.write(b"]}")
+
+
+def unprocessed_query(state):
+    """Query the sources of the pending run which are not processed yet.
+
+    All sources with `_id <= done_id` are processed. A pending run covers
+    the sources with `done_id < _id <= upto_id` in time order, all of them
+    up to `last_time` are processed already.
+    """
+    ids = {"$lte": ObjectId(state["upto_id"])}
+    if state["done_id"] is not None:
+        ids["$gt"] = ObjectId(state["done_id"])
+    query = {"_id": ids}
+    if state["last_time"] is not None:
+        query["time"] = {"$gt": datetime.fromisoformat(state["last_time"])}
+    return query
+
+
+def _chunk_ends(times, rows):
+    """Split time sorted rows in chunks, never splitting equal timestamps."""
+    start = 0
+    while start < times.size:
+        stop = min(start + rows, times.size)
+        stop = np.searchsorted(times, times[stop - 1], side="right")
+        yield start, stop
+        start = stop
+
+
+def parallel_resumable(
+    client,
+    source_name,
+    searchspace,
+    distance_km,
+    delta,
+    percentage,
+    output,
+    engine="batch",
+    rows=10_000,
+):
+    """Return the number of matched sources, resuming from a checkpoint.
+
+    Only the sources not covered by the checkpoint of the output are
+    processed (the percentage applies to those). After every chunk of
+    rows the matches are appended to the output and the checkpoint is
+    updated, so an interrupted run continues where it stopped.
+
+    Sources are never processed twice: candidates added to the search
+    space after a source was processed are not matched with it. In this
+    case a warning is printed and only a new run covers them.
+    """
+    params = dict(
+        distance_km=distance_km,
+        delta_min=delta.total_seconds() / 60,
+        source=source_name,
+        searchspace=searchspace,
+    )
+    candidates_state = lc.fingerprint(client, searchspace)
+    state = read(output)
+    if state is not None and not os.path.exists(output):
+        print(f"{output} is missing, starting a new run")
+        state = None
+    append = state is not None
+    if state is None:
+        state = dict(
+            params=params,
+            candidates=candidates_state,
+            done_id=None,
+            upto_id=None,
+            last_time=None,
+        )
+    elif state["params"] != params:
+        raise ValueError(f"Checkpoint of {output} was created with {state['params']}")
+    else:
+        restore(output, state["size"])
+        if state["candidates"] != candidates_state:
+            print(
+                f"Warning: {searchspace} changed since {output} was started, "
+                "sources processed before are not matched with new candidates"
+            )
+
+    if state["upto_id"] is None:
+        last = client[source_name].v0.find_one(sort=[("_id", -1)])
+        if last is None or str(last["_id"]) == state["done_id"]:
+            return 0
+        state.update(upto_id=str(last["_id"]), last_time=None)
+
+    source = gm.get_collection(client, source_name, query=unprocessed_query(state))
+    n = 0 if source is None else int(source.index.size * percentage)
+    candidates = gm.get_collection(client, searchspace)
+
+    if n > 0:
+        times = gm.index_as_ns(source[:n])
+        for start, stop in _chunk_ends(times, rows):
+            chunk = source[start:stop]
+            if candidates is None:
+                matches = [{str(x): []} for x in chunk._id]
+                metrics.count_matches(matches)
+            else:
+                result = par.ENGINES[engine](chunk, candidates, distance_km, delta)
+                matches = result["matches"]
+            with gm.MatchWriter(output, distance_km, delta, append) as writer:
+                writer.write(matches)
+            append = True
+            state["last_time"] = chunk.index[-1].to_pydatetime().isoformat()
+            state["size"] = os.path.getsize(output)
+            write(output, state)
+            n = stop
+
+    if source is None or n == source.index.size:
+        if not append:
+            with gm.MatchWriter(output, distance_km, delta):
+                pass
+        state.update(done_id=state["upto_id"], upto_id=None, last_time=None)
+        state["size"] = os.path.getsize(output)
+        write(output, state)
+    return n
+
+
+def main(distance_km, delta, percentage, output, tropomi_in_iasi: bool, engine, rows):
+    """Example application of the methods in this module."""
+    print("Loading data")
+    client = gm.connect()
+    if tropomi_in_iasi:
+        source, searchspace = "TROPOMI", "IASI"
+    else:
+        source, searchspace = "IASI", "TROPOMI"
+
+    tic = time.perf_counter()
+    n = parallel_resumable(
+        client,
+        source,
+        searchspace,
+        distance_km,
+        delta,
+        percentage,
+        output,
+        engine,
+        rows,
+    )
+    toc = time.perf_counter()
+
+    print(f"Calculation of {n} new data was done in {toc - tic:0.4f} seconds")
+
+
+if __name__ == "__main__":
+    distance_km = 160.934
+    delta = timedelta(hours=6)
+    percentage = 0.01
+    output = "matches.json"
+    tropomi_in_iasi = True
+    main(distance_km, delta, percentage, output, tropomi_in_iasi, "batch", 10_000)
@@ -1,15 +1,27 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import os
 from datetime import timedelta
 
 import click
-from bson.objectid import ObjectId
 
-from .geomatch import main as geomatch_main
-from .mongo import main as mongo_main
-from .parallel import main as par_main
-from .plot import main as plot_main
+from . import metrics
+
+# Choices of the options, the modules using them (and pandas, numba, pymongo
+# and folium) are only imported by the commands, see tests/test_cli.py.
+COLLECTIONS = ("TROPOMI", "IASI")
+ENGINES = ("thread", "process", "sweep", "batch", "shared")
+INDEXED_ENGINES = ("thread", "process", "sweep")
+BENCH_ENGINES = (
+    *ENGINES,
+    "thread+grid",
+    "sweep+grid",
+    "stream",
+    "mongo-thread",
+    "mongo-bounded",
+    "mongo-batch",
+)
 
 
 @click.group()
@@ -39,13 +51,54 @@ from .plot import main as plot_main
     default=True,
     help="Define source and search satellite.",
 )
+@click.option(
+    "--grid/--no-grid",
+    show_default=True,
+    default=False,
+    help="Spatial selection using a grid index over the search satellite.",
+)
 @click.pass_context
-def cli(ctx, distance, delta, tropomi_in_iasi):
+def cli(ctx, distance, delta, tropomi_in_iasi, grid):
     """Geomatch Tool - Analysis of TROPOMI and IASI satellite tracks."""
     ctx.ensure_object(dict)
     ctx.obj["distance"] = distance
     ctx.obj["delta"] = timedelta(minutes=delta)
     ctx.obj["tropomi_in_iasi"] = tropomi_in_iasi
+    ctx.obj["grid"] = grid
+
+
+def parse_mode(text):
+    """Parse a mode ("all", "nearest" or "k=N") to k (None for all)."""
+    if text == "all":
+        return None
+    if text == "nearest":
+        return 1
+    try:
+        key, k = text.split("=")
+        k = int(k)
+    except ValueError:
+        key = None
+    if key != "k" or k < 1:
+        raise ValueError(f"Mode {text!r} is not all, nearest or k=N (N >= 1)")
+    return k
+
+
+def _parse_mode(ctx, param, value):
+    try:
+        return parse_mode(value)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc))
+
+
+def _parse_shard(ctx, param, value):
+    if value is None:
+        return None
+    from .shard import parse_shard
+
+    try:
+        return parse_shard(value)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc))
 
 
 @cli.command()
@@ -70,33 +123,288 @@ def cli(ctx, distance, delta, tropomi_in_iasi):
     default=False,
     help="Spatial selection using MongoDB.",
 )
+@click.option(
+    "--engine",
+    default=None,
+    type=click.Choice(list(ENGINES)),
+    help="Join engine used by geomatch [default: thread].",
+)
+@click.option(
+    "--stream/--no-stream",
+    show_default=True,
+    default=False,
+    help="Match time ordered chunks with bounded memory.",
+)
+@click.option(
+    "--chunk",
+    default=6,
+    show_default=True,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Time span of the chunks when streaming [h].",
+)
+@click.option(
+    "--resume/--no-resume",
+    show_default=True,
+    default=False,
+    help=(
+        "Checkpoint the output and only process new or unprocessed data. "
+        "Processed data is not matched again with candidates added later."
+    ),
+)
+@click.option(
+    "--checkpoint-rows",
+    default=10_000,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of source rows between checkpoints.",
+)
+@click.option(
+    "--format",
+    "fmt",
+    default="json",
+    show_default=True,
+    type=click.Choice(["json", "edges"]),
+    help="Output format, edges writes a binary edge list directory.",
+)
+@click.option(
+    "--mongo-engine",
+    default="thread",
+    show_default=True,
+    type=click.Choice(["thread", "bounded", "batch"]),
+    help="Query scheduling used with --mongo.",
+)
+@click.option(
+    "--batch-size",
+    default=100,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of centers per MongoDB query (batch).",
+)
+@click.option(
+    "--max-in-flight",
+    default=32,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of concurrent MongoDB queries (bounded).",
+)
+@click.option(
+    "--pool-size",
+    default=None,
+    type=click.IntRange(min=1),
+    help="MongoDB connection pool size [default: max(max-in-flight, 100)].",
+)
+@click.option(
+    "--metrics",
+    "metrics_output",
+    default=None,
+    type=click.Path(exists=False),
+    help="Output json file with timers and counters per stage.",
+)
+@click.option(
+    "--profile",
+    default=None,
+    type=click.Path(exists=False),
+    help="Output file with cProfile statistics of the run.",
+)
+@click.option(
+    "--shard",
+    default=None,
+    callback=_parse_shard,
+    help="Only process time shard i of n (i/n), see the merge command.",
+)
+@click.option(
+    "--result-cache/--no-result-cache",
+    default=False,
+    show_default=True,
+    help="Store all matches in the result cache for single lookups.",
+)
+@click.option(
+    "--mode",
+    "k",
+    default="all",
+    show_default=True,
+    callback=_parse_mode,
+    help=(
+        "Matches per source: all, nearest or k=N, the N best by distance "
+        "and time offset relative to the thresholds."
+    ),
+)
+@click.option(
+    "--both-directions",
+    "both",
+    is_flag=True,
+    help="Write the matches of both directions from a single pass.",
+)
 @click.pass_context
-def match(ctx, percentage, output, mongo):
+def match(
+    ctx,
+    percentage,
+    output,
+    mongo,
+    engine,
+    stream,
+    chunk,
+    resume,
+    checkpoint_rows,
+    fmt,
+    mongo_engine,
+    max_in_flight,
+    pool_size,
+    batch_size,
+    metrics_output,
+    profile,
+    shard,
+    result_cache,
+    k,
+    both,
+):
     """Run search algorithm in either geomatch or mongo."""
     distance = ctx.obj["distance"]
     delta = ctx.obj["delta"]
     tropomi_in_iasi = ctx.obj["tropomi_in_iasi"]
+    grid = ctx.obj["grid"]
 
-    if mongo:
-        click.echo("Using mongo for finding matches.")
-        mongo_main(
-            distance, delta, percentage, output=output, tropomi_in_iasi=tropomi_in_iasi
+    if resume and output is None:
+        raise click.UsageError("--resume requires --output.")
+    engine_given = engine is not None
+    if engine_given and (mongo or stream):
+        raise click.UsageError("--engine has no effect with --mongo/--stream.")
+    engine = engine or "thread"
+    if grid and (mongo or stream or resume):
+        raise click.UsageError("--grid has no effect with --mongo/--stream/--resume.")
+    if grid and engine not in INDEXED_ENGINES:
+        raise click.UsageError(
+            f"--grid requires one of the engines {', '.join(INDEXED_ENGINES)}."
         )
-    else:
-        click.echo("Using geomatch for finding matches.")
-        par_main(
-            distance, delta, percentage, output=output, tropomi_in_iasi=tropomi_in_iasi
+    if fmt == "edges" and (output is None or mongo or stream or resume):
+        raise click.UsageError(
+            "--format edges requires --output and no --mongo/--stream/--resume."
+        )
+    if fmt == "edges" and (engine_given or grid):
+        raise click.UsageError("--format edges does not use --engine/--grid.")
+    if shard is not None and (output is None or mongo or stream or resume):
+        raise click.UsageError(
+            "--shard requires --output and no --mongo/--stream/--resume."
+        )
+    if k is not None and (mongo or stream or resume or shard is not None):
+        raise click.UsageError("--mode requires no --mongo/--stream/--resume/--shard.")
+    if k is not None and (engine_given or grid or fmt == "edges" or result_cache):
+        raise click.UsageError(
+            "--mode cannot be combined with --engine, --grid, --format edges "
+            "or --result-cache."
         )
+    if result_cache and output is None:
+        raise click.UsageError("--result-cache requires --output.")
+    if shard is not None and (fmt == "edges" or percentage < 1):
+        raise click.UsageError("--shard processes whole shards as json, without -p.")
+    if both and (mongo or stream or resume or shard is not None or k is not None):
+        raise click.UsageError(
+            "--both-directions requires no --mongo/--stream/--resume/--shard/--mode."
+        )
+    if both and (engine_given or grid or percentage < 1):
+        raise click.UsageError(
+            "--both-directions matches whole collections, without --engine, "
+            "--grid or -p."
+        )
+
+    with metrics.collect(metrics_output, profile):
+        if mongo:
+            from .mongo import main as mongo_main
+
+            click.echo("Using mongo for finding matches.")
+            mongo_main(
+                distance,
+                delta,
+                percentage,
+                output=output,
+                tropomi_in_iasi=tropomi_in_iasi,
+                engine=mongo_engine,
+                max_in_flight=max_in_flight,
+                pool_size=pool_size,
+                batch_size=batch_size,
+            )
+        elif resume:
+            from .checkpoint import main as checkpoint_main
+
+            click.echo("Using geomatch with checkpoints for finding matches.")
+            checkpoint_main(
+                distance,
+                delta,
+                percentage,
+                output=output,
+                tropomi_in_iasi=tropomi_in_iasi,
+                engine=engine,
+                rows=checkpoint_rows,
+            )
+        elif shard is not None:
+            from .shard import main as shard_main
+
+            click.echo(f"Using geomatch on time shard {shard[0]}/{shard[1]}.")
+            shard_main(
+                distance,
+                delta,
+                output=output,
+                tropomi_in_iasi=tropomi_in_iasi,
+                shard=shard,
+                engine=engine,
+                grid=grid,
+            )
+        elif stream:
+            from .stream import main as stream_main
+
+            click.echo("Using geomatch on streamed chunks for finding matches.")
+            stream_main(
+                distance,
+                delta,
+                percentage,
+                output=output,
+                tropomi_in_iasi=tropomi_in_iasi,
+                chunk=timedelta(hours=chunk),
+            )
+        else:
+            from .parallel import main as par_main
+
+            click.echo("Using geomatch for finding matches.")
+            par_main(
+                distance,
+                delta,
+                percentage,
+                output=output,
+                tropomi_in_iasi=tropomi_in_iasi,
+                engine=engine,
+                grid=grid,
+                fmt=fmt,
+                k=k,
+                both=both,
+            )
+    if result_cache:
+        from .parallel import direction_output
+        from .results import ResultCache
+        from .results import direction as result_direction
+        from .results import populate as populate_results
+
+        directions = [result_direction(tropomi_in_iasi)]
+        if both:
+            directions.append(result_direction(not tropomi_in_iasi))
+        with ResultCache() as results:
+            for direction in directions:
+                path = output
+                if both:
+                    path = direction_output(output, *direction.split("-"))
+                if not os.path.exists(path):
+                    continue
+                n = populate_results(results, path, direction)
+                click.echo(f"Stored the matches of {n} sources in the result cache.")
 
 
 @cli.command()
-@click.option("--id", "ident", default=None, type=str, help="Tropomi ID")
+@click.option("--id", "ident", default=None, type=str, help="ID of the source data.")
 @click.option(
     "--ix",
     default=0,
     type=click.IntRange(min=0),
     show_default=True,
-    help="Index position in Tropomi DB",
+    help="Index position of the source data in time.",
 )
 @click.option(
     "-o",
@@ -104,23 +412,433 @@ def match(ctx, percentage, output, mongo):
     default=None,
     show_default=True,
     type=click.Path(exists=False),
-    help="Output html file.",
+    help="Output html file (directory of html files with --ids).",
+)
+@click.option(
+    "--result-cache/--no-result-cache",
+    default=False,
+    show_default=True,
+    help="Read the matches from (and store them in) the result cache.",
+)
+@click.option(
+    "--ids",
+    default=None,
+    type=click.File("r"),
+    help="File (- for stdin) listing IDs or index positions, one per line.",
+)
+@click.option(
+    "--report",
+    default=None,
+    type=click.Path(exists=False),
+    help="Output json file with the matches of all --ids.",
 )
 @click.pass_context
-def single(ctx, ident, ix, output):
+def single(ctx, ident, ix, output, result_cache, ids, report):
     """Search single TROPOMI entries w/ geomatch and mongodb."""
     distance = ctx.obj["distance"]
     delta = ctx.obj["delta"]
     query = None
     tropomi_in_iasi = ctx.obj["tropomi_in_iasi"]
+    grid = ctx.obj["grid"]
+
+    ix_given = ctx.get_parameter_source("ix") != click.core.ParameterSource.DEFAULT
+    if ids is not None and (ident or ix_given):
+        raise click.UsageError("--ids cannot be combined with --id/--ix.")
+    if report is not None and (ids is None or output is not None):
+        raise click.UsageError("--report requires --ids and no --output.")
+
+    from bson.objectid import ObjectId
+
+    from .results import ResultCache
+
+    results = ResultCache() if result_cache else None
+    if ids is not None:
+        try:
+            if output is not None:
+                from .plot import main_many as plot_many
+
+                plot_many(distance, delta, ids, tropomi_in_iasi, output, grid, results)
+            else:
+                from .lookup import main as lookup_main
+
+                lookup_main(
+                    distance, delta, ids, tropomi_in_iasi, report, grid, results
+                )
+        except ValueError as exc:
+            raise click.UsageError(str(exc))
+        return
 
     if ident:
         query = {"_id": ObjectId(ident)}
         ix = 0
     if output is not None:
-        plot_main(distance, delta, ix, tropomi_in_iasi, query=query, save=output)
+        from .plot import main as plot_main
+
+        plot_main(
+            distance,
+            delta,
+            ix,
+            tropomi_in_iasi,
+            query=query,
+            save=output,
+            grid=grid,
+            results=results,
+        )
     else:
-        geomatch_main(distance, delta, ix, tropomi_in_iasi, query=query)
+        from .geomatch import main as geomatch_main
+
+        geomatch_main(
+            distance,
+            delta,
+            ix,
+            tropomi_in_iasi,
+            query=query,
+            grid=grid,
+            results=results,
+        )
+
+
+@cli.command()
+@click.option(
+    "--id",
+    "ids",
+    multiple=True,
+    type=str,
+    help="ID of a source data (repeatable).",
+)
+@click.option(
+    "--matches",
+    default=None,
+    type=click.Path(exists=True),
+    help="Match output (json file or edge list) to plot instead.",
+)
+@click.option(
+    "-o",
+    "--output",
+    default=None,
+    type=click.Path(exists=False),
+    help="Output html file.",
+)
+@click.option(
+    "--cluster/--no-cluster",
+    default=False,
+    show_default=True,
+    help="Draw the centers and matches as marker clusters.",
+)
+@click.option(
+    "--max-points",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Draw at most this many centers and matches (randomly chosen).",
+)
+@click.pass_context
+def plot(ctx, ids, matches, output, cluster, max_points):
+    """Plot the matches of many sources in one map."""
+    if bool(ids) == bool(matches):
+        raise click.UsageError("Give either --id or --matches.")
+    from .plot import main_bulk
+
+    main_bulk(
+        ctx.obj["distance"],
+        ctx.obj["delta"],
+        ctx.obj["tropomi_in_iasi"],
+        ids=ids or None,
+        path=matches,
+        save=output,
+        cluster=cluster,
+        max_points=max_points,
+    )
+
+
+@cli.command()
+@click.option(
+    "--host",
+    default="127.0.0.1",
+    show_default=True,
+    help="Host of the HTTP server.",
+)
+@click.option(
+    "--port",
+    default=8000,
+    show_default=True,
+    type=click.IntRange(0, 65535),
+    help="Port of the HTTP server.",
+)
+@click.option(
+    "--socket",
+    default=None,
+    type=click.Path(),
+    help="Serve on a Unix socket instead of host and port.",
+)
+@click.pass_context
+def serve(ctx, host, port, socket):
+    """Answer match requests over HTTP with the data kept in memory.
+
+    GET /match?id=<source id> or /match?lat=..&lon=..&time=<iso> with the
+    optional parameters direction (e.g. IASI-TROPOMI), km and min.
+    """
+    from .serve import main as serve_main
+
+    serve_main(
+        ctx.obj["distance"],
+        ctx.obj["delta"],
+        grid=ctx.obj["grid"],
+        host=host,
+        port=port,
+        socket=socket,
+    )
+
+
+@cli.command()
+@click.option(
+    "--sources",
+    default=2_000,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of synthetic TROPOMI data.",
+)
+@click.option(
+    "--candidates",
+    default=8_000,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of synthetic IASI data.",
+)
+@click.option(
+    "--span",
+    default=24,
+    show_default=True,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Time span of the synthetic tracks [h].",
+)
+@click.option(
+    "--distance",
+    "distances",
+    multiple=True,
+    default=(20, 160.934),
+    show_default=True,
+    type=click.FloatRange(min=0, max=6371),
+    help="Spatial tolerance to benchmark [km].",
+)
+@click.option(
+    "--delta",
+    "deltas",
+    multiple=True,
+    default=(120, 360),
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Temporal tolerance to benchmark [min].",
+)
+@click.option(
+    "-e",
+    "--engine",
+    "names",
+    multiple=True,
+    type=click.Choice(BENCH_ENGINES),
+    help="Engine to benchmark [default: all].",
+)
+@click.option(
+    "--repeat",
+    default=3,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of timed runs per engine and setting.",
+)
+@click.option(
+    "--output",
+    default=None,
+    type=click.Path(exists=False),
+    help="Output json file.",
+)
+@click.option(
+    "--startup",
+    is_flag=True,
+    help="Benchmark the start up of the cli and the numba kernels instead.",
+)
+def bench(sources, candidates, span, distances, deltas, names, repeat, output, startup):
+    """Benchmark the engines on synthetic satellite tracks."""
+    if startup:
+        from .bench import startup as bench_startup
+
+        for name, seconds in bench_startup(repeat).items():
+            click.echo(f"{name}: {seconds:0.4f} seconds")
+        return
+    from .bench import main as bench_main
+
+    settings = [(d, timedelta(minutes=t)) for d in distances for t in deltas]
+    bench_main(
+        sources,
+        candidates,
+        timedelta(hours=span),
+        settings,
+        names=names,
+        repeat=repeat,
+        output=output,
+    )
+
+
+@cli.command()
+@click.option(
+    "--distance",
+    "distances",
+    multiple=True,
+    default=(20, 50, 100, 160.934),
+    show_default=True,
+    type=click.FloatRange(min=0, max=6371),
+    help="Spatial tolerance of a combination [km].",
+)
+@click.option(
+    "--delta",
+    "deltas",
+    multiple=True,
+    default=(60, 120, 360),
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Temporal tolerance of a combination [min].",
+)
+@click.option(
+    "-o",
+    "--output",
+    required=True,
+    type=click.Path(exists=False),
+    help="Output directory of the edge list at the largest tolerances.",
+)
+@click.option(
+    "--summary",
+    default=None,
+    type=click.Path(exists=False),
+    help="Output csv file with the match counts of all combinations.",
+)
+@click.pass_context
+def thresholds(ctx, distances, deltas, output, summary):
+    """Match once and count the matches of all tolerance combinations."""
+    from .thresholds import main as thresholds_main
+
+    settings = [(d, timedelta(minutes=t)) for d in distances for t in deltas]
+    thresholds_main(settings, output, ctx.obj["tropomi_in_iasi"], table=summary)
+
+
+@cli.command()
+@click.argument("edges", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "-o",
+    "--output",
+    required=True,
+    type=click.Path(exists=False),
+    help="Output json file.",
+)
+@click.pass_context
+def select(ctx, edges, output):
+    """Select the matches within the tolerances from a thresholds output."""
+    from .edges import read_edges
+    from .geomatch import to_json
+    from .thresholds import to_matches
+
+    try:
+        result = to_matches(*read_edges(edges), ctx.obj["distance"], ctx.obj["delta"])
+    except ValueError as exc:
+        raise click.UsageError(str(exc))
+    to_json(output, result)
+    n = sum(len(v) for x in result["matches"] for v in x.values())
+    click.echo(f"Selected {n} matches to {output}.")
+
+
+@cli.command()
+@click.argument("parts", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option(
+    "-o",
+    "--output",
+    required=True,
+    type=click.Path(exists=False),
+    help="Output json file.",
+)
+def merge(parts, output):
+    """Merge the outputs of all shards of a sharded match run."""
+    from .shard import merge as merge_shards
+
+    try:
+        result = merge_shards(parts, output)
+    except ValueError as exc:
+        raise click.UsageError(str(exc))
+    click.echo(f"Merged {len(result['matches'])} data to {output}.")
+
+
+@cli.group("cache")
+def cache_group():
+    """Manage the local columnar cache of the MongoDB collections."""
+
+
+@cache_group.command("build")
+@click.option(
+    "-c",
+    "--collection",
+    "names",
+    multiple=True,
+    default=COLLECTIONS,
+    show_default=True,
+    type=click.Choice(COLLECTIONS),
+    help="Collection to cache.",
+)
+def cache_build(names):
+    """Snapshot collections from MongoDB into the cache."""
+    from . import cache as lc
+    from .geomatch import connect
+
+    client = connect()
+    for name in names:
+        meta = lc.build(client, name)
+        click.echo(f"Cached {meta['count']} documents of {name}.")
+
+
+@cache_group.command("status")
+def cache_status():
+    """Show if the cached collections are up to date."""
+    from . import cache as lc
+    from .geomatch import connect
+    from .results import ResultCache
+
+    client = connect()
+    click.echo(f"Cache directory: {lc.cache_dir()}")
+    for name in COLLECTIONS:
+        meta = lc.read_meta(name)
+        if meta is None:
+            click.echo(f"{name}: not cached")
+            continue
+        state = "valid" if lc.is_valid(client, name) else "stale"
+        click.echo(f"{name}: {meta['count']} documents, {state}")
+    with ResultCache() as results:
+        click.echo(f"Results: {len(results)} sources, {results.size()} bytes")
+
+
+@cache_group.command("clear")
+@click.option(
+    "-c",
+    "--collection",
+    "names",
+    multiple=True,
+    default=COLLECTIONS,
+    show_default=True,
+    type=click.Choice(COLLECTIONS),
+    help="Collection to remove from the cache.",
+)
+@click.option(
+    "--results/--no-results",
+    default=False,
+    show_default=True,
+    help="Also remove all entries of the result cache.",
+)
+def cache_clear(names, results):
+    """Remove collections from the cache."""
+    from . import cache as lc
+    from .results import ResultCache
+
+    for name in names:
+        lc.clear(name)
+        click.echo(f"Removed {name} from the cache.")
+    if results:
+        with ResultCache() as cache:
+            cache.clear()
+        click.echo("Removed all results from the cache.")
 
 
 def main():
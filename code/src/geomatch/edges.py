@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+
+import numpy as np
+from bson.objectid import ObjectId
+
+from geomatch import cache as lc
+from geomatch import geomatch as gm
+
+COLUMNS = dict(
+    source_idx=np.int32,
+    candidate_idx=np.int32,
+    distance_km=np.float32,
+    dt_seconds=np.float32,
+)
+IDS = ("source_ids", "candidate_ids")
+
+
+def object_id_bytes(oids):
+    """Return ObjectIds as (n, 12) uint8 array."""
+    if isinstance(oids, lc.ObjectIdArray):
+        return oids.raw
+    raw = b"".join(x.binary for x in oids)
+    return np.frombuffer(raw, dtype=np.uint8).reshape(-1, 12)
+
+
+class EdgeWriter:
+    """Write matches as binary edge list into a directory.
+
+    Every edge (source_idx, candidate_idx, distance_km, dt_seconds) refers
+    to the id dictionaries `source_ids` and `candidate_ids`, which hold the
+    12 byte ObjectIds. All columns are raw little endian arrays appended
+    chunk by chunk, `meta.json` describes them once the writer is closed
+    without an error. `columns` may override the dtypes of `COLUMNS`.
+    """
+
+    def __init__(self, path, distance_km, delta, columns=COLUMNS):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.meta = dict(
+            distance=f"{distance_km} km",
+            delta=f"{delta.total_seconds()/60} min",
+        )
+        self.columns = columns
+        self.files = {x: open(self._file(x), "wb") for x in [*columns, *IDS]}
+        self.n_sources = 0
+        self.n_edges = 0
+        self.candidates = {}
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _candidate_idx(self, oids, indices):
+        """Map candidate rows to the candidate id dictionary."""
+        rows, inverse = np.unique(indices, return_inverse=True)
+        new = []
+        idx = np.empty(rows.size, dtype=np.int32)
+        for i, oid in enumerate(oids[rows]):
+            if oid not in self.candidates:
+                self.candidates[oid] = len(self.candidates)
+                new.append(oid)
+            idx[i] = self.candidates[oid]
+        self.files["candidate_ids"].write(object_id_bytes(new).tobytes())
+        return idx[inverse]
+
+    def write(self, sources, candidates, offsets, indices, distances):
+        """Append CSR matches of source frame rows in candidate frame rows."""
+        counts = np.diff(offsets)
+        source_idx = np.repeat(np.arange(counts.size), counts) + self.n_sources
+        src_times = np.repeat(gm.index_as_ns(sources), counts)
+        dt = (gm.index_as_ns(candidates)[indices] - src_times) / 1e9
+        columns = dict(
+            source_idx=source_idx,
+            candidate_idx=self._candidate_idx(candidates._id.values, indices),
+            distance_km=distances,
+            dt_seconds=dt,
+        )
+        for name, dtype in self.columns.items():
+            self.files[name].write(columns[name].astype(dtype).tobytes())
+        self.files["source_ids"].write(object_id_bytes(sources._id.values).tobytes())
+        self.n_sources += counts.size
+        self.n_edges += indices.size
+
+    def close(self, complete=True):
+        """Close all files, `meta.json` is only written for a complete list."""
+        for f in self.files.values():
+            f.close()
+        if not complete:
+            return
+        self.meta.update(
+            sources=self.n_sources,
+            candidates=len(self.candidates),
+            edges=self.n_edges,
+            columns={k: np.dtype(v).str for k, v in self.columns.items()},
+        )
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(complete=exc_type is None)
+
+
+def _map(path, name, dtype, shape):
+    if shape[0] == 0:
+        return np.empty(shape, dtype=dtype)
+    fname = os.path.join(path, f"{name}.bin")
+    return np.memmap(fname, dtype=dtype, mode="r", shape=shape)
+
+
+def read_edges(path):
+    """Memory map an edge list written by `EdgeWriter`.
+
+    Returns the metadata and a dictionary with the edge columns and the id
+    dictionaries ((n, 12) uint8 arrays) without copying them.
+    """
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    arrays = {
+        k: _map(path, k, dtype, (meta["edges"],))
+        for k, dtype in meta["columns"].items()
+    }
+    arrays["source_ids"] = _map(path, "source_ids", np.uint8, (meta["sources"], 12))
+    arrays["candidate_ids"] = _map(
+        path, "candidate_ids", np.uint8, (meta["candidates"], 12)
+    )
+    return meta, arrays
+
+
+def to_matches(meta, arrays):
+    """Convert an edge list to the result dictionary of `gm.to_json`."""
+    sources = [str(ObjectId(x.tobytes())) for x in arrays["source_ids"]]
+    candidates = [str(ObjectId(x.tobytes())) for x in arrays["candidate_ids"]]
+    found = {x: [] for x in sources}
+    for s, c in zip(arrays["source_idx"], arrays["candidate_idx"]):
+        found[sources[s]].append(candidates[c])
+    matches = [{k: v} for k, v in found.items()]
+    return dict(distance=meta["distance"], delta=meta["delta"], matches=matches)
@@ -5,15 +5,22 @@ import json
 import os
 from datetime import timedelta
 
-from pandas import DataFrame
+import numpy as np
+from pandas import DataFrame, DatetimeIndex, Timedelta
 from pymongo import MongoClient
 
+from . import cache as lc
 from . import haversine as hv
+from . import metrics
 from . import mongo as m
+from . import spatial
 
 
-def connect():
-    """Connect to MongoDB using environment variables."""
+def connect(**kwargs):
+    """Connect to MongoDB using environment variables.
+
+    Keyword arguments are passed to `MongoClient`, e.g. `maxPoolSize`.
+    """
     USERNAME = os.getenv("MONGO_USERNAME")
     PASSWORD = os.getenv("MONGO_PASSWORD")
     HOST = os.getenv("MONGO_HOST")
@@ -21,40 +28,156 @@ def connect():
     PATH = os.getenv("MONGO_PATH")
 
     link = f"mongodb://{USERNAME}:{PASSWORD}@{HOST}:{PORT}/{PATH}"
-    return MongoClient(link)
+    return MongoClient(link, **kwargs)
 
 
-def _query_result_to_gdb(cursor, index="time"):
-    """Private function to parse MongoDB query results to GeoDataFrames."""
+PROJECTION = {"time": 1, "id": 1, "_id": 1, "loc.coordinates": 1}
+BATCH_SIZE = 10_000
+UNIT_VECTORS = ["x", "y", "z"]
+
+
+def find(collection, query=None, projection=PROJECTION, **kwargs):
+    """Query a collection for the fields used by geomatch in large batches.
 
-    def _single_entry(entry):
-        result = {k: entry[k] for k in ["time", "id", "_id"]}
-        result["lat"] = entry["loc"]["coordinates"][1]
-        result["lon"] = entry["loc"]["coordinates"][0]
-        result["timestamp"] = result["time"]
-        return result
+    Keyword arguments are passed to `find`, e.g. `sort` and `limit`.
+    """
+    return collection.find(query, projection, batch_size=BATCH_SIZE, **kwargs)
+
+
+def _query_result_to_gdb(cursor, index="time"):
+    """Private function to parse MongoDB query results to GeoDataFrames.
 
-    entries = [_single_entry(x) for x in cursor]
-    if not entries:
+    The documents are decoded column by column, without creating an
+    intermediate dictionary per document.
+    """
+    times, ids, oids, lats, lons = [], [], [], [], []
+    with metrics.timer("fetch"):
+        for entry in cursor:
+            times.append(entry["time"])
+            ids.append(entry["id"])
+            oids.append(entry["_id"])
+            coordinates = entry["loc"]["coordinates"]
+            lons.append(coordinates[0])
+            lats.append(coordinates[1])
+    metrics.count("documents_fetched", len(times))
+    if not times:
         return None
-    df = DataFrame(entries).set_index(index)
-    df = df.sort_index()
+    with metrics.timer("frame"):
+        times = DatetimeIndex(times).astype("datetime64[ns]")
+        df = DataFrame(
+            dict(
+                time=times,
+                id=ids,
+                _id=lc.ObjectIdArray._from_sequence(oids),
+                lat=np.array(lats, dtype=np.float64),
+                lon=np.array(lons, dtype=np.float64),
+                timestamp=times,
+            )
+        )
+        df = df.set_index(index)
+        df = df.sort_index()
     return df
 
 
-# TODO: Unify next two calls
-def get_tropomi(client, query=None, index="time"):
-    """Get all of the TROPOMI data from the client."""
-    cursor = client["TROPOMI"].v0.find(query)
+def get_collection(client, name, query=None, index="time", cache=True):
+    """Get the data of a collection, from the local cache if it is valid."""
+    if cache and query is None and index == "time" and lc.is_valid(client, name):
+        with metrics.timer("cache_load"):
+            return lc.load(name)
+    cursor = find(client[name].v0, query)
     gdf = _query_result_to_gdb(cursor, index)
     return gdf
 
 
-def get_iasi(client, query=None, index="time"):
+def get_head(client, name, n, cache=True):
+    """Get the first n data of a collection in time (None if n is 0)."""
+    if n <= 0:
+        return None
+    if cache and lc.is_valid(client, name):
+        with metrics.timer("cache_load"):
+            frame = lc.load(name)
+        return None if frame is None else frame[:n]
+    cursor = find(client[name].v0, sort=[("time", 1)], limit=n)
+    return _query_result_to_gdb(cursor)
+
+
+def candidate_bounds(source, delta, distance_km=None):
+    """Return the time range and bounding box of candidates of the sources.
+
+    The time range covers the temporal boundaries of all sources. With
+    `distance_km` the latitudes (and the longitudes if the box neither
+    reaches a pole nor wraps around) cover the search circles of all
+    sources, otherwise they are None.
+    """
+    window = Timedelta(delta / 2)
+    bounds = dict(
+        tmin=source.index.min() - window,
+        tmax=source.index.max() + window,
+        lat=None,
+        lon=None,
+    )
+    if distance_km is None:
+        return bounds
+    angle = distance_km / hv.R
+    dlat = np.degrees(angle) + 1e-9
+    lats, lons = source.lat.values, source.lon.values
+    lat_min, lat_max = lats.min() - dlat, lats.max() + dlat
+    if lat_min <= -90 or lat_max >= 90:
+        return bounds
+    bounds["lat"] = (lat_min, lat_max)
+    ratio = np.sin(angle) / np.cos(np.radians(np.abs(lats).max()))
+    if ratio >= 1:
+        return bounds
+    dlon = np.degrees(np.arcsin(ratio)) + 1e-9
+    lon_min, lon_max = lons.min() - dlon, lons.max() + dlon
+    if lon_min > -180 and lon_max < 180:
+        bounds["lon"] = (lon_min, lon_max)
+    return bounds
+
+
+def bounds_query(bounds):
+    """Return the MongoDB query of `candidate_bounds`."""
+    query = {"time": {"$gte": bounds["tmin"], "$lte": bounds["tmax"]}}
+    for key, position in (("lon", 0), ("lat", 1)):
+        if bounds[key] is not None:
+            lo, hi = bounds[key]
+            query[f"loc.coordinates.{position}"] = {"$gte": lo, "$lte": hi}
+    return query
+
+
+def get_candidates(client, name, source, delta, distance_km=None, cache=True):
+    """Get only the data of a collection within reach of the sources.
+
+    The bounds (see `candidate_bounds`) are pushed down to MongoDB, or
+    applied to the cached frame if the local cache is valid. Returns an
+    empty frame if there are no candidates.
+    """
+    bounds = candidate_bounds(source, delta, distance_km)
+    if cache and lc.is_valid(client, name):
+        with metrics.timer("cache_load"):
+            frame = lc.load(name)
+    else:
+        frame = get_collection(client, name, bounds_query(bounds), cache=False)
+    if frame is None:
+        return source.iloc[:0][["id", "_id", "lat", "lon", "timestamp"]]
+    lo = frame.index.searchsorted(bounds["tmin"], "left")
+    hi = frame.index.searchsorted(bounds["tmax"], "right")
+    frame = frame.iloc[lo:hi]
+    for key in ("lat", "lon"):
+        if bounds[key] is not None:
+            values = frame[key].values
+            frame = frame[(values >= bounds[key][0]) & (values <= bounds[key][1])]
+    return frame
+
+
+def get_tropomi(client, query=None, index="time", cache=True):
+    """Get all of the TROPOMI data from the client."""
+    return get_collection(client, "TROPOMI", query, index, cache)
+
+
+def get_iasi(client, query=None, index="time", cache=True):
     """Get all of the IASI data from the client."""
-    cursor = client["IASI"].v0.find(query)
-    gdf = _query_result_to_gdb(cursor, index)
-    return gdf
+    return get_collection(client, "IASI", query, index, cache)
 
 
 def temporal_boundaries(center, delta, window_center=True):
@@ -65,14 +188,55 @@ def temporal_boundaries(center, delta, window_center=True):
     return (tmin, tmax)
 
 
-def filter_by_distance(center, candidate_list, distance_km):
-    """Return only the candidates within a certain distance."""
+def temporal_window_ns(delta, window_center=True):
+    """Return the half width of the temporal boundaries in nanoseconds."""
+    window = delta / 2 if window_center else delta
+    return Timedelta(window).value
+
+
+def index_as_ns(frame):
+    """Return the time index of a frame as int64 nanoseconds."""
+    return frame.index.values.astype("datetime64[ns]").view("int64")
+
+
+def add_unit_vectors(frame):
+    """Cache the unit vectors of the points as x, y, z columns of a frame.
+
+    With these columns `filter_by_distance` rejects far away candidates
+    before evaluating the haversine formula (see `hv.unit_vectors`).
+    """
+    if frame is not None and not set(UNIT_VECTORS) <= set(frame.columns):
+        xs, ys, zs = hv.unit_vectors(frame.lat.values, frame.lon.values)
+        frame[UNIT_VECTORS[0]] = xs
+        frame[UNIT_VECTORS[1]] = ys
+        frame[UNIT_VECTORS[2]] = zs
+    return frame
+
+
+def filter_by_distance(center, candidate_list, distance_km, index=None):
+    """Return only the candidates within a certain distance.
+
+    If a `spatial.GridIndex` built over `candidate_list` is given, only the
+    candidates in the grid cells around the center are evaluated. If the
+    candidates have unit vector columns (see `add_unit_vectors`) they are
+    prefiltered by latitude band and chord length.
+    """
     lat = center.lat
     lon = center.lon
-    lats = candidate_list.lat.values
-    lons = candidate_list.lon.values
-    mask = hv.haversine_par(lats, lons, lat, lon, distance_km)
-    result = candidate_list[mask]
+    with metrics.timer("filter_by_distance"):
+        if index is not None:
+            return candidate_list.iloc[index.query(lat, lon, distance_km)]
+        lats = candidate_list.lat.values
+        lons = candidate_list.lon.values
+        metrics.count("haversine_evaluations", lats.size)
+        if set(UNIT_VECTORS) <= set(candidate_list.columns):
+            xs, ys, zs = (candidate_list[x].values for x in UNIT_VECTORS)
+            mask = hv.haversine_par_prefiltered(
+                xs, ys, zs, lats, lons, lat, lon, distance_km
+            )
+        else:
+            mask = hv.haversine_par(lats, lons, lat, lon, distance_km)
+        result = candidate_list[mask]
     return result
 
 
@@ -80,36 +244,123 @@ def filter_by_time(center, candidate_list, delta):
     """Return only the candidates within a certain time window."""
     tmin, tmax = temporal_boundaries(center, delta)
 
-    mask = candidate_list["timestamp"].between(tmin, tmax)
-    result = candidate_list[mask]
+    with metrics.timer("filter_by_time"):
+        mask = candidate_list["timestamp"].between(tmin, tmax)
+        result = candidate_list[mask]
+    metrics.count("candidates_after_time_filter", result.index.size)
     return result
 
 
 def to_json(fname, obj):
     """Output object to json file."""
-    with open(fname, "w") as f:
+    with metrics.timer("output"), open(fname, "w") as f:
         json.dump(obj, f)
 
 
-def main(distance_km, delta, ix, tropomi_in_iasi: bool, query=None):
-    """Example application of this module."""
+class MatchWriter:
+    """Write match results incrementally in the json format of `to_json`.
+
+    With `append` the matches are added to an existing file written by this
+    class. Without a file name the matches are discarded.
+    """
+
+    def __init__(self, fname, distance_km, delta, append=False):
+        self.f = None
+        self.count = 0
+        self.separator = b""
+        if fname is None:
+            return
+        if append and os.path.exists(fname):
+            self.f = open(fname, "r+b")
+            self.f.seek(-3, os.SEEK_END)
+            if self.f.read(3) != b"[]}":
+                self.separator = b", "
+            self.f.seek(-2, os.SEEK_END)
+            self.f.truncate()
+        else:
+            self.f = open(fname, "wb")
+            header = dict(
+                distance=f"{distance_km} km",
+                delta=f"{delta.total_seconds()/60} min",
+            )
+            self.f.write(json.dumps(header)[:-1].encode() + b', "matches": [')
+
+    def write(self, matches):
+        """Append a list of matches ({source_id: [candidate_ids]})."""
+        with metrics.timer("output"):
+            for match in matches:
+                if self.f is not None:
+                    self.f.write(self.separator + json.dumps(match).encode())
+                    self.separator = b", "
+                self.count += 1
+
+    def close(self):
+        if self.f is not None:
+            self.f.write(b"]}")
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def collections(tropomi_in_iasi: bool):
+    """Return the names of the source and of the searched collection."""
+    return ("TROPOMI", "IASI") if tropomi_in_iasi else ("IASI", "TROPOMI")
+
+
+def get_source(client, name, ix=0, query=None):
+    """Get a single source as frame with one row.
+
+    The source is selected by `query` or else by its position `ix` in time.
+    """
+    if query is not None:
+        source = get_collection(client, name, query=query)
+        ix = 0
+    else:
+        source = get_head(client, name, ix + 1)
+    if source is None or ix >= source.index.size:
+        raise ValueError(f"No data in {name} for {query or ix}")
+    return source.iloc[[ix]]
+
+
+def main(
+    distance_km, delta, ix, tropomi_in_iasi: bool, query=None, grid=False, results=None
+):
+    """Example application of this module.
+
+    With `results` (see `results.ResultCache`) cached matches are read
+    instead of searched, and new matches are stored.
+    """
     print("Loading data")
     client = connect()
-    if tropomi_in_iasi:
-        source = get_tropomi(client, query=query)  # size: 155.654
-        candidates = get_iasi(client)  # size: 657.417
-        searchspace = "IASI"
+    name, searchspace = collections(tropomi_in_iasi)
+    source = get_source(client, name, ix, query)
+    center = source.iloc[0]
+    key = (f"{name}-{searchspace}", distance_km, delta)
+    found = None if results is None else results.get(center._id, *key)
+    if found is not None:
+        print(f"Cached: There are {len(found)} matches for {center._id}")
+        return
+
+    candidates = get_candidates(client, searchspace, source, delta, distance_km)
+    if grid:
+        print("Apply spatial constraints using grid index")
+        index = spatial.GridIndex.from_frame(candidates)
+        filtered_s = filter_by_distance(center, candidates, distance_km, index)
+        print("Apply time constraints")
+        filter_fin = filter_by_time(center, filtered_s, delta)
     else:
-        candidates = get_tropomi(client, query=query)  # size: 155.654
-        source = get_iasi(client)  # size: 657.417
-        searchspace = "TROPOMI"
-
-    center = source.iloc[ix]
-    print("Apply time constraints")
-    filtered_t = filter_by_time(center, candidates, delta)
-    print("Apply spatial constraints")
-    filter_fin = filter_by_distance(center, filtered_t, distance_km)
+        print("Apply time constraints")
+        add_unit_vectors(candidates)
+        filtered_t = filter_by_time(center, candidates, delta)
+        print("Apply spatial constraints")
+        filter_fin = filter_by_distance(center, filtered_t, distance_km)
     print(f"There are {filter_fin.index.size} matches for {center._id}")
+    if results is not None:
+        results.put(center._id, filter_fin._id, *key)
 
     res = m.mongo_query(client, center, distance_km, delta, searchspace)
     length = 0 if res is None else res.index.size
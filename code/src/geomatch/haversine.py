@@ -4,15 +4,16 @@
 import numpy as np
 from numba import jit, prange
 
+R = 6371  # earth radius in km
 
-@jit(nopython=True)
+
+@jit(nopython=True, cache=True)
 def haversine(lat1, lon1, lat2, lon2):
     """Calculate the haversine distance between two points.
 
     More information can be found
     [here](https://en.wikipedia.org/wiki/Haversine_formula).
     """
-    R = 6371  # earth radius in km
     φ1 = lat1 * np.pi / 180
     φ2 = lat2 * np.pi / 180
     Δφ = (lat2 - lat1) * np.pi / 180
@@ -27,10 +28,189 @@ def haversine(lat1, lon1, lat2, lon2):
     return R * c
 
 
-@jit(nopython=True, parallel=True)
+@jit(nopython=True, parallel=True, cache=True)
 def haversine_par(arr_lats, arr_lons, lat, lon, distance_km):
     """Parallel implmentation of the haversine formula."""
     result = np.full(arr_lats.size, False)
     for i in prange(0, arr_lats.size):
         result[i] = haversine(arr_lats[i], arr_lons[i], lat, lon) <= distance_km
     return result
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def haversine_batch(
+    src_lats, src_lons, src_times, arr_lats, arr_lons, arr_times, distance_km, window
+):
+    """Match many centers within distance and time window in one call.
+
+    The candidate times (`arr_times`) need to be sorted, all times are int64
+    and `window` is the half width of the time window in the same unit. The
+    matches are returned as CSR arrays (offsets, indices, distances), i.e.
+    the candidates of center i are `indices[offsets[i]:offsets[i + 1]]`.
+    """
+    n = src_lats.size
+    lower = np.searchsorted(arr_times, src_times - window, side="left")
+    upper = np.searchsorted(arr_times, src_times + window, side="right")
+
+    counts = np.zeros(n, dtype=np.int64)
+    for i in prange(n):
+        count = 0
+        for j in range(lower[i], upper[i]):
+            d = haversine(arr_lats[j], arr_lons[j], src_lats[i], src_lons[i])
+            if d <= distance_km:
+                count += 1
+        counts[i] = count
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    indices = np.empty(offsets[n], dtype=np.int64)
+    distances = np.empty(offsets[n], dtype=np.float64)
+    for i in prange(n):
+        k = offsets[i]
+        for j in range(lower[i], upper[i]):
+            d = haversine(arr_lats[j], arr_lons[j], src_lats[i], src_lons[i])
+            if d <= distance_km:
+                indices[k] = j
+                distances[k] = d
+                k += 1
+    return offsets, indices, distances
+
+
+def unit_vectors(lats, lons):
+    """Return the points as unit vectors (x, y, z) on the sphere."""
+    φ = np.radians(lats)
+    λ = np.radians(lons)
+    return np.cos(φ) * np.cos(λ), np.cos(φ) * np.sin(λ), np.sin(φ)
+
+
+def warm_up():
+    """Compile `haversine_batch` and start the threads of the threading layer.
+
+    Call it on the main thread before parallel kernels run in a thread
+    pool: the TBB layer hangs at interpreter exit if its threads are first
+    started from another thread. Worker processes load the compiled kernel
+    from the disk cache.
+    """
+    x = np.zeros(1)
+    t = np.zeros(1, dtype=np.int64)
+    haversine_batch(x, x, t, x, x, t, 0.0, 0)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def haversine_par_prefiltered(xs, ys, zs, arr_lats, arr_lons, lat, lon, distance_km):
+    """Parallel haversine formula with a cheap prefilter.
+
+    Candidates (with unit vectors xs, ys, zs, see `unit_vectors`) outside
+    the latitude band or the squared chord length of the search circle are
+    rejected before the exact check. Both bounds have a small margin, so
+    the result is identical to `haversine_par`.
+    """
+    angle = min(distance_km / R, np.pi)
+    dlat = angle * 180 / np.pi + 1e-9
+    limit = (2 * np.sin(angle / 2)) ** 2 * (1 + 1e-9) + 1e-12
+    φ = lat * np.pi / 180
+    λ = lon * np.pi / 180
+    x, y, z = np.cos(φ) * np.cos(λ), np.cos(φ) * np.sin(λ), np.sin(φ)
+
+    result = np.full(arr_lats.size, False)
+    for i in prange(0, arr_lats.size):
+        if abs(arr_lats[i] - lat) > dlat:
+            continue
+        chord = (xs[i] - x) ** 2 + (ys[i] - y) ** 2 + (zs[i] - z) ** 2
+        if chord > limit:
+            continue
+        result[i] = haversine(arr_lats[i], arr_lons[i], lat, lon) <= distance_km
+    return result
+
+
+@jit(nopython=True, cache=True)
+def _worse(score1, j1, score2, j2):
+    """Order of the heap, ties are broken by the candidate position."""
+    return score1 > score2 or (score1 == score2 and j1 > j2)
+
+
+@jit(nopython=True, cache=True)
+def _heap_push(scores, positions, size, score, j):
+    """Add a candidate to a bounded max heap (the worst candidate on top)."""
+    k = scores.size
+    if size < k:
+        i = size
+        size += 1
+        while i > 0:
+            parent = (i - 1) // 2
+            if not _worse(score, j, scores[parent], positions[parent]):
+                break
+            scores[i], positions[i] = scores[parent], positions[parent]
+            i = parent
+    elif _worse(scores[0], positions[0], score, j):
+        i = 0
+        while True:
+            child = 2 * i + 1
+            if child >= k:
+                break
+            if child + 1 < k and _worse(
+                scores[child + 1], positions[child + 1], scores[child], positions[child]
+            ):
+                child += 1
+            if not _worse(scores[child], positions[child], score, j):
+                break
+            scores[i], positions[i] = scores[child], positions[child]
+            i = child
+    else:
+        return size
+    scores[i], positions[i] = score, j
+    return size
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def haversine_topk(
+    src_lats, src_lons, src_times, arr_lats, arr_lons, arr_times, distance_km, window, k
+):
+    """Return the k best candidates of many centers within distance and window.
+
+    Candidates are ranked by the score distance / distance_km + |dt| /
+    window, i.e. both offsets relative to their threshold, and are kept in
+    a bounded heap of size k per center. Returns (counts, indices,
+    distances, dts) where row i holds the counts[i] best candidates of
+    center i ordered by score, unused entries of indices are -1.
+    """
+    n = src_lats.size
+    lower = np.searchsorted(arr_times, src_times - window, side="left")
+    upper = np.searchsorted(arr_times, src_times + window, side="right")
+
+    counts = np.zeros(n, dtype=np.int64)
+    indices = np.full((n, k), -1, dtype=np.int64)
+    distances = np.full((n, k), np.nan)
+    dts = np.zeros((n, k), dtype=np.int64)
+    for i in prange(n):
+        scores = np.empty(k)
+        positions = np.empty(k, dtype=np.int64)
+        size = 0
+        for j in range(lower[i], upper[i]):
+            d = haversine(arr_lats[j], arr_lons[j], src_lats[i], src_lons[i])
+            if d > distance_km:
+                continue
+            score = 0.0
+            if distance_km > 0:
+                score += d / distance_km
+            if window > 0:
+                score += abs(arr_times[j] - src_times[i]) / window
+            size = _heap_push(scores, positions, size, score, j)
+
+        for a in range(1, size):  # insertion sort, k is small
+            b = a
+            while b > 0 and _worse(
+                scores[b - 1], positions[b - 1], scores[b], positions[b]
+            ):
+                scores[b - 1], scores[b] = scores[b], scores[b - 1]
+                positions[b - 1], positions[b] = positions[b], positions[b - 1]
+                b -= 1
+        for rank in range(size):
+            j = positions[rank]
+            indices[i, rank] = j
+            distances[i, rank] = haversine(
+                arr_lats[j], arr_lons[j], src_lats[i], src_lons[i]
+            )
+            dts[i, rank] = arr_times[j] - src_times[i]
+        counts[i] = size
+    return counts, indices, distances, dts
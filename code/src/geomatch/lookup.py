@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import concurrent.futures
+import time
+from datetime import timedelta
+
+from bson.objectid import ObjectId
+from pandas import concat
+
+from geomatch import geomatch as gm
+from geomatch import haversine as hv
+from geomatch import mongo as m
+from geomatch import spatial
+
+
+def parse_lookups(lines):
+    """Parse sources given one per line as _id (24 hex digits) or index.
+
+    Empty lines and comments (#) are skipped. Returns the ids and indices.
+    """
+    ids, indices = [], []
+    for line in lines:
+        text = line.split("#")[0].strip()
+        if not text:
+            continue
+        if len(text) == 24 and ObjectId.is_valid(text):
+            ids.append(text)
+        elif text.isdigit():
+            indices.append(int(text))
+        else:
+            raise ValueError(f"{text!r} is neither an ObjectId nor an index")
+    return ids, indices
+
+
+def get_sources(client, name, ids=(), indices=()):
+    """Get many sources by _id and by position in time as one frame.
+
+    The rows are in the order of `ids` followed by `indices`. Raises a
+    ValueError naming the sources which are not found.
+    """
+    if not ids and not indices:
+        raise ValueError("No sources given")
+    parts, missing = [], []
+    if ids:
+        query = {"_id": {"$in": [ObjectId(x) for x in ids]}}
+        frame = gm.get_collection(client, name, query=query)
+        rows = {} if frame is None else {str(x): i for i, x in enumerate(frame._id)}
+        missing.extend(x for x in ids if x not in rows)
+        if frame is not None:
+            parts.append(frame.iloc[[rows[x] for x in ids if x in rows]])
+    if indices:
+        frame = gm.get_head(client, name, max(indices) + 1)
+        n = 0 if frame is None else frame.index.size
+        missing.extend(str(x) for x in indices if x >= n)
+        if frame is not None:
+            parts.append(frame.iloc[[x for x in indices if x < n]])
+    if missing:
+        raise ValueError(f"No data in {name} for {', '.join(missing)}")
+    return concat(parts)
+
+
+def lookup(center, candidates, distance_km, delta, index=None):
+    """Return the candidates of a single center like `geomatch single`.
+
+    Without a `spatial.GridIndex` only the candidates within the temporal
+    boundaries (found by bisection of the sorted index) are filtered.
+    """
+    if index is not None:
+        filtered_s = gm.filter_by_distance(center, candidates, distance_km, index)
+        return gm.filter_by_time(center, filtered_s, delta)
+    tmin, tmax = gm.temporal_boundaries(center, delta)
+    lo = candidates.index.searchsorted(tmin, "left")
+    hi = candidates.index.searchsorted(tmax, "right")
+    filtered_t = gm.filter_by_time(center, candidates.iloc[lo:hi], delta)
+    return gm.filter_by_distance(center, filtered_t, distance_km)
+
+
+def lookup_many(
+    client,
+    name,
+    searchspace,
+    sources,
+    distance_km,
+    delta,
+    grid=False,
+    results=None,
+    mongo=True,
+    workers=None,
+):
+    """Look up many sources with the candidates loaded once.
+
+    The candidates of all sources are fetched in one query and the lookups
+    (and the `m.mongo_query` of every source with `mongo`) run in a thread
+    pool. With `results` (see `results.ResultCache`) cached sources are
+    not looked up and new matches are stored.
+
+    Returns the matches and the MongoDB matches (or None) per source row.
+    """
+    key = (f"{name}-{searchspace}", distance_km, delta)
+    candidates = gm.get_candidates(client, searchspace, sources, delta, distance_km)
+    index = spatial.GridIndex.from_frame(candidates) if grid else None
+    if index is None:
+        gm.add_unit_vectors(candidates)
+    centers = [sources.iloc[i] for i in range(sources.index.size)]
+    cached = [None] * len(centers)
+    if results is not None:
+        cached = [results.get(x._id, *key) for x in centers]
+
+    def run(center, hit):
+        if hit is not None:
+            return None, None
+        found = lookup(center, candidates, distance_km, delta, index)
+        res = None
+        if mongo:
+            res = m.mongo_query(client, center, distance_km, delta, searchspace)
+            res = sources.iloc[:0] if res is None else res
+        return found, res
+
+    hv.warm_up()  # the lookups run in the pool threads
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        done = list(pool.map(run, centers, cached))
+
+    if any(x is not None for x in cached):
+        rows = {str(x): i for i, x in enumerate(candidates._id)}
+        for i, hit in enumerate(cached):
+            if hit is not None:
+                found = candidates.iloc[[rows[x] for x in hit if x in rows]]
+                done[i] = (found, None)
+    if results is not None:
+        new = [(c._id, d[0]._id) for c, d, h in zip(centers, done, cached) if h is None]
+        results.put_many(new, *key)
+    return [x for x, _ in done], [x for _, x in done]
+
+
+def report(sources, found, mongo_found):
+    """Return the lookups of sources as list of dictionaries."""
+    entries = []
+    for i, (matches, res) in enumerate(zip(found, mongo_found)):
+        center = sources.iloc[i]
+        entry = dict(
+            source=str(center._id),
+            time=center.name.isoformat(),
+            lat=float(center.lat),
+            lon=float(center.lon),
+            matches=[str(x) for x in matches._id],
+        )
+        if res is not None:
+            entry["mongo"] = [str(x) for x in res._id]
+        entries.append(entry)
+    return entries
+
+
+def main(
+    distance_km,
+    delta,
+    lines,
+    tropomi_in_iasi: bool,
+    output=None,
+    grid=False,
+    results=None,
+    mongo=True,
+):
+    """Example application looking up all sources listed in `lines`."""
+    ids, indices = parse_lookups(lines)
+    print("Loading data")
+    client = gm.connect()
+    name, searchspace = gm.collections(tropomi_in_iasi)
+    sources = get_sources(client, name, ids, indices)
+
+    tic = time.perf_counter()
+    found, mongo_found = lookup_many(
+        client, name, searchspace, sources, distance_km, delta, grid, results, mongo
+    )
+    toc = time.perf_counter()
+    entries = report(sources, found, mongo_found)
+    for entry in entries:
+        text = f"There are {len(entry['matches'])} matches for {entry['source']}"
+        if "mongo" in entry:
+            text += f", Mongo: {len(entry['mongo'])}"
+        print(text)
+    print(f"Lookup of {len(entries)} sources was done in {toc - tic:0.4f} seconds")
+    if output is not None:
+        gm.to_json(
+            output,
+            dict(
+                distance=f"{distance_km} km",
+                delta=f"{delta.total_seconds()/60} min",
+                lookups=entries,
+            ),
+        )
+    return entries
+
+
+if __name__ == "__main__":
+    distance_km = 160.934
+    delta = timedelta(hours=6)
+    with open("edgecases.txt") as f:
+        main(distance_km, delta, f, True)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import contextlib
+import cProfile
+import json
+import threading
+import time
+from collections import defaultdict
+
+
+class Metrics:
+    """Thread safe timers and counters per stage of a match run.
+
+    Timers sum the wall time of all calls, so stages running in several
+    threads can add up to more than the elapsed time. Worker processes
+    (e.g. the `process` and `shared` engines) do not report back.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.seconds = defaultdict(float)
+            self.calls = defaultdict(int)
+            self.counters = defaultdict(int)
+            self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Time a block as part of a stage."""
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            toc = time.perf_counter()
+            with self.lock:
+                self.seconds[stage] += toc - tic
+                self.calls[stage] += 1
+
+    def count(self, name, n=1):
+        """Increase a counter by n."""
+        with self.lock:
+            self.counters[name] += int(n)
+
+    def summary(self):
+        """Return all timers and counters as json serialisable dictionary."""
+        with self.lock:
+            stages = {
+                k: dict(seconds=v, calls=self.calls[k]) for k, v in self.seconds.items()
+            }
+            return dict(
+                elapsed=time.perf_counter() - self.started,
+                stages=stages,
+                counters=dict(self.counters),
+            )
+
+
+METRICS = Metrics()
+timer = METRICS.timer
+count = METRICS.count
+
+
+def count_matches(matches):
+    """Count the sources and matches of a list of {source_id: [candidate_ids]}."""
+    count("sources", len(matches))
+    count("matches", sum(len(v) for x in matches for v in x.values()))
+
+
+def report(summary):
+    """Print a summary (see `Metrics.summary`) as table."""
+    print(f"Elapsed {summary['elapsed']:0.4f} seconds")
+    for stage, x in sorted(summary["stages"].items()):
+        print(f"  {stage:<24} {x['seconds']:>12.4f} s {x['calls']:>10} calls")
+    for name, value in sorted(summary["counters"].items()):
+        print(f"  {name:<24} {value:>12}")
+
+
+@contextlib.contextmanager
+def collect(output=None, profile=None):
+    """Collect the metrics of a run and report them at the end.
+
+    The summary is printed and written to `output` as json. With `profile`
+    the run is profiled with cProfile and the statistics are written to
+    that file (see `pstats`).
+    """
+    METRICS.reset()
+    profiler = cProfile.Profile() if profile is not None else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield METRICS
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            print(f"Profile is saved to: {profile}.")
+    summary = METRICS.summary()
+    report(summary)
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(summary, f)
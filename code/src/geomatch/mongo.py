@@ -2,10 +2,17 @@
 # coding: utf-8
 
 import concurrent.futures
+import threading
 import time
 from datetime import timedelta
 
+from pymongo import monitoring
+
 from geomatch import geomatch as gm
+from geomatch import haversine as hv
+from geomatch import metrics, points
+
+EARTH_RADIUS_KM = 6378.1  # radius MongoDB uses for $centerSphere
 
 
 def create_query(center, distance_km, delta):
@@ -18,7 +25,7 @@ def create_query(center, distance_km, delta):
                     "$geoWithin": {
                         "$centerSphere": [
                             [center.lon, center.lat],
-                            distance_km / 6378.1,
+                            distance_km / EARTH_RADIUS_KM,
                         ]
                     }
                 }
@@ -29,6 +36,109 @@ def create_query(center, distance_km, delta):
     return result
 
 
+def create_batch_query(centers, distance_km, delta):
+    """Create a single query for a batch of time adjacent centers.
+
+    The result is a superset of the results of `create_query` for every
+    center, see `assign_batch` for the assignment to the single centers.
+    """
+    tmin, _ = gm.temporal_boundaries(center=centers.iloc[0], delta=delta)
+    _, tmax = gm.temporal_boundaries(center=centers.iloc[-1], delta=delta)
+    circles = [
+        {
+            "loc": {
+                "$geoWithin": {
+                    "$centerSphere": [[lon, lat], distance_km / EARTH_RADIUS_KM],
+                }
+            }
+        }
+        for lat, lon in zip(centers.lat.values, centers.lon.values)
+    ]
+    result = {
+        "$and": [
+            {"$or": circles},
+            {"time": {"$gte": tmin, "$lte": tmax}},
+        ]
+    }
+    return result
+
+
+def assign_batch(centers, candidates, distance_km, delta):
+    """Assign the results of `create_batch_query` to the single centers.
+
+    Returns CSR arrays (offsets, indices) into the candidates. Like
+    `$centerSphere` the radius is an angle of distance_km / EARTH_RADIUS_KM.
+    """
+    offsets, indices, _ = hv.haversine_batch(
+        centers.lat.values,
+        centers.lon.values,
+        gm.index_as_ns(centers),
+        candidates.lat.values,
+        candidates.lon.values,
+        gm.index_as_ns(candidates),
+        distance_km * hv.R / EARTH_RADIUS_KM,
+        gm.temporal_window_ns(delta),
+    )
+    return offsets, indices
+
+
+def batch_query(client, centers, distance_km, delta, searchspace):
+    """Return the matches of a batch of centers with one MongoDB query."""
+    query = create_batch_query(centers, distance_km, delta)
+    metrics.count("mongo_queries")
+    with metrics.timer("mongo_query"):
+        cursor = gm.find(client[searchspace].v0, query)
+        candidates = gm._query_result_to_gdb(cursor)
+    if candidates is None:
+        return [[] for _ in range(centers.index.size)]
+    with metrics.timer("assign_batch"):
+        offsets, indices = assign_batch(centers, candidates, distance_km, delta)
+    found = points.PointStore.from_frame(candidates).ids(indices)
+    return [found[lo:hi] for lo, hi in zip(offsets[:-1], offsets[1:])]
+
+
+def batch_mongo(
+    client, source, distance_km, delta, searchspace, output=None, batch_size=100
+):
+    """Return all data within distance and temporal thresholds from MongoDB.
+
+    The time sorted source is split in batches of time adjacent centers and
+    every batch is queried with a single round trip (see `batch_query`).
+    """
+    hv.warm_up()  # `assign_batch` runs in the pool threads
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = {}
+        result = dict(
+            distance=f"{distance_km} km",
+            delta=f"{delta.total_seconds()/60} min",
+            matches=[],
+        )
+        ids = points.PointStore.from_frame(source).ids()
+        for start in range(0, source.index.size, batch_size):
+            stop = start + batch_size
+            centers = source.iloc[start:stop]
+            key = executor.submit(
+                batch_query, client, centers, distance_km, delta, searchspace
+            )
+            futures[key] = ids[start:stop]
+        print(f"Sending {len(futures)} batched queries")
+        with metrics.timer("futures"):
+            for future in concurrent.futures.as_completed(futures):
+                tropomi_ids = futures[future]
+                try:
+                    data = future.result()
+                except Exception as exc:
+                    print("%r generated an exception: %s" % (tropomi_ids[0], exc))
+                else:
+                    for tropomi_id, found in zip(tropomi_ids, data):
+                        print(f"There are {len(found)} matches for {tropomi_id}")
+                        result["matches"].append({tropomi_id: found})
+        metrics.count_matches(result["matches"])
+        if output is not None:
+            gm.to_json(output, result)
+    return result
+
+
 def parallel_mongo(
     client, source, distance_km, delta, searchspace, rparams=None, output=None
 ):
@@ -40,47 +150,224 @@ def parallel_mongo(
             delta=f"{delta.total_seconds()/60} min",
             matches=[],
         )
-        for k, center in source.iterrows():
+        for center in points.PointStore.from_frame(source).centers():
             key = executor.submit(
                 mongo_query, client, center, distance_km, delta, searchspace, rparams
             )
-            futures[key] = center["_id"]
-        for future in concurrent.futures.as_completed(futures):
-            tropomi_id = futures[future]
-            try:
-                data = future.result()
-            except Exception as exc:
-                print("%r generated an exception: %s" % (tropomi_id, exc))
-            else:
-                found = [str(x) for x in data._id] if data is not None else []
-                print(f"There are {len(found)} matches for {tropomi_id}")
-                result["matches"].append({str(tropomi_id): found})
+            futures[key] = center._id
+        with metrics.timer("futures"):
+            for future in concurrent.futures.as_completed(futures):
+                tropomi_id = futures[future]
+                try:
+                    data = future.result()
+                except Exception as exc:
+                    print("%r generated an exception: %s" % (tropomi_id, exc))
+                else:
+                    found = _ids(data)
+                    print(f"There are {len(found)} matches for {tropomi_id}")
+                    result["matches"].append({tropomi_id: found})
+        metrics.count_matches(result["matches"])
         if output is not None:
             gm.to_json(output, result)
+    return result
+
+
+def _ids(data):
+    """Return the ObjectIds of a query result as strings."""
+    return [] if data is None else points.PointStore.from_frame(data).ids()
+
+
+def _add_match(result, tropomi_id, future):
+    """Append the matches of a finished `mongo_query` to the result."""
+    try:
+        data = future.result()
+    except Exception as exc:
+        print("%r generated an exception: %s" % (tropomi_id, exc))
+    else:
+        found = _ids(data)
+        print(f"There are {len(found)} matches for {tropomi_id}")
+        result["matches"].append({tropomi_id: found})
+
+
+def bounded_mongo(
+    client,
+    source,
+    distance_km,
+    delta,
+    searchspace,
+    rparams=None,
+    output=None,
+    max_in_flight=32,
+):
+    """Return all data within distance and temporal thresholds from MongoDB.
+
+    Queries run in a thread pool of `max_in_flight` threads. A new query
+    is only submitted once a running one is finished, so at most
+    `max_in_flight` queries and their results are pending at a time.
+    """
+    result = dict(
+        distance=f"{distance_km} km",
+        delta=f"{delta.total_seconds()/60} min",
+        matches=[],
+    )
+    with concurrent.futures.ThreadPoolExecutor(max_in_flight) as executor:
+        pending = {}
+        for center in points.PointStore.from_frame(source).centers():
+            if len(pending) >= max_in_flight:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    _add_match(result, pending.pop(future), future)
+            key = executor.submit(
+                mongo_query, client, center, distance_km, delta, searchspace, rparams
+            )
+            pending[key] = center._id
+        for future in concurrent.futures.as_completed(pending):
+            _add_match(result, pending[future], future)
+    metrics.count_matches(result["matches"])
+    if output is not None:
+        gm.to_json(output, result)
+    return result
 
 
 def mongo_query(client, center, distance_km, delta, searchspace, rparams=None):
     """Return all data within distance and temporal window using MongoDB."""
     multiparam = create_query(center, distance_km, delta)
-    result = client[searchspace].v0.find(multiparam, rparams)
-    return gm._query_result_to_gdb(result)
+    projection = gm.PROJECTION if rparams is None else rparams
+    metrics.count("mongo_queries")
+    with metrics.timer("mongo_query"):
+        result = gm.find(client[searchspace].v0, multiparam, projection)
+        return gm._query_result_to_gdb(result)
+
+
+class RoundTrips(monitoring.CommandListener):
+    """Count the find and getMore commands, i.e. round trips, of a client."""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in ("find", "getMore"):
+            with self.lock:
+                self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
 
 
-def main(distance_km, delta, percentage, output, tropomi_in_iasi: bool):
+def compare_batch(
+    client, source, distance_km, delta, searchspace, batch_size=100, round_trips=None
+):
+    """Compare wall time and round trips of `batch_mongo` and `parallel_mongo`.
+
+    Round trips are only counted if the `RoundTrips` listener of the client
+    is given. Returns a dictionary with the measurements of both engines.
+    """
+    engines = dict(
+        thread=lambda: parallel_mongo(client, source, distance_km, delta, searchspace),
+        batch=lambda: batch_mongo(
+            client, source, distance_km, delta, searchspace, batch_size=batch_size
+        ),
+    )
+    stats, results = {}, {}
+    for name, run in engines.items():
+        before = None if round_trips is None else round_trips.count
+        tic = time.perf_counter()
+        results[name] = run()
+        toc = time.perf_counter()
+        stats[name] = dict(
+            seconds=toc - tic,
+            round_trips=None if before is None else round_trips.count - before,
+        )
+    found = [
+        {k: set(v) for x in r["matches"] for k, v in x.items()}
+        for r in results.values()
+    ]
+    stats["identical"] = found[0] == found[1]
+    return stats
+
+
+def benchmark(distance_km, delta, percentage, tropomi_in_iasi: bool, batch_size=100):
+    """Example application comparing batched and single MongoDB queries."""
+    round_trips = RoundTrips()
+    client = gm.connect(event_listeners=[round_trips])
+    if tropomi_in_iasi:
+        source, searchspace = gm.get_tropomi(client), "IASI"
+    else:
+        source, searchspace = gm.get_iasi(client), "TROPOMI"
+    n = int(source.index.size * percentage)
+
+    stats = compare_batch(
+        client,
+        source.iloc[:n],
+        distance_km,
+        delta,
+        searchspace,
+        batch_size,
+        round_trips,
+    )
+    for name in ("thread", "batch"):
+        x = stats[name]
+        print(
+            f"{name}: {n} centers in {x['seconds']:0.4f} seconds "
+            f"with {x['round_trips']} round trips"
+        )
+    print(f"Identical matches: {stats['identical']}")
+
+
+def main(
+    distance_km,
+    delta,
+    percentage,
+    output,
+    tropomi_in_iasi: bool,
+    engine="thread",
+    max_in_flight=32,
+    pool_size=None,
+    batch_size=100,
+):
     """Example application of the methods in this module."""
     print("Loading data")
-    client = gm.connect()
+    client = gm.connect(maxPoolSize=pool_size or max(max_in_flight, 100))
     if tropomi_in_iasi:
-        source = gm.get_tropomi(client)
-        searchspace = "IASI"
+        name, searchspace = "TROPOMI", "IASI"
     else:
-        source = gm.get_iasi(client)
-        searchspace = "TROPOMI"
-    n = int(source.index.size * percentage)
+        name, searchspace = "IASI", "TROPOMI"
+    n = int(client[name].v0.estimated_document_count() * percentage)
+    source = gm.get_head(client, name, n)
+    if source is None:
+        return
 
     print(f"Running {n} queries")
     tic = time.perf_counter()
-    parallel_mongo(client, source[:n], distance_km, delta, searchspace, output=output)
+    if engine == "batch":
+        print(f"Batching {batch_size} queries per round trip")
+        batch_mongo(
+            client,
+            source,
+            distance_km,
+            delta,
+            searchspace,
+            output=output,
+            batch_size=batch_size,
+        )
+    elif engine == "bounded":
+        bounded_mongo(
+            client,
+            source,
+            distance_km,
+            delta,
+            searchspace,
+            output=output,
+            max_in_flight=max_in_flight,
+        )
+    else:
+        parallel_mongo(client, source, distance_km, delta, searchspace, output=output)
     toc = time.perf_counter()
 
     print(f"Calculation was done in {toc - tic:0.4f} seconds")
@@ -93,3 +380,4 @@ if __name__ == "__main__":
     output = None
     tropomi_in_iasi = True
     main(distance_km, delta, percentage, output, tropomi_in_iasi)
+    benchmark(distance_km, delta, percentage, tropomi_in_iasi)
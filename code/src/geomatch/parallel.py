@@ -2,13 +2,22 @@
 # coding: utf-8
 
 import concurrent.futures
+import multiprocessing
+import os
+import tempfile
 import time
 from datetime import timedelta
 
+import numba
+import numpy as np
+
+from geomatch import edges
 from geomatch import geomatch as gm
+from geomatch import haversine as hv
+from geomatch import metrics, points, spatial
 
 
-def parallel_process(tropomi, iasi, distance_km, delta, output=None):
+def parallel_process(tropomi, iasi, distance_km, delta, output=None, index=None):
     """Return all data within temporal and spatial distance with a ProcessPool."""
     with concurrent.futures.ProcessPoolExecutor() as executor:
         futures = {}
@@ -17,25 +26,31 @@ def parallel_process(tropomi, iasi, distance_km, delta, output=None):
             delta=f"{delta.total_seconds()/60} min",
             matches=[],
         )
-        for k, center in tropomi.iterrows():
-            filtered = gm.filter_by_distance(center, iasi, distance_km)
+        if index is None:
+            gm.add_unit_vectors(iasi)
+        for center in points.PointStore.from_frame(tropomi).centers():
+            filtered = gm.filter_by_distance(center, iasi, distance_km, index)
             key = executor.submit(gm.filter_by_time, center, filtered, delta)
-            futures[key] = center["_id"]
-
-        for future in concurrent.futures.as_completed(futures):
-            tropomi_id = futures[future]
-            try:
-                data = future.result()
-            except Exception as exc:
-                print("%r generated an exception: %s" % (tropomi_id, exc))
-            else:
-                print(f"There are {data.index.size} matches for {tropomi_id}")
-                result["matches"].append({str(tropomi_id): [str(x) for x in data._id]})
+            futures[key] = center._id
+
+        with metrics.timer("futures"):
+            for future in concurrent.futures.as_completed(futures):
+                tropomi_id = futures[future]
+                try:
+                    data = future.result()
+                except Exception as exc:
+                    print("%r generated an exception: %s" % (tropomi_id, exc))
+                else:
+                    print(f"There are {data.index.size} matches for {tropomi_id}")
+                    found = points.PointStore.from_frame(data).ids()
+                    result["matches"].append({tropomi_id: found})
+        metrics.count_matches(result["matches"])
         if output is not None:
             gm.to_json(output, result)
+    return result
 
 
-def parallel_thread(tropomi, iasi, distance_km, delta, output=None):
+def parallel_thread(tropomi, iasi, distance_km, delta, output=None, index=None):
     """Return all data within temporal and spatial distance with a ThreadPool."""
     with concurrent.futures.ThreadPoolExecutor() as executor:
         futures = {}
@@ -44,40 +59,459 @@ def parallel_thread(tropomi, iasi, distance_km, delta, output=None):
             delta=f"{delta.total_seconds()/60} min",
             matches=[],
         )
-        for k, center in tropomi.iterrows():
-            filtered = gm.filter_by_distance(center, iasi, distance_km)
+        if index is None:
+            gm.add_unit_vectors(iasi)
+        for center in points.PointStore.from_frame(tropomi).centers():
+            filtered = gm.filter_by_distance(center, iasi, distance_km, index)
             key = executor.submit(gm.filter_by_time, center, filtered, delta)
-            futures[key] = center["_id"]
-
-        for future in concurrent.futures.as_completed(futures):
-            tropomi_id = futures[future]
-            try:
-                data = future.result()
-            except Exception as exc:
-                print("%r generated an exception: %s" % (tropomi_id, exc))
+            futures[key] = center._id
+
+        with metrics.timer("futures"):
+            for future in concurrent.futures.as_completed(futures):
+                tropomi_id = futures[future]
+                try:
+                    data = future.result()
+                except Exception as exc:
+                    print("%r generated an exception: %s" % (tropomi_id, exc))
+                else:
+                    print(f"There are {data.index.size} matches for {tropomi_id}")
+                    found = points.PointStore.from_frame(data).ids()
+                    result["matches"].append({tropomi_id: found})
+        metrics.count_matches(result["matches"])
+        if output is not None:
+            gm.to_json(output, result)
+    return result
+
+
+def parallel_sweep(tropomi, iasi, distance_km, delta, output=None, index=None):
+    """Return all data within temporal and spatial distance with a time sweep.
+
+    Both frames need to be sorted by time (see `gm._query_result_to_gdb`).
+    The temporal boundaries of all centers are merged into the sorted
+    candidate times, so the haversine formula is only evaluated for the
+    candidates within the time window of each center. With a spatial index
+    the candidates around each center are looked up first and then
+    restricted to the time window.
+    """
+    result = dict(
+        distance=f"{distance_km} km",
+        delta=f"{delta.total_seconds()/60} min",
+        matches=[],
+    )
+    sources = points.PointStore.from_frame(tropomi)
+    candidates = points.PointStore.from_frame(iasi)
+    window = gm.temporal_window_ns(delta)
+    lower, upper = candidates.windows(sources.times, window)
+
+    if index is None:
+        metrics.count("haversine_evaluations", np.sum(upper - lower))
+
+    lats = candidates.lats
+    lons = candidates.lons
+    if index is None:
+        xs, ys, zs = (gm.add_unit_vectors(iasi)[x].values for x in gm.UNIT_VECTORS)
+    centers = zip(sources.lats.tolist(), sources.lons.tolist(), sources.ids())
+    with metrics.timer("sweep"):
+        for (lat, lon, tropomi_id), lo, hi in zip(centers, lower, upper):
+            if index is not None:
+                positions = index.query(lat, lon, distance_km)
+                positions = positions[(positions >= lo) & (positions < hi)]
             else:
-                print(f"There are {data.index.size} matches for {tropomi_id}")
-                result["matches"].append({str(tropomi_id): [str(x) for x in data._id]})
+                mask = hv.haversine_par_prefiltered(
+                    xs[lo:hi],
+                    ys[lo:hi],
+                    zs[lo:hi],
+                    lats[lo:hi],
+                    lons[lo:hi],
+                    lat,
+                    lon,
+                    distance_km,
+                )
+                positions = lo + np.flatnonzero(mask)
+            found = candidates.ids(positions)
+            print(f"There are {len(found)} matches for {tropomi_id}")
+            result["matches"].append({tropomi_id: found})
+    metrics.count_matches(result["matches"])
+    if output is not None:
+        gm.to_json(output, result)
+    return result
+
+
+def parallel_batch(tropomi, iasi, distance_km, delta, output=None, index=None):
+    """Return all data within temporal and spatial distance with a batch kernel.
+
+    All centers are matched in a single call to `hv.haversine_batch` on the
+    NumPy arrays of both frames, without creating per-center frames. The
+    kernel does its own time windowing, a spatial index is not used.
+    """
+    result = dict(
+        distance=f"{distance_km} km",
+        delta=f"{delta.total_seconds()/60} min",
+        matches=[],
+    )
+    sources = points.PointStore.from_frame(tropomi)
+    candidates = points.PointStore.from_frame(iasi)
+    window = gm.temporal_window_ns(delta)
+    _count_evaluations(sources.times, candidates.times, window)
+    with metrics.timer("haversine_batch"):
+        offsets, indices, _ = hv.haversine_batch(
+            sources.lats,
+            sources.lons,
+            sources.times,
+            candidates.lats,
+            candidates.lons,
+            candidates.times,
+            float(distance_km),
+            window,
+        )
+    _add_csr_matches(result, sources, candidates, offsets, indices)
+    if output is not None:
+        gm.to_json(output, result)
+    return result
+
+
+def transpose_csr(offsets, indices, n):
+    """Return CSR matches seen from the n candidates.
+
+    Returns (offsets, indices, order) of the transposed matches, `order`
+    sorts the values of the matches (e.g. distances) by candidate. Matches
+    of a candidate keep the order of the sources.
+    """
+    source_idx = np.repeat(np.arange(offsets.size - 1), np.diff(offsets))
+    order = np.argsort(indices, kind="stable")
+    reverse = np.zeros(n + 1, dtype=np.int64)
+    reverse[1:] = np.cumsum(np.bincount(indices, minlength=n))
+    return reverse, source_idx[order], order
+
+
+def direction_output(output, name, searchspace):
+    """Return the output of a direction, e.g. matches.TROPOMI-IASI.json."""
+    root, ext = os.path.splitext(output)
+    return f"{root}.{name}-{searchspace}{ext}"
+
+
+def parallel_both(tropomi, iasi, distance_km, delta, outputs=(None, None), fmt="json"):
+    """Return the matches of both directions from a single batch kernel call.
+
+    The spatial and temporal criteria are symmetric, so the matches of the
+    candidates are the transposed matches of the sources (see
+    `transpose_csr`). Returns the results of both directions like
+    `parallel_batch` or, for the edges format, their number of edges.
+    """
+    sources = points.PointStore.from_frame(tropomi)
+    candidates = points.PointStore.from_frame(iasi)
+    window = gm.temporal_window_ns(delta)
+    _count_evaluations(sources.times, candidates.times, window)
+    with metrics.timer("haversine_batch"):
+        offsets, indices, distances = hv.haversine_batch(
+            sources.lats,
+            sources.lons,
+            sources.times,
+            candidates.lats,
+            candidates.lons,
+            candidates.times,
+            float(distance_km),
+            window,
+        )
+    reverse, reverse_indices, order = transpose_csr(offsets, indices, len(candidates))
+    directions = [
+        (tropomi, iasi, sources, candidates, offsets, indices, distances),
+        (
+            iasi,
+            tropomi,
+            candidates,
+            sources,
+            reverse,
+            reverse_indices,
+            distances[order],
+        ),
+    ]
+
+    found = []
+    for (src, dst, src_store, dst_store, *csr), output in zip(directions, outputs):
+        if fmt == "edges":
+            with edges.EdgeWriter(output, distance_km, delta) as writer:
+                writer.write(src, dst, *csr)
+            found.append(writer.n_edges)
+            continue
+        result = dict(
+            distance=f"{distance_km} km",
+            delta=f"{delta.total_seconds()/60} min",
+            matches=[],
+        )
+        _add_csr_matches(result, src_store, dst_store, *csr[:2])
         if output is not None:
             gm.to_json(output, result)
+        found.append(result)
+    return tuple(found)
+
 
+def parallel_topk(tropomi, iasi, distance_km, delta, k, output=None):
+    """Return the k best data within temporal and spatial distance.
 
-def main(distance_km, delta, percentage, output, tropomi_in_iasi: bool):
-    """Example application of the methods in this module."""
+    Candidates are ranked by their distance and time offset relative to the
+    thresholds (see `hv.haversine_topk`). Every match holds the id, the
+    distance [km] and the time offset [s] of the candidate to the source.
+    """
+    result = dict(
+        distance=f"{distance_km} km",
+        delta=f"{delta.total_seconds()/60} min",
+        mode=f"k={k}",
+        matches=[],
+    )
+    sources = points.PointStore.from_frame(tropomi)
+    candidates = points.PointStore.from_frame(iasi)
+    window = gm.temporal_window_ns(delta)
+    _count_evaluations(sources.times, candidates.times, window)
+    with metrics.timer("haversine_topk"):
+        counts, indices, distances, dts = hv.haversine_topk(
+            sources.lats,
+            sources.lons,
+            sources.times,
+            candidates.lats,
+            candidates.lons,
+            candidates.times,
+            float(distance_km),
+            window,
+            int(k),
+        )
+    found = candidates.ids(indices[indices >= 0])
+    distances = distances.tolist()
+    seconds = (dts / 1e9).tolist()
+    stops = np.cumsum(counts)
+    for i, tropomi_id in enumerate(sources.ids()):
+        start, stop = stops[i] - counts[i], stops[i]
+        matches = [
+            dict(id=x, distance_km=distances[i][r], dt_seconds=seconds[i][r])
+            for r, x in enumerate(found[start:stop])
+        ]
+        print(f"There are {len(matches)} matches for {tropomi_id}")
+        result["matches"].append({tropomi_id: matches})
+    metrics.count("sources", len(sources))
+    metrics.count("matches", len(found))
+    if output is not None:
+        gm.to_json(output, result)
+    return result
+
+
+def _count_evaluations(times, candidate_times, window):
+    """Count the haversine evaluations of `hv.haversine_batch`."""
+    lower = np.searchsorted(candidate_times, times - window, side="left")
+    upper = np.searchsorted(candidate_times, times + window, side="right")
+    metrics.count("haversine_evaluations", np.sum(upper - lower))
+
+
+def _add_csr_matches(result, sources, candidates, offsets, indices):
+    """Append CSR matches (offsets, indices) of `PointStore`s to the result."""
+    found = candidates.ids(indices)
+    for i, tropomi_id in enumerate(sources.ids()):
+        lo, hi = offsets[i], offsets[i + 1]
+        matches = found[lo:hi]
+        print(f"There are {len(matches)} matches for {tropomi_id}")
+        result["matches"].append({tropomi_id: matches})
+    metrics.count("sources", len(sources))
+    metrics.count("matches", indices.size)
+
+
+_SHARED = {}
+
+
+def _share_arrays(directory, **arrays):
+    """Write arrays to .npy files in directory, return their paths."""
+    paths = {}
+    for name, arr in arrays.items():
+        paths[name] = os.path.join(directory, f"{name}.npy")
+        np.save(paths[name], np.ascontiguousarray(arr))
+    return paths
+
+
+def _attach_arrays(paths):
+    """Initialise a worker process by memory mapping the shared arrays."""
+    numba.set_num_threads(1)
+    for name, path in paths.items():
+        _SHARED[name] = np.load(path, mmap_mode="r")
+
+
+def _match_range(start, stop, distance_km, window):
+    """Match the source rows [start, stop) against all shared candidates."""
+    a = _SHARED
+    offsets, indices, _ = hv.haversine_batch(
+        a["src_lat"][start:stop],
+        a["src_lon"][start:stop],
+        a["src_time"][start:stop],
+        a["lat"],
+        a["lon"],
+        a["time"],
+        distance_km,
+        window,
+    )
+    return start, offsets, indices
+
+
+def parallel_shared(
+    tropomi, iasi, distance_km, delta, output=None, index=None, workers=None
+):
+    """Return all data within temporal and spatial distance with a ProcessPool.
+
+    The columns of both frames are written once to memory mapped files which
+    every worker maps read only. Workers only receive ranges of source rows
+    and send back compact CSR arrays. Like `parallel_batch` the time
+    windowing happens in the kernel, a spatial index is not used.
+    """
+    result = dict(
+        distance=f"{distance_km} km",
+        delta=f"{delta.total_seconds()/60} min",
+        matches=[],
+    )
+    sources = points.PointStore.from_frame(tropomi)
+    candidates = points.PointStore.from_frame(iasi)
+    workers = workers or os.cpu_count()
+    n = len(sources)
+    step = max(1, -(-n // (workers * 4)))
+    window = gm.temporal_window_ns(delta)
+    _count_evaluations(sources.times, candidates.times, window)
+    hv.warm_up()
+
+    with tempfile.TemporaryDirectory(prefix="geomatch-") as directory:
+        paths = _share_arrays(
+            directory,
+            src_lat=sources.lats,
+            src_lon=sources.lons,
+            src_time=sources.times,
+            lat=candidates.lats,
+            lon=candidates.lons,
+            time=candidates.times,
+        )
+        # spawn: forking after numba started its threading layer is unsafe
+        with metrics.timer("haversine_batch"), concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_attach_arrays,
+            initargs=(paths,),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _match_range,
+                    start,
+                    min(start + step, n),
+                    float(distance_km),
+                    window,
+                )
+                for start in range(0, n, step)
+            ]
+            parts = sorted(f.result() for f in futures)
+
+    counts = [np.diff(offsets) for _, offsets, _ in parts]
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    if counts:
+        np.cumsum(np.concatenate(counts), out=offsets[1:])
+    indices = np.concatenate([x for _, _, x in parts] or [np.empty(0, np.int64)])
+    _add_csr_matches(result, sources, candidates, offsets, indices)
+    if output is not None:
+        gm.to_json(output, result)
+    return result
+
+
+def parallel_edges(
+    tropomi, iasi, distance_km, delta, output, rows=10_000, columns=edges.COLUMNS
+):
+    """Write all data within temporal and spatial distance as binary edge list.
+
+    Sources are matched with `hv.haversine_batch` in chunks of rows and
+    every chunk is appended to the output directory (see `edges`).
+    """
+    window = gm.temporal_window_ns(delta)
+    sources = points.PointStore.from_frame(tropomi)
+    candidates = points.PointStore.from_frame(iasi)
+    _count_evaluations(sources.times, candidates.times, window)
+    with edges.EdgeWriter(output, distance_km, delta, columns) as writer:
+        for start in range(0, len(sources), rows):
+            stop = start + rows
+            chunk = tropomi.iloc[start:stop]
+            part = sources[start:stop]
+            with metrics.timer("haversine_batch"):
+                offsets, indices, distances = hv.haversine_batch(
+                    part.lats,
+                    part.lons,
+                    part.times,
+                    candidates.lats,
+                    candidates.lons,
+                    candidates.times,
+                    float(distance_km),
+                    window,
+                )
+            with metrics.timer("output"):
+                writer.write(chunk, iasi, offsets, indices, distances)
+            metrics.count("sources", chunk.index.size)
+            metrics.count("matches", indices.size)
+            print(f"There are {indices.size} matches for {chunk.index.size} data")
+    return writer.n_edges
+
+
+ENGINES = {
+    "thread": parallel_thread,
+    "process": parallel_process,
+    "sweep": parallel_sweep,
+    "batch": parallel_batch,
+    "shared": parallel_shared,
+}
+INDEXED_ENGINES = ("thread", "process", "sweep")  # engines using a GridIndex
+
+
+def main(
+    distance_km,
+    delta,
+    percentage,
+    output,
+    tropomi_in_iasi: bool,
+    engine="thread",
+    grid=False,
+    fmt="json",
+    k=None,
+    both=False,
+):
+    """Example application of the methods in this module.
+
+    With k only the k best matches per source are written (see
+    `parallel_topk`). With `both` the matches of both directions are
+    written to two outputs (see `direction_output` and `parallel_both`).
+    """
     print("Loading data")
     client = gm.connect()
     if tropomi_in_iasi:
-        source = gm.get_tropomi(client)
-        candidates = gm.get_iasi(client)
+        name, searchspace = "TROPOMI", "IASI"
     else:
-        candidates = gm.get_tropomi(client)
-        source = gm.get_iasi(client)
+        name, searchspace = "IASI", "TROPOMI"
 
-    n = int(source.index.size * percentage)
+    n = int(client[name].v0.estimated_document_count() * percentage)
     print(f"Processing {n} data")
+    source = gm.get_head(client, name, n)
+    if source is None:
+        return
+    if both:
+        # all candidates are sources of the reverse direction
+        candidates = gm.get_collection(client, searchspace)
+        candidates = source.iloc[:0] if candidates is None else candidates
+    else:
+        candidates = gm.get_candidates(client, searchspace, source, delta, distance_km)
+    print(f"Loaded {candidates.index.size} candidates")
 
     tic = time.perf_counter()
-    parallel_thread(source[:n], candidates, distance_km, delta, output)
+    if both:
+        outputs = (None, None)
+        if output is not None:
+            outputs = (
+                direction_output(output, name, searchspace),
+                direction_output(output, searchspace, name),
+            )
+        parallel_both(source, candidates, distance_km, delta, outputs, fmt)
+    elif k is not None:
+        parallel_topk(source, candidates, distance_km, delta, k, output)
+    elif fmt == "edges":
+        parallel_edges(source, candidates, distance_km, delta, output)
+    else:
+        index = spatial.GridIndex.from_frame(candidates) if grid else None
+        ENGINES[engine](source, candidates, distance_km, delta, output, index)
     toc = time.perf_counter()
 
     print(f"Calculation was done in {toc - tic:0.4f} seconds")
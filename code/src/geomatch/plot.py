@@ -1,12 +1,22 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import os
+import time
 from datetime import timedelta
 
 import folium
+import numpy as np
+from bson.objectid import ObjectId
+from folium import plugins
 
 from . import geomatch as gm
+from . import haversine as hv
+from . import lookup
 from . import mongo as m
+from . import points
+from . import results as rs
+from . import spatial
 
 
 def generate_map(lat, lon, tiles="Stamen Terrain", zoom_start=5):
@@ -37,32 +47,81 @@ def add_center_radius(m, center, distance_km):
     return m
 
 
+def feature_collection(lats, lons, **properties):
+    """Return points as GeoJSON FeatureCollection.
+
+    The coordinates and the properties (one value per point) are arrays,
+    which are converted to Python objects in one pass each.
+    """
+    coordinates = np.column_stack([lons, lats]).tolist()
+    columns = {k: np.asarray(v).tolist() for k, v in properties.items()}
+    rows = (dict(zip(columns, x)) for x in zip(*columns.values()))
+    if not columns:
+        rows = ({} for _ in coordinates)
+    features = [
+        dict(type="Feature", geometry=dict(type="Point", coordinates=c), properties=x)
+        for c, x in zip(coordinates, rows)
+    ]
+    return dict(type="FeatureCollection", features=features)
+
+
+def line_collection(lats1, lons1, lats2, lons2):
+    """Return lines between two arrays of points as GeoJSON FeatureCollection."""
+    lines = np.stack(
+        [np.column_stack([lons1, lats1]), np.column_stack([lons2, lats2])], axis=1
+    ).tolist()
+    features = [
+        dict(type="Feature", geometry=dict(type="LineString", coordinates=x))
+        for x in lines
+    ]
+    return dict(type="FeatureCollection", features=features)
+
+
+def add_points(m, collection, color, fill, radius=5000, popup="popup", name=None):
+    """Add the points of a FeatureCollection as one GeoJSON layer to (m)."""
+    if not collection["features"]:
+        popup = None  # the popup fields are checked against the first feature
+    folium.GeoJson(
+        collection,
+        name=name,
+        marker=folium.Circle(radius=radius, color=color, fill=fill),
+        popup=folium.GeoJsonPopup(fields=[popup], labels=False) if popup else None,
+    ).add_to(m)
+    return m
+
+
+def add_clustered_points(m, lats, lons, popups, name=None):
+    """Add points as marker cluster rendered in the browser to (m)."""
+    data = np.column_stack([lats, lons]).tolist()
+    for row, popup in zip(data, popups):
+        row.append(popup)
+    callback = """function (row) {
+        return L.marker(new L.LatLng(row[0], row[1])).bindPopup(row[2]);
+    };"""
+    plugins.FastMarkerCluster(data, callback=callback, name=name).add_to(m)
+    return m
+
+
 def add_geomatch_results(m, center, results):
     """Add Geomatch results to Folium Map (m)."""
-    for i, res in results.iterrows():
-        time_diff = (center.name - i).total_seconds() / 60
-        sign = "+" if time_diff >= 0 else "-"
-        folium.Circle(
-            radius=5000,
-            location=[res.lat, res.lon],
-            popup="{}{:.2f} Min.".format(sign, abs(time_diff)),
-            color="red",
-            fill=True,
-        ).add_to(m)
-    return m
+    diff = (center.name - results.index).total_seconds().values / 60
+    popups = ["{}{:.2f} Min.".format("+" if x >= 0 else "-", abs(x)) for x in diff]
+    collection = feature_collection(
+        results.lat.values, results.lon.values, popup=popups
+    )
+    return add_points(m, collection, "red", True)
 
 
 def add_mongo_results(m, results):
     """Add MongoDB results to Folium Map (m)."""
-    for i, res in results.iterrows():
-        folium.Circle(
-            radius=5000,
-            location=[res.lat, res.lon],
-            popup="Time: {} <br>Lat: {:.2f}<br>Lon: {:.2f}".format(i, res.lat, res.lon),
-            color="green",
-            fill=False,
-        ).add_to(m)
-    return m
+    popups = [
+        "Time: {} <br>Lat: {:.2f}<br>Lon: {:.2f}".format(*x)
+        for x in zip(results.index, results.lat.values, results.lon.values)
+    ]
+    collection = feature_collection(
+        results.lat.values, results.lon.values, popup=popups
+    )
+    return add_points(m, collection, "green", False)
 
 
 def map_results(
@@ -89,38 +148,271 @@ def map_results(
     return m
 
 
-def main(distance_km, delta, ix, tropomi_in_iasi: bool, query=None, save=None):
-    """Example application of the methods defined in this module."""
+def downsample(n, max_points=None, seed=0):
+    """Return the sorted positions of at most `max_points` of n points."""
+    if max_points is None or n <= max_points:
+        return np.arange(n)
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(n, max_points, replace=False))
+
+
+def _times(store, positions):
+    times = store.times[positions].astype("datetime64[ns]")
+    return np.datetime_as_string(times, unit="s")
+
+
+def map_bulk(
+    sources,
+    candidates,
+    source_idx,
+    candidate_idx,
+    distance_km,
+    cluster=False,
+    max_points=None,
+    tiles="Stamen Terrain",
+    zoom_start=3,
+):
+    """Create one plot of the matches of many centers.
+
+    Sources and candidates are `points.PointStore`s and the matches pairs
+    of positions (`source_idx`, `candidate_idx`). Centers, matches and the
+    lines between them are added as one layer each (or as marker clusters
+    with `cluster`). With `max_points` at most this many centers and
+    matches are drawn, lines only between drawn points.
+    """
+    kept = np.zeros(len(sources), dtype=bool)
+    kept[downsample(len(sources), max_points)] = True
+    matched = np.unique(candidate_idx)
+    shown = np.zeros(len(candidates), dtype=bool)
+    shown[matched[downsample(matched.size, max_points)]] = True
+    pairs = kept[source_idx] & shown[candidate_idx]
+    source_idx, candidate_idx = source_idx[pairs], candidate_idx[pairs]
+
+    centers = np.flatnonzero(kept)
+    found = np.flatnonzero(shown)
+    counts = np.bincount(source_idx, minlength=len(sources))[centers]
+    center_popups = [
+        f"{x}<br>{t}<br>{n} matches"
+        for x, t, n in zip(sources.ids(centers), _times(sources, centers), counts)
+    ]
+    match_popups = [
+        f"{x}<br>{t}" for x, t in zip(candidates.ids(found), _times(candidates, found))
+    ]
+
+    lat = float(np.mean(sources.lats[centers])) if centers.size else 0.0
+    lon = float(np.mean(sources.lons[centers])) if centers.size else 0.0
+    m = generate_map(lat, lon, tiles, zoom_start)
+    folium.GeoJson(
+        line_collection(
+            sources.lats[source_idx],
+            sources.lons[source_idx],
+            candidates.lats[candidate_idx],
+            candidates.lons[candidate_idx],
+        ),
+        name="Links",
+        style_function=lambda x: dict(color="gray", weight=1),
+    ).add_to(m)
+    if cluster:
+        add_clustered_points(
+            m, sources.lats[centers], sources.lons[centers], center_popups, "Centers"
+        )
+        add_clustered_points(
+            m, candidates.lats[found], candidates.lons[found], match_popups, "Matches"
+        )
+    else:
+        center_layer = feature_collection(
+            sources.lats[centers], sources.lons[centers], popup=center_popups
+        )
+        add_points(
+            m, center_layer, "crimson", False, distance_km * 1000, name="Centers"
+        )
+        match_layer = feature_collection(
+            candidates.lats[found], candidates.lons[found], popup=match_popups
+        )
+        add_points(m, match_layer, "red", True, name="Matches")
+    folium.LayerControl().add_to(m)
+    return m
+
+
+def bulk_matches(client, name, searchspace, distance_km, delta, ids=None, result=None):
+    """Return the stores and match positions of many sources.
+
+    The sources are given by their ids (and searched like `par.parallel_batch`)
+    or by a match output (see `rs.read`), whose matches are loaded by id.
+    Matches of the top-k mode (dictionaries, see `par.parallel_topk`) are
+    given by their "id".
+    """
+    if result is not None:
+        matches = {
+            k: [x["id"] if isinstance(x, dict) else x for x in v]
+            for item in result["matches"]
+            for k, v in item.items()
+        }
+        ids = list(matches)
+    query = {"_id": {"$in": [ObjectId(x) for x in ids]}}
+    source = gm.get_collection(client, name, query=query)
+    if source is None:
+        raise ValueError(f"None of the sources are in {name}")
+    sources = points.PointStore.from_frame(source)
+
+    if result is None:
+        frame = gm.get_candidates(client, searchspace, source, delta, distance_km)
+        candidates = points.PointStore.from_frame(frame)
+        offsets, candidate_idx, _ = hv.haversine_batch(
+            sources.lats,
+            sources.lons,
+            sources.times,
+            candidates.lats,
+            candidates.lons,
+            candidates.times,
+            float(distance_km),
+            gm.temporal_window_ns(delta),
+        )
+        source_idx = np.repeat(np.arange(len(sources)), np.diff(offsets))
+        return sources, candidates, source_idx, candidate_idx
+
+    found = sorted({x for v in matches.values() for x in v})
+    query = {"_id": {"$in": [ObjectId(x) for x in found]}}
+    frame = gm.get_collection(client, searchspace, query=query)
+    frame = source.iloc[:0] if frame is None else frame
+    candidates = points.PointStore.from_frame(frame)
+    positions = {x: i for i, x in enumerate(candidates.ids())}
+    pairs = [
+        (i, positions[x])
+        for i, source_id in enumerate(sources.ids())
+        for x in matches[source_id]
+        if x in positions
+    ]
+    pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    return sources, candidates, pairs[:, 0], pairs[:, 1]
+
+
+def _show(plot, save=None):
+    if save is not None:
+        plot.save(save)
+        print(f"Plot is saved to: {save}.")
+    else:
+        plot.show_in_browser()
+
+
+def main(
+    distance_km,
+    delta,
+    ix,
+    tropomi_in_iasi: bool,
+    query=None,
+    save=None,
+    grid=False,
+    results=None,
+):
+    """Example application of the methods defined in this module.
+
+    With `results` (see `results.ResultCache`) cached matches are plotted
+    instead of searched, and new matches are stored.
+    """
     print("Loading data")
     client = gm.connect()
-    if tropomi_in_iasi:
-        source = gm.get_tropomi(client, query=query)  # size: 155.654
-        candidates = gm.get_iasi(client)  # size: 657.417
-        searchspace = "IASI"
+    name, searchspace = gm.collections(tropomi_in_iasi)
+    source = gm.get_source(client, name, ix, query)
+    center = source.iloc[0]
+    key = (f"{name}-{searchspace}", distance_km, delta)
+    found = None if results is None else results.get(center._id, *key)
+    if found is not None:
+        print(f"Cached: There are {len(found)} matches for {center._id}")
+        query = {"_id": {"$in": [ObjectId(x) for x in found]}}
+        matches = gm.get_collection(client, searchspace, query=query)
+        matches = source.iloc[:0] if matches is None else matches
+        _show(map_results(center, distance_km, matches), save)
+        return
+
+    candidates = gm.get_candidates(client, searchspace, source, delta, distance_km)
+    if grid:
+        print("Apply spatial constraints using grid index")
+        index = spatial.GridIndex.from_frame(candidates)
+        filtered_s = gm.filter_by_distance(center, candidates, distance_km, index)
+        print("Apply time constraints")
+        result_geomatch = gm.filter_by_time(center, filtered_s, delta)
     else:
-        candidates = gm.get_tropomi(client, query=query)  # size: 155.654
-        source = gm.get_iasi(client)  # size: 657.417
-        searchspace = "TROPOMI"
-
-    center = source.iloc[ix]
-    print("Apply time constraints")
-    filtered_t = gm.filter_by_time(center, candidates, delta)
-    print("Apply spatial constraints")
-    result_geomatch = gm.filter_by_distance(center, filtered_t, distance_km)
+        print("Apply time constraints")
+        gm.add_unit_vectors(candidates)
+        filtered_t = gm.filter_by_time(center, candidates, delta)
+        print("Apply spatial constraints")
+        result_geomatch = gm.filter_by_distance(center, filtered_t, distance_km)
     print(f"There are {result_geomatch.index.size} matches for {center._id}")
+    if results is not None:
+        results.put(center._id, result_geomatch._id, *key)
 
     res = m.mongo_query(client, center, distance_km, delta, searchspace)
     length = 0 if res is None else res.index.size
     print(f"Mongo: There are {length} matches for {center._id}")
 
     if length >= 0:
-        plot = map_results(center, distance_km, result_geomatch, res)
+        _show(map_results(center, distance_km, result_geomatch, res), save)
 
-        if save is not None:
-            plot.save(save)
-            print(f"Plot is saved to: {save}.")
-        else:
-            plot.show_in_browser()
+
+def main_many(
+    distance_km,
+    delta,
+    lines,
+    tropomi_in_iasi: bool,
+    save,
+    grid=False,
+    results=None,
+):
+    """Example application plotting one map per source listed in `lines`.
+
+    The sources are looked up together (see `lookup.lookup_many`) and the
+    maps are saved as <source _id>.html into the directory `save`.
+    """
+    ids, indices = lookup.parse_lookups(lines)
+    print("Loading data")
+    client = gm.connect()
+    name, searchspace = gm.collections(tropomi_in_iasi)
+    sources = lookup.get_sources(client, name, ids, indices)
+    tic = time.perf_counter()
+    found, mongo_found = lookup.lookup_many(
+        client, name, searchspace, sources, distance_km, delta, grid, results
+    )
+    os.makedirs(save, exist_ok=True)
+    for i, (matches, res) in enumerate(zip(found, mongo_found)):
+        center = sources.iloc[i]
+        print(f"There are {matches.index.size} matches for {center._id}")
+        plot = map_results(center, distance_km, matches, res)
+        plot.save(os.path.join(save, f"{center._id}.html"))
+    toc = time.perf_counter()
+    print(f"{len(found)} plots were saved to {save} in {toc - tic:0.4f} seconds")
+
+
+def main_bulk(
+    distance_km,
+    delta,
+    tropomi_in_iasi: bool,
+    ids=None,
+    path=None,
+    save=None,
+    cluster=False,
+    max_points=None,
+):
+    """Example application plotting the matches of many sources at once.
+
+    The sources are given by `ids` or by the match output at `path`, whose
+    settings replace `distance_km` and `delta`.
+    """
+    print("Loading data")
+    client = gm.connect()
+    name, searchspace = gm.collections(tropomi_in_iasi)
+    result = None
+    if path is not None:
+        result = rs.read(path)
+        distance_km, delta = rs.parse_settings(result)
+    tic = time.perf_counter()
+    found = bulk_matches(client, name, searchspace, distance_km, delta, ids, result)
+    sources, candidates, source_idx, _ = found
+    print(f"There are {source_idx.size} matches for {len(sources)} sources")
+    plot = map_bulk(*found, distance_km, cluster=cluster, max_points=max_points)
+    toc = time.perf_counter()
+    print(f"Plot was created in {toc - tic:0.4f} seconds")
+    _show(plot, save)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson.objectid import ObjectId
+from pandas import Timestamp
+
+from geomatch import edges
+from geomatch import geomatch as gm
+
+
+class Center:
+    """A single point with the attributes of a frame row used for matching."""
+
+    __slots__ = ("name", "lat", "lon", "_id")
+
+    def __init__(self, name, lat, lon, _id):
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+        self._id = _id
+
+
+class PointStore:
+    """Points sorted by time as struct of arrays.
+
+    Times are int64 nanoseconds since the epoch, lat/lon float64 degrees
+    and the ObjectIds a (n, 12) uint8 array. Slicing a store (by position
+    or with `time_slice`) shares the arrays instead of copying them.
+    """
+
+    __slots__ = ("times", "lats", "lons", "oids")
+
+    def __init__(self, times, lats, lons, oids):
+        self.times = times
+        self.lats = lats
+        self.lons = lons
+        self.oids = oids
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Wrap the columns of a frame (see `gm._query_result_to_gdb`)."""
+        return cls(
+            gm.index_as_ns(frame),
+            np.asarray(frame.lat.values, dtype=np.float64),
+            np.asarray(frame.lon.values, dtype=np.float64),
+            edges.object_id_bytes(frame._id.values),
+        )
+
+    def __len__(self):
+        return self.times.size
+
+    def __getitem__(self, item):
+        return type(self)(
+            self.times[item], self.lats[item], self.lons[item], self.oids[item]
+        )
+
+    @property
+    def nbytes(self):
+        return sum(x.nbytes for x in (self.times, self.lats, self.lons, self.oids))
+
+    def time_range(self, tmin, tmax):
+        """Return the positions [lo, hi) of the points within [tmin, tmax]."""
+        lo = np.searchsorted(self.times, Timestamp(tmin).value, "left")
+        hi = np.searchsorted(self.times, Timestamp(tmax).value, "right")
+        return lo, hi
+
+    def time_slice(self, tmin, tmax):
+        """Return the points within [tmin, tmax] as store."""
+        lo, hi = self.time_range(tmin, tmax)
+        return self[lo:hi]
+
+    def windows(self, times, window):
+        """Return positions [lower, upper) of the points within times +- window."""
+        lower = np.searchsorted(self.times, times - window, side="left")
+        upper = np.searchsorted(self.times, times + window, side="right")
+        return lower, upper
+
+    def ids(self, positions=None):
+        """Return the ObjectIds (of the positions) as hex strings."""
+        oids = self.oids if positions is None else self.oids[positions]
+        text = np.ascontiguousarray(oids).tobytes().hex()
+        bounds = range(0, len(text) + 1, 24)
+        return [text[lo:hi] for lo, hi in zip(bounds, bounds[1:])]
+
+    def centers(self):
+        """Yield the points as `Center`s, e.g. for `gm.filter_by_distance`."""
+        for t, lat, lon, oid in zip(
+            self.times.tolist(), self.lats.tolist(), self.lons.tolist(), self.ids()
+        ):
+            yield Center(Timestamp(t), lat, lon, oid)
+
+
+def main(n=657_417, seed=0):
+    """Example application comparing the memory of a frame and a store."""
+    rng = np.random.default_rng(seed)
+    frame = gm._query_result_to_gdb(
+        iter(
+            dict(
+                _id=ObjectId(),
+                id=i,
+                time=datetime(2023, 6, 1) + timedelta(seconds=t),
+                loc=dict(coordinates=[lon, lat]),
+            )
+            for i, (t, lat, lon) in enumerate(
+                zip(
+                    rng.uniform(0, 86400, n),
+                    rng.uniform(-90, 90, n),
+                    rng.uniform(-180, 180, n),
+                )
+            )
+        )
+    )
+    store = PointStore.from_frame(frame)
+    memory = frame.memory_usage(deep=True).sum()
+    print(f"Frame: {memory / n:0.1f} bytes, store: {store.nbytes / n:0.1f} bytes")
+
+    tic = time.perf_counter()
+    for _ in frame.iloc[:10_000].iterrows():
+        pass
+    toc = time.perf_counter()
+    print(f"iterrows: {(toc - tic) / 10_000 * 1e6:0.2f} us per row")
+    tic = time.perf_counter()
+    for _ in store[:10_000].centers():
+        pass
+    toc = time.perf_counter()
+    print(f"centers: {(toc - tic) / 10_000 * 1e6:0.2f} us per row")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+
+from . import cache as lc
+from . import edges
+from . import geomatch as gm
+
+MAX_BYTES = 256 * 2**20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    source TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    distance REAL NOT NULL,
+    delta REAL NOT NULL,
+    matches TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used INTEGER NOT NULL,
+    PRIMARY KEY (source, direction, distance, delta)
+);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+"""
+
+
+def direction(tropomi_in_iasi: bool):
+    """Return the direction of a search, e.g. "TROPOMI-IASI"."""
+    return "-".join(gm.collections(tropomi_in_iasi))
+
+
+def _key(source_id, distance_km, delta):
+    return str(source_id), float(distance_km), delta.total_seconds()
+
+
+class ResultCache:
+    """Matches per source in a SQLite database with LRU eviction.
+
+    Entries are keyed by source _id, direction (see `direction`), distance
+    and delta and hold the _ids of the matches. The least recently used
+    entries are evicted once the stored matches exceed `max_bytes`.
+    """
+
+    def __init__(self, path=None, max_bytes=MAX_BYTES):
+        if path is None:
+            os.makedirs(lc.cache_dir(), exist_ok=True)
+            path = os.path.join(lc.cache_dir(), "results.sqlite")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT count(*) FROM results").fetchone()[0]
+
+    def size(self):
+        """Return the number of bytes of all stored matches."""
+        with self.lock:
+            query = "SELECT coalesce(sum(size), 0) FROM results"
+            return self.db.execute(query).fetchone()[0]
+
+    def get(self, source_id, direction, distance_km, delta):
+        """Return the cached matches of a source or None."""
+        source, distance, seconds = _key(source_id, distance_km, delta)
+        where = "source = ? AND direction = ? AND distance = ? AND delta = ?"
+        with self.lock, self.db:
+            row = self.db.execute(
+                f"SELECT matches FROM results WHERE {where}",
+                (source, direction, distance, seconds),
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                f"UPDATE results SET used = ? WHERE {where}",
+                (time.time_ns(), source, direction, distance, seconds),
+            )
+        return json.loads(row[0])
+
+    def put_many(self, matches, direction, distance_km, delta):
+        """Store (source_id, match_ids) pairs in one transaction."""
+        used = time.time_ns()
+        rows = []
+        for source_id, found in matches:
+            source, distance, seconds = _key(source_id, distance_km, delta)
+            text = json.dumps([str(x) for x in found])
+            size = len(text) + len(source)
+            rows.append((source, direction, distance, seconds, text, size, used))
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._evict()
+        return len(rows)
+
+    def put(self, source_id, match_ids, direction, distance_km, delta):
+        """Store the matches of a single source."""
+        self.put_many([(source_id, match_ids)], direction, distance_km, delta)
+
+    def _evict(self):
+        total = self.db.execute("SELECT coalesce(sum(size), 0) FROM results")
+        excess = total.fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        cursor = self.db.execute("SELECT rowid, size FROM results ORDER BY used")
+        evicted = []
+        for rowid, size in cursor:
+            if excess <= 0:
+                break
+            evicted.append((rowid,))
+            excess -= size
+        self.db.executemany("DELETE FROM results WHERE rowid = ?", evicted)
+
+    def clear(self):
+        """Remove all entries."""
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM results")
+
+
+def parse_settings(result):
+    """Return distance [km] and delta of a result (see `gm.to_json`)."""
+    distance = float(result["distance"].split()[0])
+    delta = timedelta(minutes=float(result["delta"].split()[0]))
+    return distance, delta
+
+
+def read(path):
+    """Read a match output (json or edge list) as result of `gm.to_json`."""
+    if os.path.isdir(path):
+        return edges.to_matches(*edges.read_edges(path))
+    with open(path) as f:
+        return json.load(f)
+
+
+def populate(results, path, direction):
+    """Store all matches of a match output (json or edge list) in the cache.
+
+    Returns the number of stored sources.
+    """
+    result = read(path)
+    distance_km, delta = parse_settings(result)
+    pairs = (item for x in result["matches"] for item in x.items())
+    return results.put_many(pairs, direction, distance_km, delta)
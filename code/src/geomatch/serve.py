@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+import socketserver
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from pandas import Series, Timestamp
+
+from . import geomatch as gm
+from . import haversine as hv
+from . import points, spatial
+
+
+class MatchService:
+    """Answer match requests from collections loaded once into memory.
+
+    Both collections are kept with their unit vectors, a point store (and
+    optionally a `spatial.GridIndex`), so a request only slices the sorted
+    times and applies `gm.filter_by_time` and `gm.filter_by_distance` like
+    `geomatch single`.
+    """
+
+    def __init__(self, frames, distance_km, delta, grid=False):
+        hv.warm_up()  # the requests are answered in the handler threads
+        self.frames = {k: gm.add_unit_vectors(v) for k, v in frames.items()}
+        self.distance_km = distance_km
+        self.delta = delta
+        self.stores = {
+            k: points.PointStore.from_frame(v) for k, v in self.frames.items()
+        }
+        self.ids = {
+            k: {x: i for i, x in enumerate(v.ids())} for k, v in self.stores.items()
+        }
+        self.indexes = {}
+        if grid:
+            self.indexes = {
+                k: spatial.GridIndex.from_frame(v) for k, v in self.frames.items()
+            }
+
+    @classmethod
+    def from_client(cls, client, distance_km, delta, grid=False):
+        """Load both collections (see `gm.get_collection`)."""
+        frames = {x: gm.get_collection(client, x) for x in ("TROPOMI", "IASI")}
+        for name, frame in frames.items():
+            if frame is None:
+                raise ValueError(f"No data in {name}")
+        return cls(frames, distance_km, delta, grid)
+
+    def center(self, name, source_id):
+        """Return the row of a source by its _id (KeyError if unknown)."""
+        return self.frames[name].iloc[self.ids[name][str(source_id)]]
+
+    def match(self, center, searchspace, distance_km=None, delta=None):
+        """Return the candidates of a center (a row with lat, lon and time)."""
+        distance_km = self.distance_km if distance_km is None else distance_km
+        delta = self.delta if delta is None else delta
+        candidates = self.frames[searchspace]
+        index = self.indexes.get(searchspace)
+        if index is not None:
+            filtered_s = gm.filter_by_distance(center, candidates, distance_km, index)
+            return gm.filter_by_time(center, filtered_s, delta)
+
+        lo, hi = self.stores[searchspace].time_range(
+            *gm.temporal_boundaries(center, delta)
+        )
+        filtered_t = gm.filter_by_time(center, candidates.iloc[lo:hi], delta)
+        return gm.filter_by_distance(center, filtered_t, distance_km)
+
+    def request(self, params):
+        """Answer a request given as dictionary of query parameters.
+
+        A center is given by `id` (a source _id) or by `lat`, `lon` and
+        `time` (ISO format). `direction` (e.g. "IASI-TROPOMI"), `km` and
+        `min` override the defaults of the service.
+        """
+        name, searchspace = params.get("direction", "TROPOMI-IASI").split("-")
+        if searchspace not in self.frames or name == searchspace:
+            raise ValueError(f"Unknown direction {params['direction']!r}")
+        distance_km = float(params["km"]) if "km" in params else None
+        delta = timedelta(minutes=float(params["min"])) if "min" in params else None
+        if "id" in params:
+            center = self.center(name, params["id"])
+            source_id = str(center._id)
+        elif not {"lat", "lon", "time"} <= params.keys():
+            raise ValueError("A center is given by id or by lat, lon and time")
+        else:
+            center = Series(
+                dict(lat=float(params["lat"]), lon=float(params["lon"])),
+                name=Timestamp(params["time"]),
+            )
+            source_id = None
+        found = self.match(center, searchspace, distance_km, delta)
+        return dict(
+            source=source_id,
+            lat=float(center.lat),
+            lon=float(center.lon),
+            time=center.name.isoformat(),
+            matches=points.PointStore.from_frame(found).ids(),
+        )
+
+
+class MatchHandler(BaseHTTPRequestHandler):
+    """HTTP handler answering GET /match requests of a `MatchService`."""
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == "/health":
+            counts = {k: v.index.size for k, v in self.service.frames.items()}
+            return self._send(200, counts)
+        if url.path != "/match":
+            return self._send(404, dict(error=f"Unknown path {url.path}"))
+        try:
+            return self._send(200, self.service.request(params))
+        except KeyError as exc:
+            return self._send(404, dict(error=f"Unknown source {exc}"))
+        except ValueError as exc:
+            return self._send(400, dict(error=str(exc)))
+
+    def _send(self, status, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # clients of Unix sockets have no (host, port) address
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+def make_server(service, host="127.0.0.1", port=8000, socket=None):
+    """Return a threading HTTP server (on a Unix socket if given)."""
+    if socket is not None:
+        if os.path.exists(socket):
+            os.remove(socket)
+        server = ThreadingUnixHTTPServer(socket, MatchHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), MatchHandler)
+    server.service = service
+    return server
+
+
+def main(distance_km, delta, grid=False, host="127.0.0.1", port=8000, socket=None):
+    """Example application of the methods in this module."""
+    print("Loading data")
+    client = gm.connect()
+    tic = time.perf_counter()
+    service = MatchService.from_client(client, distance_km, delta, grid)
+    toc = time.perf_counter()
+    counts = ", ".join(f"{v.index.size} {k}" for k, v in service.frames.items())
+    print(f"Loaded {counts} in {toc - tic:0.4f} seconds")
+
+    server = make_server(service, host, port, socket)
+    where = socket if socket is not None else f"http://{host}:{port}"
+    print(f"Serving matches on {where}/match")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    distance_km = 160.934
+    delta = timedelta(hours=6)
+    main(distance_km, delta)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import time
+from datetime import timedelta
+
+from geomatch import geomatch as gm
+from geomatch import parallel as par
+from geomatch import spatial, stream
+
+
+def parse_shard(text):
+    """Parse a shard given as "i/n" (1 <= i <= n) to (i, n)."""
+    try:
+        i, n = (int(x) for x in text.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard {text!r} is not of the form i/n") from None
+    if not 1 <= i <= n:
+        raise ValueError(f"Shard {text!r} is not within 1/{n} and {n}/{n}")
+    return i, n
+
+
+def shard_bounds(start, stop, i, n):
+    """Return the time range [tmin, tmax) of shard i of n over [start, stop].
+
+    The last shard includes `stop`, so all shards together cover the time
+    extent exactly once.
+    """
+    step = (stop - start) / n
+    tmin = start + step * (i - 1)
+    tmax = stop if i == n else start + step * i
+    return tmin, tmax
+
+
+def parallel_shard(
+    client,
+    source,
+    searchspace,
+    distance_km,
+    delta,
+    shard,
+    output=None,
+    engine="batch",
+    grid=False,
+):
+    """Return the matches of one time shard of the source collection.
+
+    Only the sources within the shard bounds (see `shard_bounds`) and the
+    candidates within these bounds widened by the temporal boundaries
+    (+- delta/2) are fetched. The partial output records the time extent
+    and the shard bounds, so it can be checked and combined with the other
+    shards by `merge`.
+    """
+    i, n = shard
+    start, stop = stream.time_extent(client, source)
+    result = dict(
+        distance=f"{distance_km} km",
+        delta=f"{delta.total_seconds()/60} min",
+        shard=f"{i}/{n}",
+        start=None,
+        stop=None,
+        bounds=None,
+        matches=[],
+    )
+    if start is not None:
+        tmin, tmax = shard_bounds(start, stop, i, n)
+        result["start"], result["stop"] = start.isoformat(), stop.isoformat()
+        result["bounds"] = [tmin.isoformat(), tmax.isoformat()]
+        last = i == n
+        sources = stream.get_time_range(client, source, tmin, tmax, closed=last)
+        window = delta / 2
+        candidates = stream.get_time_range(
+            client, searchspace, tmin - window, tmax + window, closed=True
+        )
+        if sources is not None and candidates is None:
+            result["matches"] = [{str(x): []} for x in sources._id]
+        elif sources is not None:
+            index = spatial.GridIndex.from_frame(candidates) if grid else None
+            found = par.ENGINES[engine](
+                sources, candidates, distance_km, delta, index=index
+            )
+            result["matches"] = found["matches"]
+    if output is not None:
+        gm.to_json(output, result)
+    return result
+
+
+def merge(paths, output=None):
+    """Combine the partial outputs of all shards of a run.
+
+    The shards need to be complete, share distance, delta and time extent
+    and their bounds need to tile the extent, otherwise data ingested
+    between the runs could be matched twice or not at all. A source in
+    more than one shard is rejected too. Matches are ordered by shard and
+    by source id, so the merged output does not depend on the order of
+    `paths` or of the matches within a shard.
+    """
+    parts = {}
+    for path in paths:
+        with open(path) as f:
+            part = json.load(f)
+        if "bounds" not in part:
+            raise ValueError(f"Shard {path} has no time extent, rerun it")
+        parts[parse_shard(part["shard"])] = part
+    counts = {n for _, n in parts}
+    if len(counts) != 1 or len(parts) != next(iter(counts)):
+        raise ValueError(f"Shards {sorted(parts)} are not a complete set")
+    headers = {(x["distance"], x["delta"]) for x in parts.values()}
+    if len(headers) != 1:
+        raise ValueError(f"Shards were created with different settings {headers}")
+    extents = {(x["start"], x["stop"]) for x in parts.values()}
+    if len(extents) != 1:
+        raise ValueError(f"Shards were created for different time extents {extents}")
+    start, stop = extents.pop()
+    if start is not None:
+        bounds = [parts[key]["bounds"] for key in sorted(parts)]
+        edges = [start] + [t for x in bounds for t in x] + [stop]
+        if edges[::2] != edges[1::2]:
+            raise ValueError(f"Shard bounds {bounds} do not tile {start} to {stop}")
+
+    distance, delta = headers.pop()
+    result = dict(distance=distance, delta=delta, matches=[])
+    seen, duplicates = set(), set()
+    for key in sorted(parts):
+        matches = parts[key]["matches"]
+        for x in matches:
+            source_id = next(iter(x))
+            if source_id in seen:
+                duplicates.add(source_id)
+            seen.add(source_id)
+        result["matches"].extend(sorted(matches, key=lambda x: next(iter(x))))
+    if duplicates:
+        raise ValueError(f"Sources {sorted(duplicates)} are in more than one shard")
+    if output is not None:
+        gm.to_json(output, result)
+    return result
+
+
+def main(distance_km, delta, output, tropomi_in_iasi: bool, shard, engine, grid):
+    """Example application of the methods in this module."""
+    client = gm.connect()
+    if tropomi_in_iasi:
+        source, searchspace = "TROPOMI", "IASI"
+    else:
+        source, searchspace = "IASI", "TROPOMI"
+
+    print(f"Processing shard {shard[0]}/{shard[1]}")
+    tic = time.perf_counter()
+    result = parallel_shard(
+        client, source, searchspace, distance_km, delta, shard, output, engine, grid
+    )
+    toc = time.perf_counter()
+
+    n = len(result["matches"])
+    print(f"Calculation of {n} data was done in {toc - tic:0.4f} seconds")
+
+
+if __name__ == "__main__":
+    distance_km = 160.934
+    delta = timedelta(hours=6)
+    output = "matches.1.json"
+    tropomi_in_iasi = True
+    main(distance_km, delta, output, tropomi_in_iasi, (1, 4), "batch", False)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+
+import numpy as np
+
+from . import haversine as hv
+from . import metrics
+
+R = hv.R
+
+
+class GridIndex:
+    """Spatial index bucketing points into a regular lat/lon grid.
+
+    The index is built once over the candidate points. Radius queries only
+    evaluate the haversine formula for points in the grid cells overlapping
+    the bounding box of the search circle. Returned positions refer to the
+    row positions of the arrays (or frame) the index was built from.
+    """
+
+    def __init__(self, lats, lons, cell_deg=1.0):
+        self.lats = np.ascontiguousarray(lats, dtype=np.float64)
+        self.lons = np.ascontiguousarray(lons, dtype=np.float64)
+        self.cell_deg = cell_deg
+        self.n_rows = int(np.ceil(180 / cell_deg))
+        self.n_cols = int(np.ceil(360 / cell_deg))
+
+        cells = self._rows(self.lats) * self.n_cols + self._cols(self.lons)
+        self.order = np.argsort(cells, kind="stable")
+        counts = np.bincount(cells, minlength=self.n_rows * self.n_cols)
+        self.offsets = np.zeros(counts.size + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+
+    @classmethod
+    def from_frame(cls, frame, cell_deg=1.0):
+        """Build the index over the lat/lon columns of a frame."""
+        return cls(frame.lat.values, frame.lon.values, cell_deg)
+
+    def __len__(self):
+        return self.lats.size
+
+    def _rows(self, lats):
+        rows = np.floor((np.asarray(lats) + 90) / self.cell_deg).astype(np.int64)
+        return np.clip(rows, 0, self.n_rows - 1)
+
+    def _cols(self, lons):
+        lons = np.mod(np.asarray(lons) + 180, 360)
+        cols = np.floor(lons / self.cell_deg).astype(np.int64)
+        return np.clip(cols, 0, self.n_cols - 1)
+
+    def _col_ranges(self, lat, lon, distance_km, lat_min, lat_max):
+        """Return the (inclusive) column ranges covered by the search circle."""
+        everything = [(0, self.n_cols - 1)]
+        if lat_min <= -90 or lat_max >= 90:
+            return everything
+        ratio = np.sin(distance_km / R) / np.cos(np.radians(lat))
+        if ratio >= 1:
+            return everything
+        dlon = np.degrees(np.arcsin(ratio)) + 1e-9
+        first = int(np.floor((lon - dlon + 180) / self.cell_deg))
+        last = int(np.floor((lon + dlon + 180) / self.cell_deg))
+        if last - first + 1 >= self.n_cols:
+            return everything
+        first %= self.n_cols
+        last %= self.n_cols
+        if first <= last:
+            return [(first, last)]
+        return [(first, self.n_cols - 1), (0, last)]
+
+    def candidates(self, lat, lon, distance_km):
+        """Return positions of all points in cells overlapping the circle."""
+        if distance_km / R >= np.pi:
+            return np.arange(len(self))
+        dlat = np.degrees(distance_km / R) + 1e-9
+        lat_min, lat_max = lat - dlat, lat + dlat
+        rows = range(self._rows(lat_min), self._rows(lat_max) + 1)
+        ranges = self._col_ranges(lat, lon, distance_km, lat_min, lat_max)
+
+        parts = []
+        for row in rows:
+            for first, last in ranges:
+                lo = self.offsets[row * self.n_cols + first]
+                hi = self.offsets[row * self.n_cols + last + 1]
+                if hi > lo:
+                    parts.append(self.order[lo:hi])
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts)
+
+    def query(self, lat, lon, distance_km):
+        """Return sorted positions of all points within distance_km."""
+        positions = self.candidates(lat, lon, distance_km)
+        metrics.count("haversine_evaluations", positions.size)
+        mask = hv.haversine_par(
+            self.lats[positions], self.lons[positions], lat, lon, distance_km
+        )
+        return np.sort(positions[mask])
+
+
+def main(n=657_417, queries=1_000, seed=0):
+    """Example application comparing the grid index with brute force."""
+    rng = np.random.default_rng(seed)
+    lats = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    lons = rng.uniform(-180, 180, n)
+    centers = np.column_stack(
+        [
+            np.degrees(np.arcsin(rng.uniform(-1, 1, queries))),
+            rng.uniform(-180, 180, queries),
+        ]
+    )
+
+    tic = time.perf_counter()
+    index = GridIndex(lats, lons)
+    toc = time.perf_counter()
+    print(f"Index over {n} points was built in {toc - tic:0.4f} seconds")
+
+    hv.haversine_par(lats[:1], lons[:1], 0.0, 0.0, 1.0)  # compile
+    for distance_km in (20.0, 160.934):
+        tic = time.perf_counter()
+        brute = [
+            np.flatnonzero(hv.haversine_par(lats, lons, lat, lon, distance_km))
+            for lat, lon in centers
+        ]
+        brute_time = time.perf_counter() - tic
+
+        tic = time.perf_counter()
+        grid = [index.query(lat, lon, distance_km) for lat, lon in centers]
+        grid_time = time.perf_counter() - tic
+
+        assert all(np.array_equal(a, b) for a, b in zip(brute, grid))
+        print(
+            f"{distance_km} km: brute force {brute_time:0.4f} s, "
+            f"grid {grid_time:0.4f} s, speedup {brute_time / grid_time:0.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
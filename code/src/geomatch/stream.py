@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+from datetime import timedelta
+
+import pandas as pd
+
+from geomatch import geomatch as gm
+from geomatch import metrics
+from geomatch import parallel as par
+
+
+def time_extent(client, name):
+    """Return the first and last timestamp of a collection."""
+    collection = client[name].v0
+    first = collection.find_one(sort=[("time", 1)], projection={"time": 1})
+    last = collection.find_one(sort=[("time", -1)], projection={"time": 1})
+    if first is None:
+        return None, None
+    return first["time"], last["time"]
+
+
+def get_time_range(client, name, tmin, tmax, closed=False):
+    """Get the data of a collection within [tmin, tmax) or [tmin, tmax]."""
+    query = {"time": {"$gte": tmin, "$lte" if closed else "$lt": tmax}}
+    return gm.get_collection(client, name, query=query)
+
+
+def iter_chunks(client, source, searchspace, delta, chunk, start, stop):
+    """Yield time ordered chunks of sources with all candidates they need.
+
+    Sources are read in windows [t0, t0 + chunk), the last window ends at
+    `stop` and includes it. The candidates are read once: the part of the
+    previous chunk within the temporal boundaries of the next one is kept
+    as overlap buffer and only newer candidates are fetched.
+    """
+    window = delta / 2
+    buffer = None
+    fetched = start - window
+    t0 = start
+    last = False
+    while not last:
+        t1 = min(t0 + chunk, stop)
+        last = t1 == stop
+        sources = get_time_range(client, source, t0, t1, closed=last)
+        new = get_time_range(client, searchspace, fetched, t1 + window, closed=last)
+        fetched = t1 + window
+        frames = [x for x in (buffer, new) if x is not None]
+        candidates = pd.concat(frames) if frames else None
+        if candidates is not None:
+            candidates = candidates[candidates.index >= t0 - window]
+        buffer = candidates
+        yield t0, t1, sources, candidates
+        t0 = t1
+
+
+def parallel_stream(
+    client,
+    source,
+    searchspace,
+    distance_km,
+    delta,
+    output=None,
+    chunk=timedelta(hours=6),
+    percentage=1,
+):
+    """Return the number of matches, streaming over time ordered chunks.
+
+    Peak memory is bounded by the size of the chunks, matches are written
+    to the output after each chunk. The percentage limits the processed
+    time span of the source collection.
+    """
+    start, stop = time_extent(client, source)
+    if start is None:
+        return 0
+    stop = start + (stop - start) * percentage
+
+    with gm.MatchWriter(output, distance_km, delta) as writer:
+        chunks = iter_chunks(client, source, searchspace, delta, chunk, start, stop)
+        for t0, t1, sources, candidates in chunks:
+            if sources is None:
+                continue
+            if candidates is None:
+                matches = [{str(x): []} for x in sources._id]
+                metrics.count_matches(matches)
+            else:
+                result = par.parallel_batch(sources, candidates, distance_km, delta)
+                matches = result["matches"]
+            writer.write(matches)
+            print(f"Processed {len(matches)} sources between {t0} and {t1}")
+        return writer.count
+
+
+def main(distance_km, delta, percentage, output, tropomi_in_iasi: bool, chunk):
+    """Example application of the methods in this module."""
+    client = gm.connect()
+    if tropomi_in_iasi:
+        source, searchspace = "TROPOMI", "IASI"
+    else:
+        source, searchspace = "IASI", "TROPOMI"
+
+    tic = time.perf_counter()
+    n = parallel_stream(
+        client, source, searchspace, distance_km, delta, output, chunk, percentage
+    )
+    toc = time.perf_counter()
+
+    print(f"Calculation of {n} data was done in {toc - tic:0.4f} seconds")
+
+
+if __name__ == "__main__":
+    distance_km = 160.934
+    delta = timedelta(hours=6)
+    percentage = 0.01
+    output = None
+    tropomi_in_iasi = True
+    chunk = timedelta(hours=6)
+    main(distance_km, delta, percentage, output, tropomi_in_iasi, chunk)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""In-memory stand-in for the MongoDB collections, for tests and benchmarks.
+
+Only the subset of pymongo used by geomatch is implemented. It is not meant
+to be used with real data.
+"""
+
+import numpy as np
+import pandas as pd
+
+from geomatch import haversine as hv
+
+
+class MemoryCursor(list):
+    """Query result of the `MemoryCollection`."""
+
+    def sort(self, key, direction=1):
+        if isinstance(key, list):
+            key, direction = key[0]
+        ordered = sorted(self, key=lambda x: x[key], reverse=direction == -1)
+        return MemoryCursor(ordered)
+
+    def limit(self, n):
+        return MemoryCursor(self[:n] if n else self)
+
+    def batch_size(self, n):
+        return self
+
+
+class MemoryCollection:
+    """In-memory stand-in for a MongoDB collection used by geomatch.
+
+    Supports the query operators used in this package ($and, $or, $gt,
+    $gte, $lt, $lte, $in and $geoWithin with $centerSphere) and counts the
+    number of queries (round trips). `$geoWithin` is evaluated with
+    `hv.haversine_par`, so create collections on the main thread (see
+    `hv.warm_up`) if the engines query them from a thread pool.
+    """
+
+    FIELDS = {"loc.coordinates.0": "lon", "loc.coordinates.1": "lat"}
+
+    def __init__(self, docs=()):
+        hv.warm_up()
+        self.docs = []
+        self.queries = 0
+        self._columns = None
+        self.insert_many(docs)
+
+    def insert_many(self, docs):
+        self.docs.extend(docs)
+        self._columns = None
+
+    def delete_one(self, query):
+        positions = np.flatnonzero(self._mask(query))
+        if positions.size:
+            del self.docs[positions[0]]
+            self._columns = None
+
+    def columns(self):
+        if self._columns is None:
+            coordinates = np.array(
+                [x["loc"]["coordinates"] for x in self.docs], dtype=np.float64
+            ).reshape(-1, 2)
+            self._columns = dict(
+                time=pd.DatetimeIndex([x["time"] for x in self.docs]).values,
+                _id=np.array([str(x["_id"]) for x in self.docs], dtype="U24"),
+                id=np.array([x["id"] for x in self.docs]),
+                lat=coordinates[:, 1].copy(),
+                lon=coordinates[:, 0].copy(),
+            )
+        return self._columns
+
+    @staticmethod
+    def _value(key, value):
+        if key == "time":
+            return pd.Timestamp(value).to_datetime64()
+        if key == "_id":
+            return str(value)
+        return value
+
+    def _mask(self, query):
+        columns = self.columns()
+        mask = np.full(len(self.docs), True)
+        for key, cond in (query or {}).items():
+            if key == "$and":
+                for x in cond:
+                    mask &= self._mask(x)
+            elif key == "$or":
+                mask &= np.logical_or.reduce([self._mask(x) for x in cond])
+            elif key == "loc":
+                (lon, lat), radius = cond["$geoWithin"]["$centerSphere"]
+                # $centerSphere takes an angle in radians on the sphere
+                mask &= hv.haversine_par(
+                    columns["lat"], columns["lon"], lat, lon, radius * hv.R
+                )
+            elif isinstance(cond, dict):
+                values = columns[self.FIELDS.get(key, key)]
+                for op, arg in cond.items():
+                    if op == "$in":
+                        mask &= np.isin(values, [self._value(key, x) for x in arg])
+                        continue
+                    arg = self._value(key, arg)
+                    ops = {
+                        "$gt": np.greater,
+                        "$gte": np.greater_equal,
+                        "$lt": np.less,
+                        "$lte": np.less_equal,
+                    }
+                    mask &= ops[op](values, arg)
+            else:
+                mask &= columns[key] == self._value(key, cond)
+        return mask
+
+    def find(self, query=None, projection=None, sort=None, limit=0, **kwargs):
+        self.queries += 1
+        docs = MemoryCursor(self.docs[i] for i in np.flatnonzero(self._mask(query)))
+        if sort is not None:
+            docs = docs.sort(sort)
+        return docs.limit(limit)
+
+    def find_one(self, query=None, projection=None, sort=None):
+        docs = self.find(query, projection, sort=sort, limit=1)
+        return docs[0] if docs else None
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+    def count_documents(self, query):
+        return int(self._mask(query).sum())
+
+
+class MemoryDatabase:
+    def __init__(self, docs=()):
+        self.v0 = MemoryCollection(docs)
+
+
+def memory_client(tropomi=(), iasi=()):
+    """Return a client with in-memory TROPOMI and IASI collections."""
+    return {"TROPOMI": MemoryDatabase(tropomi), "IASI": MemoryDatabase(iasi)}
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import csv
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from geomatch import edges
+from geomatch import geomatch as gm
+from geomatch import parallel as par
+from geomatch import results as rs
+
+# distances and time offsets are kept in double precision, so filtering
+# gives the same matches as a run at the smaller thresholds
+COLUMNS = dict(edges.COLUMNS, distance_km=np.float64, dt_seconds=np.float64)
+FIELDS = ("distance_km", "delta_min", "matches", "sources", "candidates")
+
+
+def select(meta, arrays, distance_km, delta):
+    """Return the mask of the edges within distance_km and delta.
+
+    Raises a ValueError if the thresholds exceed those of the edge list.
+    """
+    max_distance, max_delta = rs.parse_settings(meta)
+    if distance_km > max_distance or delta > max_delta:
+        raise ValueError(
+            f"{distance_km} km and {delta} exceed the thresholds of "
+            f"{meta['distance']} and {meta['delta']}"
+        )
+    window = gm.temporal_window_ns(delta) / 1e9
+    within = arrays["distance_km"] <= distance_km
+    return within & (np.abs(arrays["dt_seconds"]) <= window)
+
+
+def to_matches(meta, arrays, distance_km, delta):
+    """Return the result of one combination (see `edges.to_matches`)."""
+    mask = select(meta, arrays, distance_km, delta)
+    filtered = dict(arrays, **{k: arrays[k][mask] for k in edges.COLUMNS})
+    meta = dict(
+        meta,
+        distance=f"{distance_km} km",
+        delta=f"{delta.total_seconds()/60} min",
+    )
+    return edges.to_matches(meta, filtered)
+
+
+def summary(meta, arrays, settings):
+    """Return the counts of every (distance_km, delta) combination.
+
+    Every row holds the `FIELDS`, i.e. the number of matches and of the
+    sources and candidates with at least one match.
+    """
+    rows = []
+    for distance_km, delta in settings:
+        mask = select(meta, arrays, distance_km, delta)
+        rows.append(
+            dict(
+                distance_km=distance_km,
+                delta_min=delta.total_seconds() / 60,
+                matches=int(mask.sum()),
+                sources=np.unique(arrays["source_idx"][mask]).size,
+                candidates=np.unique(arrays["candidate_idx"][mask]).size,
+            )
+        )
+    return rows
+
+
+def write_summary(path, rows):
+    """Write the summary rows as csv file."""
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_sweep(tropomi, iasi, settings, output):
+    """Match once at the largest thresholds and summarize all combinations.
+
+    The edges are written with exact distances and time offsets (see
+    `COLUMNS`), so every smaller combination can be taken from `output`
+    with `to_matches`. Returns the summary rows.
+    """
+    distance_km = max(x for x, _ in settings)
+    delta = max(x for _, x in settings)
+    par.parallel_edges(tropomi, iasi, distance_km, delta, output, columns=COLUMNS)
+    return summary(*edges.read_edges(output), settings)
+
+
+def main(settings, output, tropomi_in_iasi: bool, table=None):
+    """Example application of the methods in this module."""
+    print("Loading data")
+    client = gm.connect()
+    name, searchspace = gm.collections(tropomi_in_iasi)
+    source = gm.get_collection(client, name)
+    if source is None:
+        return
+    distance_km = max(x for x, _ in settings)
+    delta = max(x for _, x in settings)
+    candidates = gm.get_candidates(client, searchspace, source, delta, distance_km)
+    print(f"Processing {source.index.size} data and {candidates.index.size} candidates")
+
+    tic = time.perf_counter()
+    rows = run_sweep(source, candidates, settings, output)
+    toc = time.perf_counter()
+    print(f"Sweep over {len(rows)} settings was done in {toc - tic:0.4f} seconds")
+
+    print(" ".join(f"{x:>12}" for x in FIELDS))
+    for row in rows:
+        print(" ".join(f"{row[x]:>12}" for x in FIELDS))
+    if table is not None:
+        write_summary(table, rows)
+
+
+if __name__ == "__main__":
+    settings = [
+        (d, timedelta(minutes=t))
+        for d in (20, 50, 100, 160.934)
+        for t in (60, 120, 360)
+    ]
+    output = "thresholds"
+    tropomi_in_iasi = True
+    main(settings, output, tropomi_in_iasi)
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from bson.objectid import ObjectId
+
+from geomatch import testing
+
+
+def make_documents(n, seed, start=datetime(2023, 6, 1)):
+    """Random satellite documents as stored in MongoDB."""
+    rng = np.random.default_rng(seed)
+    minutes = rng.uniform(0, 3 * 24 * 60, n)
+    lats = rng.uniform(-10, 10, n)
+    lons = rng.uniform(-10, 10, n)
+    return [
+        dict(
+            _id=ObjectId(),
+            id=i,
+            time=start + timedelta(minutes=float(m)),
+            loc=dict(type="Point", coordinates=[float(lon), float(lat)]),
+        )
+        for i, (m, lat, lon) in enumerate(zip(minutes, lats, lons))
+    ]
+
+
+@pytest.fixture
+def client():
+    """Client with small random TROPOMI and IASI collections."""
+    return testing.memory_client(make_documents(50, 0), make_documents(500, 1))
+
+
+def run_fresh(code, timeout=120):
+    """Run code in a fresh interpreter, e.g. to check that it exits."""
+    return subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, timeout=timeout
+    )
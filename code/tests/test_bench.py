@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+import pytest
+from conftest import make_documents
+
+from geomatch import bench, testing
+
+settings = [(100.0, timedelta(hours=12)), (300.0, timedelta(hours=6))]
+
+
+@pytest.fixture(scope="module")
+def tracks():
+    return testing.memory_client(
+        bench.synthetic_documents(500, seed=0), bench.synthetic_documents(2_000, seed=1)
+    )
+
+
+def test_synthetic_documents():
+    docs = bench.synthetic_documents(1_000, span=timedelta(hours=3))
+    lats = [x["loc"]["coordinates"][1] for x in docs]
+    lons = [x["loc"]["coordinates"][0] for x in docs]
+    assert max(lats) <= 90 and min(lats) >= -90
+    assert max(lons) < 180 and min(lons) >= -180
+    assert docs[-1]["time"] - docs[0]["time"] <= timedelta(hours=3)
+
+
+def test_engines_are_identical():
+    names = ["thread", "sweep+grid", "mongo-batch"]
+    report = bench.run_benchmark(
+        make_documents(40, 0), make_documents(400, 1), settings, names, repeat=1
+    )
+    assert report["sources"] == 40
+    for entry in report["settings"]:
+        assert entry["pairs"] > 0
+        assert list(entry["engines"]) == names
+        for name, result in entry["engines"].items():
+            assert result["identical"], name
+            assert result["throughput"] > 0
+    for memory in report["memory"].values():
+        assert memory["peak_rss_mb"] >= memory["base_rss_mb"] > 0
+
+
+@pytest.mark.parametrize("distance_km, delta", settings)
+@pytest.mark.parametrize("name", ["thread", "sweep", "batch", "sweep+grid"])
+def test_benchmark_engine(benchmark, tracks, name, distance_km, delta):
+    runs, n = bench.engines(tracks)
+    benchmark.extra_info["centers"] = n
+    benchmark.pedantic(runs[name], (distance_km, delta), rounds=3)
+
+
+def test_startup():
+    report = bench.startup(repeat=1)
+    assert set(report) >= {"python", "--help", "kernel (cold)", "kernel (cached)"}
+    assert all(x > 0 for x in report.values())
@@ -0,0 +1,44 @@
+import pytest
+from pandas.testing import assert_frame_equal
+
+from geomatch import cache as lc
+from geomatch import geomatch as gm
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("GEOMATCH_CACHE_DIR", str(tmp_path))
+
+
+def test_roundtrip(client):
+    assert not lc.is_valid(client, "IASI")
+    lc.build(client, "IASI")
+    assert lc.is_valid(client, "IASI")
+
+    expected = gm.get_iasi(client, cache=False)
+    assert_frame_equal(lc.load("IASI"), expected, check_dtype=False)
+    assert_frame_equal(gm.get_iasi(client), expected, check_dtype=False)
+
+
+def test_load_is_zero_copy(client):
+    lc.build(client, "IASI")
+    frame = lc.load("IASI")
+    assert frame["_id"].dtype == lc.ObjectIdDtype()
+    # read only columns are views of the memory mapped files, not copies
+    assert not frame["_id"].values.raw.flags.writeable
+    assert not frame["lat"].values.flags.writeable
+    assert frame["_id"].iloc[3] == gm.get_iasi(client, cache=False)["_id"].iloc[3]
+
+
+def test_invalidated_by_new_documents(client):
+    lc.build(client, "TROPOMI")
+    collection = client["TROPOMI"].v0
+    collection.delete_one({"_id": collection.docs[-1]["_id"]})
+    assert not lc.is_valid(client, "TROPOMI")
+    assert gm.get_tropomi(client).index.size == 49
+
+
+def test_clear(client):
+    lc.build(client, "TROPOMI")
+    lc.clear("TROPOMI")
+    assert lc.read_meta("TROPOMI") is None
@@ -0,0 +1,102 @@
+import json
+from datetime import timedelta
+
+import pytest
+from conftest import make_documents
+
+from geomatch import checkpoint as ck
+from geomatch import geomatch as gm
+from geomatch import parallel as par
+
+distance_km = 160.934
+delta = timedelta(hours=6)
+
+
+def _run(client, output, rows=7):
+    return ck.parallel_resumable(
+        client, "TROPOMI", "IASI", distance_km, delta, 1, output, rows=rows
+    )
+
+
+def _expected(client):
+    source = gm.get_tropomi(client, cache=False)
+    candidates = gm.get_iasi(client, cache=False)
+    return par.parallel_batch(source, candidates, distance_km, delta)
+
+
+def test_resume_only_processes_new_sources(client, tmp_path):
+    output = tmp_path / "matches.json"
+    new = make_documents(10, 2)
+    assert _run(client, output) == 50
+
+    client["TROPOMI"].v0.insert_many(new)
+    assert _run(client, output) == 10
+    assert _run(client, output) == 0
+
+    with open(output) as f:
+        result = json.load(f)
+    expected = _expected(client)
+    assert len(result["matches"]) == 60
+    assert sorted(map(json.dumps, result["matches"])) == sorted(
+        map(json.dumps, expected["matches"])
+    )
+
+
+def test_resume_after_interrupted_write(client, tmp_path):
+    output = tmp_path / "matches.json"
+    _run(client, output)
+    with open(output, "ab") as f:
+        f.write(b'{"broken": [')
+    client["TROPOMI"].v0.insert_many(make_documents(3, 2))
+    _run(client, output)
+    with open(output) as f:
+        assert len(json.load(f)["matches"]) == 53
+
+
+def test_resume_with_other_parameters(client, tmp_path):
+    output = tmp_path / "matches.json"
+    _run(client, output)
+    with pytest.raises(ValueError):
+        ck.parallel_resumable(client, "TROPOMI", "IASI", 20, delta, 1, output)
+
+
+def test_resume_partial_run(client, tmp_path):
+    output = tmp_path / "matches.json"
+    n = ck.parallel_resumable(
+        client, "TROPOMI", "IASI", distance_km, delta, 0.5, output, rows=7
+    )
+    assert n == 25
+    assert ck.read(output)["upto_id"] is not None
+    assert _run(client, output) == 25
+    assert ck.read(output)["upto_id"] is None
+    with open(output) as f:
+        assert json.load(f) == _expected(client)
+
+
+def test_resume_after_interrupted_append(client, tmp_path):
+    output = tmp_path / "matches.json"
+    _run(client, output)
+    size = ck.read(output)["size"]
+    with open(output, "r+b") as f:
+        f.truncate(size - 2)
+    client["TROPOMI"].v0.insert_many(make_documents(3, 2))
+    assert _run(client, output) == 3
+    with open(output) as f:
+        assert len(json.load(f)["matches"]) == 53
+
+
+def test_resume_with_missing_output(client, tmp_path):
+    output = tmp_path / "matches.json"
+    _run(client, output)
+    output.unlink()
+    assert _run(client, output) == 50
+    with open(output) as f:
+        assert json.load(f) == _expected(client)
+
+
+def test_resume_warns_about_new_candidates(client, tmp_path, capsys):
+    output = tmp_path / "matches.json"
+    _run(client, output)
+    client["IASI"].v0.insert_many(make_documents(5, 3))
+    assert _run(client, output) == 0
+    assert "not matched with new candidates" in capsys.readouterr().out
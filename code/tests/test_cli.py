@@ -0,0 +1,80 @@
+import subprocess
+import sys
+
+import pytest
+from click.testing import CliRunner
+
+from geomatch import cli as gcli
+from geomatch.cli import cli
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["--grid", "match", "--mongo"],
+        ["--grid", "match", "--stream"],
+        ["--grid", "match", "--engine", "batch"],
+        ["--grid", "match", "--engine", "shared"],
+        ["match", "--engine", "sweep", "--mongo"],
+        ["match", "--engine", "batch", "--stream"],
+        ["match", "--format", "edges", "--output", "out", "--engine", "batch"],
+        ["--grid", "match", "--format", "edges", "--output", "out"],
+        ["match", "--shard", "1/2"],
+        ["match", "--shard", "1/2", "--output", "out", "-p", "0.5"],
+        ["match", "--shard", "3/2", "--output", "out"],
+        ["match", "--mode", "k=0"],
+        ["match", "--mode", "nearest", "--mongo"],
+        ["match", "--mode", "nearest", "--engine", "batch"],
+        ["match", "--mode", "k=3", "--output", "out", "--format", "edges"],
+        ["match", "--both-directions", "--mongo"],
+        ["match", "--both-directions", "--mode", "nearest"],
+        ["match", "--both-directions", "--engine", "batch"],
+        ["match", "--both-directions", "-p", "0.5"],
+    ],
+)
+def test_match_rejects_options_without_effect(args):
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 2
+    assert "Error" in result.output
+    assert "No such option" not in result.output
+
+
+def test_choices_match_the_modules():
+    from geomatch import bench
+    from geomatch import cache as lc
+    from geomatch import parallel as par
+
+    assert gcli.COLLECTIONS == lc.COLLECTIONS
+    assert gcli.ENGINES == tuple(par.ENGINES)
+    assert gcli.INDEXED_ENGINES == par.INDEXED_ENGINES
+    assert gcli.BENCH_ENGINES == bench.ENGINE_NAMES
+
+
+@pytest.mark.parametrize("text,k", [("all", None), ("nearest", 1), ("k=5", 5)])
+def test_parse_mode(text, k):
+    assert gcli.parse_mode(text) == k
+
+
+@pytest.mark.parametrize("text", ["k=0", "k=x", "best", "n=2"])
+def test_parse_mode_invalid(text):
+    with pytest.raises(ValueError):
+        gcli.parse_mode(text)
+
+
+def test_import_is_lazy():
+    code = (
+        "import sys, geomatch.cli; "
+        "geomatch.cli.match.make_context('match', ['--mode', 'k=2']); "
+        "print(*[x for x in ('pandas', 'numba', 'pymongo', 'folium') if x in sys.modules])"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == ""
+
+
+@pytest.mark.parametrize("args", [["plot"], ["plot", "--id", "a", "--matches", "."]])
+def test_plot_needs_ids_or_matches(args):
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 2
+    assert "Give either --id or --matches" in result.output
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from geomatch import edges
+from geomatch import geomatch as gm
+from geomatch import haversine as hv
+from geomatch import parallel as par
+
+distance_km = 160.934
+delta = timedelta(hours=6)
+
+
+def test_edges_roundtrip(client, tmp_path):
+    source = gm.get_tropomi(client, cache=False)
+    candidates = gm.get_iasi(client, cache=False)
+    n = par.parallel_edges(source, candidates, distance_km, delta, tmp_path, rows=7)
+
+    meta, arrays = edges.read_edges(tmp_path)
+    assert meta["edges"] == n
+    assert isinstance(arrays["source_idx"], np.memmap)
+    expected = par.parallel_batch(source, candidates, distance_km, delta)
+    assert edges.to_matches(meta, arrays) == expected
+
+    s = source.iloc[arrays["source_idx"][0]]
+    oid = arrays["candidate_ids"][arrays["candidate_idx"][0]]
+    c = candidates[(edges.object_id_bytes(candidates._id) == oid).all(1)].iloc[0]
+    d = hv.haversine(c.lat, c.lon, s.lat, s.lon)
+    assert np.isclose(arrays["distance_km"][0], d)
+    assert np.isclose(arrays["dt_seconds"][0], (c.name - s.name).total_seconds())
+
+
+def test_edges_empty(client, tmp_path):
+    source = gm.get_tropomi(client, cache=False)
+    candidates = gm.get_iasi(client, cache=False)
+    par.parallel_edges(source, candidates, 0.001, delta, tmp_path)
+    meta, arrays = edges.read_edges(tmp_path)
+    assert meta["edges"] == 0 and meta["sources"] == 50
+    assert arrays["candidate_idx"].size == 0
+
+
+def test_edges_without_meta_on_error(tmp_path):
+    with pytest.raises(RuntimeError):
+        with edges.EdgeWriter(tmp_path, distance_km, delta):
+            raise RuntimeError
+    assert not (tmp_path / "meta.json").exists()
@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+import pytest
+from conftest import make_documents
+from pandas.testing import assert_frame_equal
+
+from geomatch import cache as lc
+from geomatch import geomatch as gm
+from geomatch import parallel as par
+
+
+def test_query_result_to_gdb():
+    docs = make_documents(100, 0)
+    df = gm._query_result_to_gdb(iter(docs))
+
+    assert list(df.columns) == ["id", "_id", "lat", "lon", "timestamp"]
+    assert df.index.name == "time"
+    assert df.index.is_monotonic_increasing
+    assert (df.index == df.timestamp).all()
+    for doc in docs[:10]:
+        row = df[df._id == doc["_id"]].iloc[0]
+        assert row.name == doc["time"]
+        assert [row.lon, row.lat] == doc["loc"]["coordinates"]
+        assert row.id == doc["id"]
+
+
+def test_query_result_to_gdb_empty():
+    assert gm._query_result_to_gdb(iter([])) is None
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("GEOMATCH_CACHE_DIR", str(tmp_path))
+
+
+@pytest.mark.parametrize("distance_km", [20.0, 160.934, 3000.0])
+@pytest.mark.parametrize("cached", [False, True])
+def test_get_candidates_keeps_all_matches(client, cache_dir, distance_km, cached):
+    delta = timedelta(hours=6)
+    if cached:
+        lc.build(client, "IASI")
+    source = gm.get_head(client, "TROPOMI", 10)
+    candidates = gm.get_candidates(client, "IASI", source, delta, distance_km)
+    everything = gm.get_iasi(client, cache=False)
+
+    assert 0 < candidates.index.size < everything.index.size
+    expected = par.parallel_batch(source, everything, distance_km, delta)
+    assert par.parallel_batch(source, candidates, distance_km, delta) == expected
+
+
+def test_get_candidates_pushes_bounds_down(client, cache_dir):
+    source = gm.get_head(client, "TROPOMI", 1)
+    queries = client["IASI"].v0.queries
+    candidates = gm.get_candidates(client, "IASI", source, timedelta(hours=1), 20.0)
+    assert client["IASI"].v0.queries == queries + 1
+    assert candidates.index.size < 10
+    assert (abs(candidates.index - source.index[0]) <= timedelta(minutes=30)).all()
+
+
+def test_get_candidates_empty(client, cache_dir):
+    source = gm.get_head(client, "TROPOMI", 1)
+    source.index += timedelta(days=30)
+    candidates = gm.get_candidates(client, "IASI", source, timedelta(hours=1), 20.0)
+    assert candidates.index.size == 0
+    assert list(candidates.columns) == ["id", "_id", "lat", "lon", "timestamp"]
+
+
+def test_get_head(client, cache_dir):
+    expected = gm.get_tropomi(client, cache=False)[:5]
+    assert_frame_equal(gm.get_head(client, "TROPOMI", 5), expected)
+    assert gm.get_head(client, "TROPOMI", 0) is None
+
+
+def test_candidate_bounds_near_pole():
+    source = gm._query_result_to_gdb(iter(make_documents(5, 0)))
+    source["lat"] = 89.9
+    bounds = gm.candidate_bounds(source, timedelta(hours=1), 160.934)
+    assert bounds["lat"] is None and bounds["lon"] is None
+    assert gm.bounds_query(bounds).keys() == {"time"}
+
+
+def test_get_source(client, cache_dir):
+    source = gm.get_tropomi(client, cache=False)
+    query = {"_id": source._id.iloc[7]}
+    assert gm.get_source(client, "TROPOMI", query=query)._id.iloc[0] == query["_id"]
+    assert gm.get_source(client, "TROPOMI", 7)._id.iloc[0] == query["_id"]
+    with pytest.raises(ValueError):
+        gm.get_source(client, "TROPOMI", 50)
@@ -62,3 +62,68 @@ def test_parallel_haversine():
                 expected.append(tol_km > dist["distance_km"])
     result = hv.haversine_par(np.array(lats), np.array(lons), ref_lat, ref_lon, tol_km)
     assert np.equal(result, expected).all()
+
+
+def test_batch_haversine():
+    rng = np.random.default_rng(0)
+    src_lats, src_lons = rng.uniform(-60, 60, (2, 100))
+    src_times = rng.integers(0, 1_000, 100)
+    lats, lons = rng.uniform(-60, 60, (2, 2_000))
+    times = np.sort(rng.integers(0, 1_000, 2_000))
+    tol_km, window = 1_500.0, 50
+
+    offsets, indices, distances = hv.haversine_batch(
+        src_lats, src_lons, src_times, lats, lons, times, tol_km, window
+    )
+    assert offsets.size == src_lats.size + 1
+    for i in range(src_lats.size):
+        in_time = np.abs(times - src_times[i]) <= window
+        in_space = hv.haversine_par(lats, lons, src_lats[i], src_lons[i], tol_km)
+        expected = np.flatnonzero(in_time & in_space)
+        lo, hi = offsets[i], offsets[i + 1]
+        assert np.array_equal(indices[lo:hi], expected)
+        assert (distances[lo:hi] <= tol_km).all()
+
+
+@pytest.mark.parametrize("tol_km", [0.0, 1.0, 20.0, 160.934, 3_000.0, 20_100.0])
+def test_prefiltered_haversine(tol_km):
+    rng = np.random.default_rng(0)
+    lats = np.degrees(np.arcsin(rng.uniform(-1, 1, 20_000)))
+    lons = rng.uniform(-180, 180, 20_000)
+    xs, ys, zs = hv.unit_vectors(lats, lons)
+    centers = [(0.0, 0.0), (89.9, 10.0), (-90.0, 0.0), (10.0, 179.99), (45, -180)]
+    for lat, lon in [*centers, *zip(lats[:20], lons[:20])]:
+        # points exactly on the circle are part of the comparison
+        tol = [hv.haversine(lats[i], lons[i], lat, lon) for i in range(3)]
+        for d in [tol_km, *tol]:
+            expected = hv.haversine_par(lats, lons, lat, lon, d)
+            result = hv.haversine_par_prefiltered(xs, ys, zs, lats, lons, lat, lon, d)
+            assert np.array_equal(result, expected)
+
+
+@pytest.mark.parametrize("k", [1, 3, 50])
+def test_haversine_topk(k):
+    rng = np.random.default_rng(2)
+    src_lats, src_lons = rng.uniform(-10, 10, 200), rng.uniform(-10, 10, 200)
+    src_times = np.sort(rng.integers(0, 10**6, 200))
+    lats, lons = rng.uniform(-10, 10, 5_000), rng.uniform(-10, 10, 5_000)
+    times = np.sort(rng.integers(0, 10**6, 5_000))
+    tol_km, window = 300.0, 100_000
+
+    counts, indices, distances, dts = hv.haversine_topk(
+        src_lats, src_lons, src_times, lats, lons, times, tol_km, window, k
+    )
+    offsets, found, found_distances = hv.haversine_batch(
+        src_lats, src_lons, src_times, lats, lons, times, tol_km, window
+    )
+    for i in range(src_lats.size):
+        lo, hi = offsets[i], offsets[i + 1]
+        js, ds = found[lo:hi], found_distances[lo:hi]
+        scores = ds / tol_km + np.abs(times[js] - src_times[i]) / window
+        best = np.lexsort((js, scores))[:k]
+        n = counts[i]
+        assert n == min(k, js.size)
+        assert np.array_equal(indices[i, :n], js[best])
+        assert (indices[i, n:] == -1).all()
+        assert np.allclose(distances[i, :n], ds[best])
+        assert np.array_equal(dts[i, :n], times[js[best]] - src_times[i])
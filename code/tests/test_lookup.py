@@ -0,0 +1,140 @@
+import json
+import os
+from datetime import timedelta
+
+import pytest
+from click.testing import CliRunner
+from conftest import run_fresh
+
+from geomatch import geomatch as gm
+from geomatch import lookup, plot
+from geomatch import results as rs
+from geomatch.cli import cli
+
+distance_km = 160.934
+delta = timedelta(hours=6)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("GEOMATCH_CACHE_DIR", str(tmp_path))
+
+
+@pytest.fixture
+def connect(client, monkeypatch):
+    monkeypatch.setattr(gm, "connect", lambda: client)
+    return client
+
+
+def _single(client, center):
+    candidates = gm.add_unit_vectors(gm.get_iasi(client, cache=False))
+    filtered_t = gm.filter_by_time(center, candidates, delta)
+    found = gm.filter_by_distance(center, filtered_t, distance_km)
+    return [str(x) for x in found._id]
+
+
+def test_parse_lookups():
+    lines = ["6495415cde8eb33d8393caa7\n", "\n", "# comment\n", "12  # twelfth\n"]
+    assert lookup.parse_lookups(lines) == (["6495415cde8eb33d8393caa7"], [12])
+    with pytest.raises(ValueError):
+        lookup.parse_lookups(["abc"])
+
+
+def test_get_sources(client):
+    frame = gm.get_tropomi(client, cache=False)
+    ids = [str(frame._id.iloc[7]), str(frame._id.iloc[2])]
+    sources = lookup.get_sources(client, "TROPOMI", ids, [0, 7])
+    assert [str(x) for x in sources._id] == [*ids, str(frame._id.iloc[0]), ids[0]]
+    with pytest.raises(ValueError, match="100"):
+        lookup.get_sources(client, "TROPOMI", ids, [100])
+    with pytest.raises(ValueError, match="6495415cde8eb33d8393caa7"):
+        lookup.get_sources(client, "TROPOMI", ["6495415cde8eb33d8393caa7"])
+
+
+@pytest.mark.parametrize("grid", [False, True])
+def test_lookup_many_matches_single(client, grid):
+    sources = lookup.get_sources(client, "TROPOMI", indices=range(0, 50, 5))
+    found, mongo_found = lookup.lookup_many(
+        client, "TROPOMI", "IASI", sources, distance_km, delta, grid, workers=4
+    )
+    assert len(found) == len(mongo_found) == 10
+    for i, (matches, res) in enumerate(zip(found, mongo_found)):
+        expected = _single(client, sources.iloc[i])
+        assert [str(x) for x in matches._id] == expected
+        assert sorted(str(x) for x in res._id) == sorted(expected)
+    assert sum(len(x) for x in found) > 0
+
+
+def test_lookup_many_reads_cache(client):
+    sources = lookup.get_sources(client, "TROPOMI", indices=range(10))
+    args = (client, "TROPOMI", "IASI", sources, distance_km, delta)
+    with rs.ResultCache() as results:
+        first, _ = lookup.lookup_many(*args, results=results)
+        assert len(results) == 10
+        again, mongo_found = lookup.lookup_many(*args, results=results)
+    assert mongo_found == [None] * 10
+    for x, y in zip(first, again):
+        assert sorted(str(v) for v in x._id) == sorted(str(v) for v in y._id)
+
+
+LOOKUP_MANY = """
+from datetime import timedelta
+from geomatch import bench, lookup, testing
+from geomatch import haversine as hv
+
+warm_up, hv.warm_up = hv.warm_up, lambda: None  # the collection warms up too
+client = testing.memory_client(
+    bench.synthetic_documents(50, seed=0), bench.synthetic_documents(200, seed=1)
+)
+hv.warm_up = warm_up
+sources = lookup.get_sources(client, "TROPOMI", indices=range(10))
+lookup.lookup_many(client, "TROPOMI", "IASI", sources, 500.0, timedelta(hours=6))
+"""
+
+
+def test_lookup_many_exits():
+    # the kernels run in pool threads, the TBB layer hung at exit without warm up
+    assert run_fresh(LOOKUP_MANY).returncode == 0
+
+
+def test_cli_report(connect, tmp_path):
+    frame = gm.get_tropomi(connect, cache=False)
+    lines = f"{frame._id.iloc[3]}\n5\n"
+    output = tmp_path / "report.json"
+    args = ["-k", str(distance_km), "-m", "360", "single", "--ids", "-"]
+    args += ["--report", str(output)]
+    result = CliRunner().invoke(cli, args, input=lines)
+    assert result.exit_code == 0, result.output
+    with open(output) as f:
+        report = json.load(f)
+    sources = [x["source"] for x in report["lookups"]]
+    assert sources == [str(frame._id.iloc[3]), str(frame._id.iloc[5])]
+    for entry, i in zip(report["lookups"], [3, 5]):
+        assert entry["matches"] == _single(connect, frame.iloc[i])
+
+
+def test_plot_many(connect, tmp_path, monkeypatch):
+    generate_map = plot.generate_map
+    monkeypatch.setattr(
+        plot, "generate_map", lambda *args: generate_map(*args[:2], "OpenStreetMap")
+    )
+    plot.main_many(distance_km, delta, ["0", "1", "2"], True, tmp_path / "maps")
+    frame = gm.get_tropomi(connect, cache=False)
+    expected = {f"{x}.html" for x in frame._id.iloc[:3]}
+    assert set(os.listdir(tmp_path / "maps")) == expected
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["single", "--ids", "-", "--id", "6495415cde8eb33d8393caa7"],
+        ["single", "--ids", "-", "--ix", "3"],
+        ["single", "--report", "out.json"],
+        ["single", "--ids", "-", "--report", "out.json", "-o", "maps"],
+        ["single", "--ids", "-"],
+    ],
+)
+def test_cli_rejects(connect, args):
+    result = CliRunner().invoke(cli, args, input="not-an-id\n")
+    assert result.exit_code == 2
+    assert "Error" in result.output
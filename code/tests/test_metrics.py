@@ -0,0 +1,46 @@
+import json
+import pstats
+from datetime import timedelta
+
+import pytest
+
+from geomatch import geomatch as gm
+from geomatch import metrics
+from geomatch import parallel as par
+
+distance_km = 160.934
+delta = timedelta(hours=6)
+
+
+def test_timer_and_counter():
+    m = metrics.Metrics()
+    with m.timer("stage"):
+        m.count("items", 3)
+    with m.timer("stage"):
+        m.count("items")
+    summary = m.summary()
+    assert summary["stages"]["stage"]["calls"] == 2
+    assert summary["stages"]["stage"]["seconds"] >= 0
+    assert summary["counters"] == {"items": 4}
+
+
+@pytest.mark.parametrize("engine", ["thread", "sweep", "batch"])
+def test_collect_match_run(client, tmp_path, engine):
+    output = tmp_path / "metrics.json"
+    profile = tmp_path / "run.prof"
+    with metrics.collect(output, profile):
+        source = gm.get_tropomi(client, cache=False)
+        candidates = gm.get_iasi(client, cache=False)
+        result = par.ENGINES[engine](source, candidates, distance_km, delta)
+
+    with open(output) as f:
+        summary = json.load(f)
+    counters = summary["counters"]
+    assert counters["documents_fetched"] == 550
+    assert counters["sources"] == 50
+    assert counters["matches"] == sum(
+        len(v) for x in result["matches"] for v in x.values()
+    )
+    assert counters["haversine_evaluations"] >= counters["matches"]
+    assert {"fetch", "frame"} <= set(summary["stages"])
+    assert pstats.Stats(str(profile)).total_calls > 0
@@ -1,5 +1,105 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from conftest import run_fresh
+
+from geomatch import geomatch as gm
 from geomatch import mongo as m
 
+distance_km = 160.934
+delta = timedelta(hours=6)
+
 
 def test_query():
     assert False
+
+
+def _as_sets(result):
+    return {k: set(v) for x in result["matches"] for k, v in x.items()}
+
+
+def test_create_query(client):
+    center = gm.get_tropomi(client, cache=False).iloc[0]
+    query = m.create_query(center, distance_km, delta)
+    (lon, lat), radius = query["$and"][0]["loc"]["$geoWithin"]["$centerSphere"]
+    assert (lat, lon) == (center.lat, center.lon)
+    assert radius == pytest.approx(distance_km / 6378.1)
+    assert query["$and"][1]["time"]["$lte"] - query["$and"][1]["time"]["$gte"] == delta
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 4])
+def test_bounded_mongo_matches_thread(client, max_in_flight):
+    source = gm.get_tropomi(client, cache=False)
+    expected = m.parallel_mongo(client, source, distance_km, delta, "IASI")
+    result = m.bounded_mongo(
+        client, source, distance_km, delta, "IASI", max_in_flight=max_in_flight
+    )
+    assert _as_sets(result) == _as_sets(expected)
+    assert len(result["matches"]) == source.index.size
+    assert client["IASI"].v0.queries == 2 * source.index.size
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 100])
+def test_batch_mongo_matches_thread(client, batch_size):
+    source = gm.get_tropomi(client, cache=False)
+    expected = m.parallel_mongo(client, source, distance_km, delta, "IASI")
+    queries = client["IASI"].v0.queries
+    result = m.batch_mongo(
+        client, source, distance_km, delta, "IASI", batch_size=batch_size
+    )
+    assert _as_sets(result) == _as_sets(expected)
+    assert client["IASI"].v0.queries - queries == -(-source.index.size // batch_size)
+
+
+def test_compare_batch_counts_round_trips(client):
+    source = gm.get_tropomi(client, cache=False)
+    round_trips = m.RoundTrips()
+    collection = client["IASI"].v0
+    find = collection.find
+
+    def counted_find(*args, **kwargs):
+        round_trips.started(SimpleNamespace(command_name="find"))
+        return find(*args, **kwargs)
+
+    collection.find = counted_find
+    stats = m.compare_batch(
+        client,
+        source,
+        distance_km,
+        delta,
+        "IASI",
+        batch_size=20,
+        round_trips=round_trips,
+    )
+    assert stats["identical"]
+    assert stats["thread"]["round_trips"] == source.index.size
+    assert stats["batch"]["round_trips"] == 3
+
+
+BATCH_MONGO = """
+from datetime import timedelta
+from geomatch import bench, testing
+from geomatch import geomatch as gm
+from geomatch import mongo as m
+
+client = testing.memory_client(
+    bench.synthetic_documents(50, seed=0), bench.synthetic_documents(200, seed=1)
+)
+source = gm.get_collection(client, "TROPOMI", cache=False)
+m.batch_mongo(client, source, 500.0, timedelta(hours=6), "IASI", batch_size=10)
+"""
+
+
+def test_batch_mongo_exits():
+    # the kernel runs in pool threads, the TBB layer hung at exit without warm up
+    assert run_fresh(BATCH_MONGO).returncode == 0
+
+
+def test_benchmark_uses_percentage(client, tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("GEOMATCH_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(gm, "connect", lambda **kwargs: client)
+    m.benchmark(distance_km, delta, 0.2, True)
+    assert "thread: 10 centers" in capsys.readouterr().out
+    # one query per center and one for the single batch
+    assert client["IASI"].v0.queries == 11
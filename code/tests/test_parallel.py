@@ -0,0 +1,106 @@
+import json
+from datetime import timedelta
+
+import numpy as np
+import pytest
+from conftest import make_documents
+
+from geomatch import edges
+from geomatch import geomatch as gm
+from geomatch import parallel as par
+from geomatch import spatial
+
+distance_km = 160.934
+delta = timedelta(hours=6)
+
+
+def _as_sets(result):
+    return {k: set(v) for x in result["matches"] for k, v in x.items()}
+
+
+@pytest.fixture(scope="module")
+def frames():
+    source = gm._query_result_to_gdb(iter(make_documents(50, 0)))
+    candidates = gm._query_result_to_gdb(iter(make_documents(500, 1)))
+    return source, candidates
+
+
+@pytest.fixture(scope="module")
+def expected(frames):
+    return _as_sets(par.parallel_thread(*frames, distance_km, delta))
+
+
+@pytest.mark.parametrize("grid", [False, True])
+@pytest.mark.parametrize("engine", ["thread", "sweep", "batch", "shared"])
+def test_engine_matches_thread(frames, expected, engine, grid):
+    index = spatial.GridIndex.from_frame(frames[1]) if grid else None
+    result = par.ENGINES[engine](*frames, distance_km, delta, index=index)
+    assert _as_sets(result) == expected
+    assert sum(len(x) for x in expected.values()) > 0
+
+
+@pytest.mark.parametrize("k", [1, 2])
+def test_topk_is_subset_of_all(frames, expected, k):
+    result = par.parallel_topk(*frames, distance_km, delta, k)
+    assert result["mode"] == f"k={k}"
+    for x in result["matches"]:
+        ((source_id, matches),) = x.items()
+        assert len(matches) == min(k, len(expected[source_id]))
+        assert {m["id"] for m in matches} <= expected[source_id]
+        assert all(m["distance_km"] <= distance_km for m in matches)
+        assert all(abs(m["dt_seconds"]) <= delta.total_seconds() / 2 for m in matches)
+        window = delta.total_seconds() / 2
+        scores = [
+            m["distance_km"] / distance_km + abs(m["dt_seconds"]) / window
+            for m in matches
+        ]
+        assert scores == sorted(scores)
+
+
+def test_transpose_csr():
+    offsets = np.array([0, 2, 2, 4])
+    indices = np.array([1, 0, 1, 2])
+    reverse, reverse_indices, order = par.transpose_csr(offsets, indices, 4)
+    assert reverse.tolist() == [0, 1, 3, 4, 4]
+    assert reverse_indices.tolist() == [0, 0, 2, 2]
+    assert indices[order].tolist() == [0, 1, 1, 2]
+
+
+def test_both_directions(frames):
+    forward, reverse = par.parallel_both(*frames, distance_km, delta)
+    assert forward == par.parallel_batch(*frames, distance_km, delta)
+    assert reverse == par.parallel_batch(*frames[::-1], distance_km, delta)
+
+
+def test_both_directions_edges(frames, tmp_path):
+    outputs = (tmp_path / "forward", tmp_path / "reverse")
+    counts = par.parallel_both(*frames, distance_km, delta, outputs, fmt="edges")
+    for output, (source, candidates), n in zip(outputs, [frames, frames[::-1]], counts):
+        meta, arrays = edges.read_edges(output)
+        assert meta["edges"] == n
+        expected = par.parallel_batch(source, candidates, distance_km, delta)
+        assert edges.to_matches(meta, arrays) == expected
+
+
+def test_direction_output():
+    assert par.direction_output("out/m.json", "IASI", "TROPOMI") == (
+        "out/m.IASI-TROPOMI.json"
+    )
+    assert par.direction_output("edges", "TROPOMI", "IASI") == "edges.TROPOMI-IASI"
+
+
+def test_main_both_directions(client, tmp_path, monkeypatch):
+    monkeypatch.setenv("GEOMATCH_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(gm, "connect", lambda: client)
+    output = tmp_path / "matches.json"
+    par.main(distance_km, delta, 1.0, str(output), True, both=True)
+    for name, searchspace in [("TROPOMI", "IASI"), ("IASI", "TROPOMI")]:
+        with open(tmp_path / f"matches.{name}-{searchspace}.json") as f:
+            result = json.load(f)
+        expected = par.parallel_batch(
+            gm.get_collection(client, name, cache=False),
+            gm.get_collection(client, searchspace, cache=False),
+            distance_km,
+            delta,
+        )
+        assert result == expected
@@ -0,0 +1,125 @@
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from geomatch import geomatch as gm
+from geomatch import parallel as par
+from geomatch import plot
+from geomatch import results as rs
+
+distance_km = 160.934
+delta = timedelta(hours=6)
+tiles = "OpenStreetMap"  # the Stamen tiles are gone in recent folium versions
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("GEOMATCH_CACHE_DIR", str(tmp_path))
+
+
+def _pairs(sources, candidates, source_idx, candidate_idx):
+    source_ids, candidate_ids = sources.ids(), candidates.ids()
+    return sorted(
+        (source_ids[i], candidate_ids[j]) for i, j in zip(source_idx, candidate_idx)
+    )
+
+
+def _expected(client):
+    source = gm.get_tropomi(client, cache=False)
+    result = par.parallel_batch(
+        source, gm.get_iasi(client, cache=False), distance_km, delta
+    )
+    pairs = sorted((k, x) for m in result["matches"] for k, v in m.items() for x in v)
+    return result, pairs
+
+
+def test_feature_collection():
+    collection = plot.feature_collection(
+        np.array([1.0, 2.0]), np.array([3.0, 4.0]), popup=["a", "b"]
+    )
+    assert collection["type"] == "FeatureCollection"
+    first = collection["features"][0]
+    assert first["geometry"] == dict(type="Point", coordinates=[3.0, 1.0])
+    assert first["properties"] == dict(popup="a")
+    assert plot.feature_collection([], [])["features"] == []
+
+
+def test_downsample():
+    assert list(plot.downsample(5)) == [0, 1, 2, 3, 4]
+    assert list(plot.downsample(5, 10)) == [0, 1, 2, 3, 4]
+    positions = plot.downsample(1_000, 10)
+    assert positions.size == np.unique(positions).size == 10
+    assert (np.diff(positions) > 0).all()
+
+
+def test_bulk_matches_by_ids(client):
+    result, expected = _expected(client)
+    ids = [next(iter(x)) for x in result["matches"]]
+    found = plot.bulk_matches(client, "TROPOMI", "IASI", distance_km, delta, ids)
+    assert _pairs(*found) == expected
+
+
+def test_bulk_matches_by_result(client):
+    result, expected = _expected(client)
+    found = plot.bulk_matches(
+        client, "TROPOMI", "IASI", distance_km, delta, result=result
+    )
+    assert _pairs(*found) == expected
+
+
+def test_bulk_matches_by_topk_result(client, tmp_path):
+    source = gm.get_tropomi(client, cache=False)
+    path = tmp_path / "matches.json"
+    par.parallel_topk(
+        source, gm.get_iasi(client, cache=False), distance_km, delta, 2, path
+    )
+    result = rs.read(path)
+    expected = sorted(
+        (k, x["id"]) for m in result["matches"] for k, v in m.items() for x in v
+    )
+    found = plot.bulk_matches(
+        client, "TROPOMI", "IASI", distance_km, delta, result=result
+    )
+    assert expected and _pairs(*found) == expected
+
+
+@pytest.mark.parametrize("cluster", [False, True])
+def test_map_bulk(client, cluster):
+    result, expected = _expected(client)
+    found = plot.bulk_matches(
+        client, "TROPOMI", "IASI", distance_km, delta, result=result
+    )
+    html = (
+        plot.map_bulk(*found, distance_km, cluster=cluster, tiles=tiles)
+        .get_root()
+        .render()
+    )
+    assert expected[0][0] in html and expected[0][1] in html
+    assert ("markerClusterGroup" in html) == cluster
+
+    small = plot.map_bulk(
+        *found, distance_km, cluster=cluster, max_points=5, tiles=tiles
+    )
+    assert len(small.get_root().render()) < len(html)
+
+
+def test_map_results(client):
+    source = gm.get_tropomi(client, cache=False)
+    center = source.iloc[0]
+    matches = gm.get_iasi(client, cache=False).iloc[:3]
+    html = (
+        plot.map_results(center, distance_km, matches, matches, tiles)
+        .get_root()
+        .render()
+    )
+    assert "Min." in html and "Time: " in html
+
+
+def test_map_results_without_matches(client):
+    center = gm.get_tropomi(client, cache=False).iloc[0]
+    empty = gm.get_iasi(client, cache=False).iloc[:0]
+    html = (
+        plot.map_results(center, distance_km, empty, empty, tiles).get_root().render()
+    )
+    assert "Min." not in html
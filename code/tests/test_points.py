@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+import numpy as np
+from conftest import make_documents
+
+from geomatch import geomatch as gm
+from geomatch.points import PointStore
+
+
+def _frame(n=100):
+    return gm._query_result_to_gdb(iter(make_documents(n, 0)))
+
+
+def test_from_frame():
+    frame = _frame()
+    store = PointStore.from_frame(frame)
+    assert len(store) == 100
+    assert store.ids() == [str(x) for x in frame._id]
+    assert np.array_equal(store.times, gm.index_as_ns(frame))
+    assert np.shares_memory(store.oids, frame._id.values.raw)
+    assert store.nbytes == 100 * (8 + 8 + 8 + 12)
+
+
+def test_slices_share_arrays():
+    store = PointStore.from_frame(_frame())
+    part = store[10:20]
+    assert np.shares_memory(part.lats, store.lats)
+    assert part.ids() == store.ids()[10:20]
+    assert store.ids(np.array([3, 1])) == [store.ids()[3], store.ids()[1]]
+    assert store.ids(np.array([], dtype=np.int64)) == []
+
+
+def test_time_slice_matches_filter_by_time():
+    frame = _frame()
+    store = PointStore.from_frame(frame)
+    delta = timedelta(hours=6)
+    for center in store[::9].centers():
+        expected = gm.filter_by_time(center, frame, delta)
+        found = store.time_slice(*gm.temporal_boundaries(center, delta))
+        assert found.ids() == PointStore.from_frame(expected).ids()
+
+
+def test_centers():
+    frame = _frame()
+    center = next(PointStore.from_frame(frame)[5:].centers())
+    row = frame.iloc[5]
+    assert (center.name, center.lat, center.lon) == (row.name, row.lat, row.lon)
+    assert center._id == str(row._id)
@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+import pytest
+
+from geomatch import geomatch as gm
+from geomatch import parallel as par
+from geomatch import results as rs
+
+distance_km = 160.934
+delta = timedelta(hours=6)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("GEOMATCH_CACHE_DIR", str(tmp_path))
+
+
+def test_roundtrip():
+    with rs.ResultCache() as results:
+        results.put("a", ["x", "y"], "TROPOMI-IASI", distance_km, delta)
+        assert results.get("a", "TROPOMI-IASI", distance_km, delta) == ["x", "y"]
+        assert results.get("a", "IASI-TROPOMI", distance_km, delta) is None
+        assert results.get("a", "TROPOMI-IASI", 20.0, delta) is None
+        assert results.get("a", "TROPOMI-IASI", distance_km, delta / 2) is None
+    with rs.ResultCache() as results:
+        assert len(results) == 1
+
+
+def test_evicts_least_recently_used():
+    with rs.ResultCache(max_bytes=15) as results:
+        results.put("a", ["x"], "TROPOMI-IASI", distance_km, delta)
+        results.put("b", ["y"], "TROPOMI-IASI", distance_km, delta)
+        results.get("a", "TROPOMI-IASI", distance_km, delta)
+        results.put("c", ["z"], "TROPOMI-IASI", distance_km, delta)
+        assert results.size() <= 15
+        assert results.get("b", "TROPOMI-IASI", distance_km, delta) is None
+        assert results.get("a", "TROPOMI-IASI", distance_km, delta) == ["x"]
+        assert results.get("c", "TROPOMI-IASI", distance_km, delta) == ["z"]
+
+
+@pytest.mark.parametrize("fmt", ["json", "edges"])
+def test_populate(client, tmp_path, fmt):
+    source = gm.get_tropomi(client, cache=False)
+    candidates = gm.get_iasi(client, cache=False)
+    if fmt == "edges":
+        output = tmp_path / "edges"
+        par.parallel_edges(source, candidates, distance_km, delta, output)
+    else:
+        output = tmp_path / "matches.json"
+        par.parallel_batch(source, candidates, distance_km, delta, output)
+    expected = par.parallel_batch(source, candidates, distance_km, delta)
+
+    with rs.ResultCache() as results:
+        direction = rs.direction(True)
+        assert rs.populate(results, output, direction) == source.index.size
+        for x in expected["matches"]:
+            ((source_id, found),) = x.items()
+            assert results.get(source_id, direction, distance_km, delta) == found
+
+
+def test_single_reads_cache(client, monkeypatch, capsys):
+    monkeypatch.setattr(gm, "connect", lambda: client)
+    query = {"_id": gm.get_tropomi(client, cache=False)._id.iloc[3]}
+    with rs.ResultCache() as results:
+        gm.main(distance_km, delta, 0, True, query=query, results=results)
+        assert "Cached" not in capsys.readouterr().out
+        assert len(results) == 1
+
+        queries = client["IASI"].v0.queries
+        gm.main(distance_km, delta, 0, True, query=query, results=results)
+        assert "Cached" in capsys.readouterr().out
+        assert client["IASI"].v0.queries == queries
@@ -0,0 +1,121 @@
+import http.client
+import json
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import pytest
+from conftest import run_fresh
+
+from geomatch import geomatch as gm
+from geomatch import serve
+
+distance_km = 160.934
+delta = timedelta(hours=6)
+
+
+@pytest.fixture
+def service(client, tmp_path, monkeypatch):
+    monkeypatch.setenv("GEOMATCH_CACHE_DIR", str(tmp_path))
+    return serve.MatchService.from_client(client, distance_km, delta)
+
+
+def _single(client, center, searchspace, distance_km=distance_km, delta=delta):
+    candidates = gm.add_unit_vectors(gm.get_collection(client, searchspace))
+    filtered_t = gm.filter_by_time(center, candidates, delta)
+    found = gm.filter_by_distance(center, filtered_t, distance_km)
+    return [str(x) for x in found._id]
+
+
+@pytest.mark.parametrize("grid", [False, True])
+@pytest.mark.parametrize("direction", ["TROPOMI-IASI", "IASI-TROPOMI"])
+def test_request_by_id_matches_single(client, service, direction, grid):
+    if grid:
+        service = serve.MatchService(service.frames, distance_km, delta, grid=True)
+    name, searchspace = direction.split("-")
+    total = 0
+    for ix in range(0, 50, 7):
+        center = gm.get_collection(client, name).iloc[ix]
+        params = dict(id=str(center._id), direction=direction)
+        answer = service.request(params)
+        assert sorted(answer["matches"]) == sorted(_single(client, center, searchspace))
+        total += len(answer["matches"])
+    assert total > 0
+
+
+def test_request_by_position(client, service):
+    center = gm.get_tropomi(client).iloc[3]
+    params = dict(
+        lat=str(center.lat), lon=str(center.lon), time=center.name.isoformat(), km="50"
+    )
+    answer = service.request(params)
+    assert answer["source"] is None
+    assert answer["matches"] == _single(client, center, "IASI", 50.0)
+
+
+def _get(server, path):
+    if isinstance(server.server_address, str):
+        conn = http.client.HTTPConnection("localhost")
+        conn.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.sock.connect(server.server_address)
+    else:
+        conn = http.client.HTTPConnection(*server.server_address)
+    conn.request("GET", path)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+@pytest.mark.parametrize("unix", [False, True])
+def test_server(client, service, tmp_path, unix):
+    if unix:
+        server = serve.make_server(service, socket=str(tmp_path / "geomatch.sock"))
+    else:
+        server = serve.make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        ids = [str(x) for x in gm.get_tropomi(client)._id]
+        with ThreadPoolExecutor(8) as pool:
+            answers = list(pool.map(lambda x: _get(server, f"/match?id={x}"), ids))
+        assert [a["source"] for _, a in answers] == ids
+        assert all(status == 200 for status, _ in answers)
+        assert answers[5][1] == service.request(dict(id=ids[5]))
+
+        assert _get(server, "/health") == (200, dict(TROPOMI=50, IASI=500))
+        assert _get(server, "/match?id=0")[0] == 404
+        assert _get(server, "/match?lat=1")[0] == 400
+        assert _get(server, "/match?id=x&direction=IASI-IASI")[0] == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+SERVE_ONCE = """
+import http.client
+import threading
+from datetime import timedelta
+from geomatch import bench, serve, testing
+from geomatch import haversine as hv
+
+warm_up, hv.warm_up = hv.warm_up, lambda: None  # the collection warms up too
+client = testing.memory_client(
+    bench.synthetic_documents(50, seed=0), bench.synthetic_documents(200, seed=1)
+)
+hv.warm_up = warm_up
+service = serve.MatchService.from_client(client, 500.0, timedelta(hours=6))
+server = serve.make_server(service, port=0)
+thread = threading.Thread(target=server.serve_forever, daemon=True)
+thread.start()
+conn = http.client.HTTPConnection(*server.server_address)
+conn.request("GET", "/match?id=" + str(service.frames["TROPOMI"]._id.iloc[0]))
+assert conn.getresponse().status == 200
+server.shutdown()
+server.server_close()
+"""
+
+
+def test_server_exits(tmp_path, monkeypatch):
+    # the kernels run in handler threads, the TBB layer hung at exit without warm up
+    monkeypatch.setenv("GEOMATCH_CACHE_DIR", str(tmp_path))
+    assert run_fresh(SERVE_ONCE).returncode == 0
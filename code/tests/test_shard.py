@@ -0,0 +1,108 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from conftest import make_documents
+
+from geomatch import geomatch as gm
+from geomatch import parallel as par
+from geomatch import shard
+
+distance_km = 160.934
+delta = timedelta(hours=6)
+
+
+def _as_sets(result):
+    return {k: set(v) for x in result["matches"] for k, v in x.items()}
+
+
+def test_parse_shard():
+    assert shard.parse_shard("2/3") == (2, 3)
+    for text in ["0/3", "4/3", "1", "a/b"]:
+        with pytest.raises(ValueError):
+            shard.parse_shard(text)
+
+
+@pytest.mark.parametrize("n", [1, 3, 7])
+def test_merged_shards_match_batch(client, tmp_path, n):
+    paths = []
+    for i in range(1, n + 1):
+        paths.append(tmp_path / f"matches.{i}.json")
+        shard.parallel_shard(
+            client, "TROPOMI", "IASI", distance_km, delta, (i, n), paths[-1]
+        )
+    result = shard.merge(paths[::-1], tmp_path / "matches.json")
+
+    source = gm.get_tropomi(client, cache=False)
+    candidates = gm.get_iasi(client, cache=False)
+    expected = par.parallel_batch(source, candidates, distance_km, delta)
+    assert len(result["matches"]) == source.index.size
+    assert _as_sets(result) == _as_sets(expected)
+    with open(tmp_path / "matches.json") as f:
+        assert json.load(f) == shard.merge(paths)
+
+
+def test_merge_incomplete_shards(client, tmp_path):
+    path = tmp_path / "matches.1.json"
+    shard.parallel_shard(client, "TROPOMI", "IASI", distance_km, delta, (1, 2), path)
+    with pytest.raises(ValueError):
+        shard.merge([path])
+
+
+def _run_shards(client, tmp_path, n):
+    paths = [tmp_path / f"matches.{i}.json" for i in range(1, n + 1)]
+    for i, path in enumerate(paths, 1):
+        shard.parallel_shard(
+            client, "TROPOMI", "IASI", distance_km, delta, (i, n), path
+        )
+    return paths
+
+
+def _edit(path, **changes):
+    with open(path) as f:
+        part = json.load(f)
+    part.update(changes)
+    with open(path, "w") as f:
+        json.dump(part, f)
+
+
+def test_partial_records_extent(client, tmp_path):
+    path = _run_shards(client, tmp_path, 2)[1]
+    with open(path) as f:
+        part = json.load(f)
+    times = gm.get_tropomi(client, cache=False).index
+    assert part["start"] == times.min().isoformat()
+    assert part["stop"] == part["bounds"][1] == times.max().isoformat()
+
+
+def test_merge_rejects_data_ingested_between_shards(client, tmp_path):
+    first = _run_shards(client, tmp_path, 2)[0]
+    later = make_documents(5, 2, start=datetime(2023, 6, 5))
+    client["TROPOMI"].v0.insert_many(later)
+    (tmp_path / "later").mkdir()
+    second = _run_shards(client, tmp_path / "later", 2)[1]
+    with pytest.raises(ValueError, match="time extents"):
+        shard.merge([first, second])
+
+
+def test_merge_rejects_gaps_and_duplicates(client, tmp_path):
+    paths = _run_shards(client, tmp_path, 2)
+    with open(paths[0]) as f:
+        part = json.load(f)
+    _edit(paths[1], matches=part["matches"][:1])
+    with pytest.raises(ValueError, match="more than one shard"):
+        shard.merge(paths)
+    _edit(paths[1], bounds=[part["start"], part["stop"]])
+    with pytest.raises(ValueError, match="do not tile"):
+        shard.merge(paths)
+
+
+def test_merge_rejects_partials_without_extent(client, tmp_path):
+    paths = _run_shards(client, tmp_path, 1)
+    with open(paths[0]) as f:
+        part = json.load(f)
+    del part["start"], part["stop"], part["bounds"]
+    with open(paths[0], "w") as f:
+        json.dump(part, f)
+    with pytest.raises(ValueError, match="no time extent"):
+        shard.merge(paths)
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from geomatch import haversine as hv
+from geomatch import spatial
+
+rng = np.random.default_rng(42)
+lats = np.degrees(np.arcsin(rng.uniform(-1, 1, 20_000)))
+lons = rng.uniform(-180, 180, 20_000)
+index = spatial.GridIndex(lats, lons)
+
+
+@pytest.mark.parametrize("distance_km", [20.0, 160.934, 3_000.0, 25_000.0])
+@pytest.mark.parametrize(
+    "lat, lon",
+    [(0.0, 0.0), (48.8566, 2.3522), (89.9, 10.0), (-89.5, -170.0), (10.0, 179.9)],
+)
+def test_query_equals_brute_force(lat, lon, distance_km):
+    expected = np.flatnonzero(hv.haversine_par(lats, lons, lat, lon, distance_km))
+    result = index.query(lat, lon, distance_km)
+    assert np.array_equal(result, expected)
+
+
+def test_query_crosses_dateline():
+    grid = spatial.GridIndex(np.array([0.0, 0.0, 0.0]), np.array([179.9, -179.9, 0]))
+    assert grid.query(0.0, 180.0, 50.0).tolist() == [0, 1]
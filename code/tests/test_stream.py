@@ -0,0 +1,62 @@
+import json
+from datetime import timedelta
+
+import pytest
+
+from geomatch import geomatch as gm
+from geomatch import parallel as par
+from geomatch import stream
+
+distance_km = 160.934
+delta = timedelta(hours=6)
+
+
+@pytest.mark.parametrize("chunk", [timedelta(hours=1), timedelta(hours=10)])
+def test_stream_matches_batch(client, tmp_path, chunk):
+    output = tmp_path / "matches.json"
+    n = stream.parallel_stream(
+        client, "TROPOMI", "IASI", distance_km, delta, output, chunk
+    )
+    source = gm.get_tropomi(client, cache=False)
+    candidates = gm.get_iasi(client, cache=False)
+    expected = par.parallel_batch(source, candidates, distance_km, delta)
+
+    with open(output) as f:
+        result = json.load(f)
+    assert n == source.index.size
+    assert result == expected
+
+
+def test_match_writer_empty(tmp_path):
+    output = tmp_path / "matches.json"
+    with gm.MatchWriter(output, distance_km, delta):
+        pass
+    with open(output) as f:
+        assert json.load(f) == dict(
+            distance="160.934 km", delta="360.0 min", matches=[]
+        )
+
+
+@pytest.mark.parametrize("percentage", [0.0, 0.3, 1.0])
+def test_stream_respects_percentage(client, tmp_path, percentage):
+    output = tmp_path / "matches.json"
+    n = stream.parallel_stream(
+        client,
+        "TROPOMI",
+        "IASI",
+        distance_km,
+        delta,
+        output,
+        timedelta(hours=7),
+        percentage,
+    )
+    source = gm.get_tropomi(client, cache=False)
+    candidates = gm.get_iasi(client, cache=False)
+    start, stop = source.index[0], source.index[-1]
+    source = source[source.index <= start + (stop - start) * percentage]
+    expected = par.parallel_batch(source, candidates, distance_km, delta)
+
+    with open(output) as f:
+        result = json.load(f)
+    assert n == source.index.size
+    assert result == expected
@@ -0,0 +1,69 @@
+import csv
+import json
+from datetime import timedelta
+
+import pytest
+from click.testing import CliRunner
+
+from geomatch import edges
+from geomatch import geomatch as gm
+from geomatch import parallel as par
+from geomatch import thresholds as th
+from geomatch.cli import cli
+
+settings = [
+    (d, timedelta(minutes=t)) for d in (20.0, 100.0, 160.934) for t in (60, 120, 360)
+]
+
+
+@pytest.fixture
+def frames(client):
+    return gm.get_tropomi(client, cache=False), gm.get_iasi(client, cache=False)
+
+
+@pytest.fixture
+def output(frames, tmp_path):
+    path = tmp_path / "thresholds"
+    rows = th.run_sweep(*frames, settings, path)
+    return path, rows
+
+
+def test_combinations_match_direct_runs(frames, output):
+    path, rows = output
+    meta, arrays = edges.read_edges(path)
+    for (distance_km, delta), row in zip(settings, rows):
+        expected = par.parallel_batch(*frames, distance_km, delta)
+        assert th.to_matches(meta, arrays, distance_km, delta) == expected
+        found = [v for x in expected["matches"] for v in x.values()]
+        assert row["matches"] == sum(len(x) for x in found)
+        assert row["sources"] == sum(1 for x in found if x)
+    assert rows[-1]["matches"] > rows[0]["matches"]
+
+
+def test_select_rejects_larger_thresholds(output):
+    meta, arrays = edges.read_edges(output[0])
+    with pytest.raises(ValueError):
+        th.select(meta, arrays, 200.0, timedelta(hours=6))
+    with pytest.raises(ValueError):
+        th.select(meta, arrays, 20.0, timedelta(hours=7))
+
+
+def test_write_summary(output, tmp_path):
+    th.write_summary(tmp_path / "summary.csv", output[1])
+    with open(tmp_path / "summary.csv") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == len(settings)
+    assert int(rows[0]["matches"]) == output[1][0]["matches"]
+
+
+def test_cli_select(frames, output, tmp_path):
+    target = tmp_path / "matches.json"
+    args = ["-k", "100", "-m", "120", "select", str(output[0]), "-o", str(target)]
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    with open(target) as f:
+        found = json.load(f)
+    assert found == par.parallel_batch(*frames, 100.0, timedelta(minutes=120))
+
+    args = ["-k", "300", "select", str(output[0]), "-o", str(target)]
+    assert CliRunner().invoke(cli, args).exit_code == 2